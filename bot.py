@@ -1,20 +1,34 @@
 from src.services.monitor_service import MonitorService
-from src.services.bot import bot, db, loop
+from src.services.monitor_store import migrate_monitor_documents
+from src.services.schema import ensure_indexes
+from src.services.chat_sync import ChatSync
 from src.services.monitor_signal import SignalService
+from src.services.compute import compute_executor
+from src.services.leader import LeaderLease
+from src.services.sharding import ShardManager
+from src.core.config import settings
 import asyncio
 
 import asyncio
 import signal as sys_signal
 import sys
 
+from pymongo.errors import PyMongoError
 
-async def shutdown(signal, loop, monitor, signal_service):
+
+async def shutdown(signal, loop, services, lease):
     """Cleanup tasks tied to the service's shutdown."""
     print(f"Received exit signal {signal.name}...")
 
     # First stop the services to prevent new task creation
-    await monitor.stop_monitoring()
-    await signal_service.stop_monitoring()
+    for service in services:
+        await service.stop_monitoring()
+    compute_executor.shutdown()
+    # Let a standby replica take over without waiting for the lease to expire
+    try:
+        await lease.release()
+    except PyMongoError as e:
+        print(f"Error releasing the leader lease: {e}")
 
     # Get all running tasks except the shutdown task itself
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
@@ -35,23 +49,76 @@ async def shutdown(signal, loop, monitor, signal_service):
 
 
 async def main():
+    # Imported here: it logs the Telegram client in, and the spawned shard
+    # and compute processes import this module again as __mp_main__
+    from src.services.bot import bot, config_cache, db, outbound, signal_cache
+
+    loop = asyncio.get_running_loop()
+
+    # Indexes, and the per-chat alert documents split before anything reads them
+    await ensure_indexes(db)
+    await migrate_monitor_documents(db)
+
     # Create the services
-    monitor = MonitorService(db, bot)
-    signal_service = SignalService(db, bot)
+    if settings.monitor_workers:
+        # The monitors run in worker processes, this one serves Telegram
+        shards = ShardManager(outbound, config_cache)
+        services = [shards]
+    else:
+        monitor = MonitorService(db, bot, config_cache, outbound)
+        signal_service = SignalService(db, bot, signal_cache, outbound)
+        services = [monitor, signal_service]
+
+    # Every replica serves commands, only the leader runs the monitors and
+    # picks up the edits the others made
+    chat_sync = ChatSync(db, config_cache)
+    services.append(chat_sync)
+    lease = LeaderLease(db, ttl=settings.leader_lease_seconds)
+    monitor_tasks = []
+
+    async def start_services():
+        # Before the indexes are loaded, see ChatSync.baseline
+        await chat_sync.start_monitoring()
+        if settings.monitor_workers:
+            shards.start(settings.monitor_workers)
+        else:
+            monitor_tasks.append(
+                asyncio.create_task(signal_service.start_monitoring())
+            )
+            monitor_tasks.append(asyncio.create_task(monitor.start_monitoring()))
+
+    async def stop_services():
+        for service in services:
+            await service.stop_monitoring()
+        for task in monitor_tasks:
+            task.cancel()
+        monitor_tasks.clear()
 
     # Setup shutdown handler
     for sig in (sys_signal.SIGTERM, sys_signal.SIGINT):
         loop.add_signal_handler(
             sig,
-            lambda s=sig: asyncio.create_task(
-                shutdown(s, loop, monitor, signal_service)
-            ),
+            lambda s=sig: asyncio.create_task(shutdown(s, loop, services, lease)),
         )
 
+    leader_task = None
+
+    def start_lease():
+        # Start the monitoring services once this replica is the leader
+        nonlocal leader_task
+        leader_task = asyncio.create_task(lease.run(start_services, stop_services))
+        leader_task.add_done_callback(restart_lease)
+
+    def restart_lease(task: asyncio.Task):
+        # LeaderLease.run never returns, an exit is a bug, not a reason for
+        # this replica to stop competing for the monitors
+        if task.cancelled():
+            return
+        print(f"Leader lease loop exited with {task.exception()!r}, restarting")
+        start_lease()
+
     try:
-        # Start the monitoring services
-        monitoring_task = asyncio.create_task(signal_service.start_monitoring())
-        monitor_task = asyncio.create_task(monitor.start_monitoring())
+        start_lease()
 
         # Run the bot
         await bot.run_until_disconnected()
@@ -60,10 +127,14 @@ async def main():
         print(f"Error occurred: {e}")
         raise
     finally:
-        await shutdown(sys_signal.SIGTERM, loop, monitor, signal_service)
+        leader_task.remove_done_callback(restart_lease)
+        leader_task.cancel()
+        await shutdown(sys_signal.SIGTERM, loop, services, lease)
 
 
 if __name__ == "__main__":
+    from src.services.bot import loop
+
     while True:
         try:
             loop.run_until_complete(main())
@@ -14,5 +14,17 @@ class Config(BaseSettings):
     bot_token: str
     db_url: str
 
+    # Pool for the CPU bound analytics: "thread" or "process"
+    compute_executor: str = "thread"
+    compute_workers: int | None = None
+    compute_batch_size: int = 16
+
+    # Worker processes for MonitorService and SignalService, each serving a
+    # shard of the chats. 0 runs them in the Telegram process
+    monitor_workers: int = 0
+    # Seconds without heartbeat after which another replica takes over the
+    # background monitors
+    leader_lease_seconds: int = 30
+
 
 settings = Config()
@@ -269,3 +269,20 @@ def viewable_signal(df):
         lambda row: row["high"] * 1.01 if row["signal_down"] else np.nan, axis=1
     )
     return df
+
+
+def latest_kernel_signal(data, bandwidth=14, kernel_type="laplace"):
+    """
+    Signal of the last closed candle, as read by SignalService
+
+    Parameters:
+        data (np.array): Close prices, the last one from the still open candle
+        bandwidth (int): Kernel bandwidth
+        kernel_type (str): Type of kernel to use
+
+    Returns:
+        tuple: (signal_up, signal_down) of the second to last candle
+    """
+    mkr = MultiKernelRegression(bandwidth, kernel_type, repaint=True)
+    _, _, _, up_signals, down_signals = mkr.calculate(np.asarray(data, dtype=float))
+    return bool(up_signals[-2]), bool(down_signals[-2])
@@ -0,0 +1,188 @@
+from bisect import bisect_left, bisect_right
+from uuid import uuid4
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+
+class AlertIndex:
+    """
+    Price alerts of every chat, kept sorted by target price per symbol
+
+    The alerts whose target lies in a price range are found by bisection in
+    O(log n + k). The index is loaded once at startup and then kept in sync
+    by MonitorService.add_monitor / update_monitor / delete_monitor, so
+    evaluating a price never queries the database.
+    """
+
+    def __init__(self):
+        self.targets: dict[str, list[float]] = {}
+        # (chat_id, alert) pairs, in the same order as targets
+        self.entries: dict[str, list[tuple[int, dict]]] = {}
+        self.chats: dict[int, list[dict]] = {}
+        # alert_id -> (chat_id, alert)
+        self.by_id: dict[str, tuple[int, dict]] = {}
+        # Called with (chat_id, alerts) on every edit made by a user
+        self.subscribers: list = []
+
+    async def load(self, db: AsyncIOMotorDatabase, owns=None):
+        """Load the alerts of every chat, or of the chats `owns` is true for"""
+        self.targets.clear()
+        self.entries.clear()
+        self.chats.clear()
+        self.by_id.clear()
+        chats = {}
+        async for doc in db.price_alerts.find(
+            {},
+            {
+                "chat_id": 1,
+                "symbol": 1,
+                "price": 1,
+                "msg": 1,
+                "state": 1,
+                "trigger_count": 1,
+            },
+        ):
+            if owns is None or owns(doc["chat_id"]):
+                doc["alert_id"] = doc.pop("_id")
+                chats.setdefault(doc.pop("chat_id"), []).append(doc)
+        for chat_id, alerts in chats.items():
+            self.replace_chat(chat_id, alerts)
+
+    def update_chat(self, chat_id: int, alerts: list[dict]):
+        """replace_chat for an edit made by the user, passed on to the subscribers"""
+        self.replace_chat(chat_id, alerts)
+        for subscriber in self.subscribers:
+            subscriber(chat_id, alerts)
+
+    def replace_chat(self, chat_id: int, alerts: list[dict]):
+        """Index the current alert list of a chat, replacing its previous one"""
+        self.remove_chat(chat_id)
+        alerts = [dict(alert) for alert in alerts]
+        if alerts:
+            self.chats[chat_id] = alerts
+        for alert in alerts:
+            targets = self.targets.setdefault(alert["symbol"], [])
+            entries = self.entries.setdefault(alert["symbol"], [])
+            i = bisect_right(targets, float(alert["price"]))
+            targets.insert(i, float(alert["price"]))
+            entries.insert(i, (chat_id, alert))
+            if "alert_id" in alert:
+                self.by_id[alert["alert_id"]] = (chat_id, alert)
+
+    def remove_chat(self, chat_id: int):
+        for alert in self.chats.pop(chat_id, []):
+            self.by_id.pop(alert.get("alert_id"), None)
+            symbol = alert["symbol"]
+            targets = self.targets[symbol]
+            entries = self.entries[symbol]
+            target = float(alert["price"])
+            for i in range(bisect_left(targets, target), bisect_right(targets, target)):
+                if entries[i][1] is alert:
+                    del targets[i]
+                    del entries[i]
+                    break
+            if not targets:
+                del self.targets[symbol]
+                del self.entries[symbol]
+
+    def get(self, alert_id: str) -> tuple[int, dict] | None:
+        """(chat_id, alert) of an alert id, None if it was deleted"""
+        return self.by_id.get(alert_id)
+
+    def chat_alerts(self, chat_id: int) -> list[dict]:
+        return self.chats.get(chat_id, [])
+
+    def symbols(self) -> list[str]:
+        return list(self.targets)
+
+    def query(self, symbol: str, low: float, high: float) -> list[tuple[int, dict]]:
+        """(chat_id, alert) pairs of the symbol with a target in [low, high]"""
+        targets = self.targets.get(symbol)
+        if not targets:
+            return []
+        return self.entries[symbol][
+            bisect_left(targets, low) : bisect_right(targets, high)
+        ]
+
+    def near(
+        self, symbol: str, low: float, high: float, tolerance: float
+    ) -> list[tuple[int, dict]]:
+        """
+        Alerts that a price range [low, high] comes within tolerance of
+
+        An alert with target T is hit when the range meets
+        [T * (1 - tolerance), T * (1 + tolerance)], i.e. when T lies in
+        [low / (1 + tolerance), high / (1 - tolerance)].
+        """
+        upper = high / (1 - tolerance) if tolerance < 1 else float("inf")
+        return self.query(symbol, low / (1 + tolerance), upper)
+
+    def distance(self, symbol: str, price: float) -> float:
+        """Relative distance from the price to the nearest target of the symbol"""
+        targets = self.targets.get(symbol)
+        if not targets:
+            return float("inf")
+        i = bisect_left(targets, price)
+        return min(
+            abs(price - target) / target for target in targets[max(i - 1, 0) : i + 1]
+        )
+
+    def __len__(self):
+        return sum(len(targets) for targets in self.targets.values())
+
+
+def new_alert_id() -> str:
+    return uuid4().hex
+
+
+alert_index = AlertIndex()
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(1)
+    index = AlertIndex()
+    symbols = [f"COIN{i}/USDT" for i in range(50)]
+    for chat_id in range(20000):
+        index.replace_chat(
+            chat_id,
+            [
+                {"symbol": random.choice(symbols), "price": random.uniform(1, 100)}
+                for _ in range(5)
+            ],
+        )
+    # Editing a chat must leave no stale entry behind
+    index.replace_chat(0, [{"symbol": "COIN0/USDT", "price": 50.0}])
+    index.remove_chat(1)
+    assert len(index) == sum(len(alerts) for alerts in index.chats.values())
+
+    flat = [
+        (chat_id, alert) for chat_id, alerts in index.chats.items() for alert in alerts
+    ]
+    low, high, tolerance = 49.0, 51.0, 0.01
+
+    start = time.perf_counter()
+    for _ in range(100):
+        expected = [
+            (chat_id, alert)
+            for chat_id, alert in flat
+            if alert["symbol"] == "COIN0/USDT"
+            and alert["price"] * (1 - tolerance) <= high
+            and alert["price"] * (1 + tolerance) >= low
+        ]
+    scan_time = (time.perf_counter() - start) / 100
+
+    start = time.perf_counter()
+    for _ in range(100):
+        found = index.near("COIN0/USDT", low, high, tolerance)
+    index_time = (time.perf_counter() - start) / 100
+
+    assert sorted(id(alert) for _, alert in found) == sorted(
+        id(alert) for _, alert in expected
+    )
+    print(
+        f"{len(index)} alerts, {len(found)} hit: scan {scan_time * 1000:.2f} ms, "
+        f"index {index_time * 1000:.4f} ms ({scan_time / index_time:.0f}x)"
+    )
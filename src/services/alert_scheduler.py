@@ -0,0 +1,165 @@
+import math
+import time
+
+MIN_CHECK_INTERVAL = 15  # Seconds, for alerts that could trigger right away
+MAX_CHECK_INTERVAL = 30 * 60  # Seconds, for alerts far from the price
+MAX_RETRY_INTERVAL = 5 * 60  # Seconds, backoff cap after failed fetches
+REQUEST_BUDGET = 120  # Candle requests per minute, all symbols together
+VOLATILITY_CANDLES = 30  # 1m candles the volatility is averaged over
+# Longest range evaluated after a long pause (alert_interval, restart)
+MAX_RANGE_CANDLES = 500
+# A target further than this many standard deviations of the move until the
+# next check is considered out of reach until then
+REACH_SIGMAS = 4
+
+
+class RequestBudget:
+    """Token bucket capping the request rate, with bursts of a quarter minute"""
+
+    def __init__(self, per_minute: int = REQUEST_BUDGET):
+        self.rate = per_minute / 60
+        self.capacity = max(per_minute / 4, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, requested: int) -> int:
+        """Grant up to `requested` requests, return how many were granted"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        granted = min(requested, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+
+class AlertScheduler:
+    """
+    Decides when the price of every alerted symbol has to be checked again
+
+    The per-minute volatility of every symbol is estimated from the high/low
+    of its 1m candles (Parkinson estimator, exponentially weighted). The
+    next check is scheduled for when the price could first have moved
+    REACH_SIGMAS standard deviations toward the nearest alert, so symbols
+    with a close alert are checked often and the others rarely.
+    """
+
+    def __init__(self, budget: int = REQUEST_BUDGET):
+        self.budget = RequestBudget(budget)
+        self.next_check: dict[str, float] = {}
+        self.last_check: dict[str, float] = {}
+        self.variance: dict[str, float] = {}
+        # Consecutive failed fetches of a symbol, for the retry backoff
+        self.failures: dict[str, int] = {}
+
+    def snapshot(self) -> list:
+        """[symbol, next_check, last_check, variance] rows, times are wall clock"""
+        return [
+            [
+                symbol,
+                next_check,
+                self.last_check.get(symbol),
+                self.variance.get(symbol),
+            ]
+            for symbol, next_check in self.next_check.items()
+        ]
+
+    def restore(self, rows: list):
+        for symbol, next_check, last_check, variance in rows:
+            self.next_check[symbol] = next_check
+            if last_check is not None:
+                self.last_check[symbol] = last_check
+            if variance is not None:
+                self.variance[symbol] = variance
+
+    def due(self, symbols: set[str], now: float | None = None) -> tuple[list, int]:
+        """
+        Symbols to check now, most overdue first, within the request budget
+
+        Returns:
+            tuple: (symbols to check, number of due symbols deferred)
+        """
+        now = time.time() if now is None else now
+        due = sorted(
+            (symbol for symbol in symbols if self.next_check.get(symbol, 0) <= now),
+            key=lambda symbol: self.next_check.get(symbol, 0),
+        )
+        granted = self.budget.take(len(due))
+        return due[:granted], len(due) - granted
+
+    def forget(self, keep):
+        """Drop the symbols not in `keep`, the ones nobody has an alert on"""
+        for symbol in set(self.next_check) - set(keep):
+            self.next_check.pop(symbol)
+            self.last_check.pop(symbol, None)
+            self.variance.pop(symbol, None)
+            self.failures.pop(symbol, None)
+
+    def candles_since(self, symbol: str) -> tuple[int | None, int]:
+        """(since in ms, limit) of the 1m candles covering the time since the last check"""
+        last_check = self.last_check.get(symbol)
+        if last_check is None:
+            return None, VOLATILITY_CANDLES
+        now = time.time()
+        since = max(
+            int(last_check // 60) * 60,
+            int(now // 60) * 60 - (MAX_RANGE_CANDLES - 1) * 60,
+        )
+        return since * 1000, int((now - since) // 60) + 1
+
+    def update_volatility(self, symbol: str, highs, lows):
+        alpha = 2 / (VOLATILITY_CANDLES + 1)
+        variance = self.variance.get(symbol)
+        for high, low in zip(highs, lows):
+            if low <= 0:
+                continue
+            sample = math.log(high / low) ** 2 / (4 * math.log(2))
+            variance = (
+                sample if variance is None else variance + alpha * (sample - variance)
+            )
+        if variance is not None:
+            self.variance[symbol] = variance
+
+    def schedule(self, symbol: str, distance: float, now: float | None = None) -> float:
+        """
+        Schedule the next check of a symbol
+
+        Args:
+            symbol: Symbol that was just checked
+            distance: Relative distance from the price to the nearest alert
+                band, 0 when the price is inside one
+            now: Time of the check
+
+        Returns:
+            float: Seconds until the next check
+        """
+        now = time.time() if now is None else now
+        sigma = math.sqrt(self.variance.get(symbol, 0.0))
+        if distance <= 0:
+            interval = MIN_CHECK_INTERVAL
+        elif sigma == 0:
+            interval = MAX_CHECK_INTERVAL
+        else:
+            minutes = (distance / (REACH_SIGMAS * sigma)) ** 2
+            interval = min(max(minutes * 60, MIN_CHECK_INTERVAL), MAX_CHECK_INTERVAL)
+        self.last_check[symbol] = now
+        self.next_check[symbol] = now + interval
+        self.failures.pop(symbol, None)
+        return interval
+
+    def retry(self, symbol: str, now: float | None = None) -> float:
+        """
+        Schedule another try after a failed fetch of a symbol
+
+        last_check is kept, so the next fetch still covers the whole range
+        since the last successful check. The delay doubles from
+        MIN_CHECK_INTERVAL with every consecutive failure.
+
+        Returns:
+            float: Seconds until the next try
+        """
+        now = time.time() if now is None else now
+        failures = self.failures.get(symbol, 0)
+        self.failures[symbol] = failures + 1
+        interval = min(MIN_CHECK_INTERVAL * 2**failures, MAX_RETRY_INTERVAL)
+        self.next_check[symbol] = now + interval
+        return interval
@@ -1,21 +1,39 @@
 import asyncio
 import copy
-from datetime import datetime
+from datetime import UTC, datetime
 import json
+import re
 import time
 from tabulate import tabulate
 from telethon import Button, TelegramClient, events
 from telethon.types import DocumentAttributeFilename
 import pandas as pd
 
+from src.services.backtest import FEE_RATE, run_backtest
+from src.services.compute import compute_executor
+from src.services.config_cache import ConfigCache
 from src.services.economic_calendar_table import final_table
 from src.services.monitor_service import MonitorService
-from src.services.indicators import quant_agent
+from src.services.indicator_state import IndicatorStateStore
+from src.services.indicator_engine import INDICATOR_WINDOW
+from src.services.indicators import confluence_analysis, resample_ohlcv
+from src.services.kernel_tuning import DEFAULT_BANDWIDTH, DEFAULT_KERNEL, kernel_params
 from src.services.monitor_signal import SignalService
+from src.services.monitor_store import AlertStore, SignalMonitorStore
+from src.services.outbound import INTERACTIVE, OutboundQueue
 from src.services.price_bot import CryptoPriceBot
+from src.services.signal_cache import SignalCache
+from src.services.subscription_index import SIGNAL_TIMEFRAMES
 from src.core.config import settings
 from src.services.sentiment_service import get_latest_sentiment
-from src.utils import format_price_message, symbol_complete
+from src.utils import (
+    SIGNAL_EMOJIS,
+    format_confluence_message,
+    format_price_message,
+    format_signal_message,
+    is_timeframe,
+    symbol_complete,
+)
 from src.core.db import motor_client
 
 START_MSG = (
@@ -29,16 +47,22 @@ START_MSG = (
     "\t E.g: /f 15m 1 \n"
     "/c or /chart - Get price chart for a cryptocurrency\n"
     "/s or /signal - Get trading signal for a cryptocurrency\n"
+    "\t E.g: /s BTC 4h, or /s BTC all for 15m/1h/4h/1d at once\n"
+    "/mon or /monitor - Get the signals of symbols on every candle close\n"
+    f"\t E.g: /mon BTC ETH 4h 1d, all of {'/'.join(SIGNAL_TIMEFRAMES)} by default\n"
+    "/pinbars - Scan the top 200 coins for pinbars on the last closed candle\n"
+    "\t E.g: /pinbars 4h\n"
+    "/backtest - Backtest the signals on historical data\n"
+    "\t E.g: /backtest BTC 4h\n"
     "/config - Configure the bot\n"
     "/ping - Check if the bot is online"
 )
 
-DEFAULT_CONFIG = {
-    "is_alert": "off",
-    "price_threshold": 0.01,
-    "alert_interval": 1,
-    "is_future": "off",
-}
+CONFLUENCE_BASE_TIMEFRAME = "15m"
+CONFLUENCE_TIMEFRAMES = ["15m", "1h", "4h", "1d"]
+# Fetched on their own, the base candles hold too few of them to fill the
+# INDICATOR_WINDOW that /signal uses on a single timeframe
+CONFLUENCE_FETCHED_TIMEFRAMES = ["4h", "1d"]
 
 PATTERN_TWO_ARGS = r"\s+([a-zA-Z]+)(?:\s+(\d+[mh]))?$"
 
@@ -49,15 +73,18 @@ bot: TelegramClient = TelegramClient(
 ).start(bot_token=settings.bot_token)
 
 db = motor_client["crypto"]
+compute_executor.configure(
+    settings.compute_executor, settings.compute_workers, settings.compute_batch_size
+)
+indicator_states = IndicatorStateStore(db)
+signal_cache = SignalCache(indicator_states)
+config_cache = ConfigCache(db)
+outbound = OutboundQueue(bot)
 
 
 # TODO: Should we use pydantic for this?
 async def get_config(chat_id: int) -> dict:
-    config = await db.config.find_one({"chat_id": chat_id})
-    if not config:
-        await db.config.insert_one({"chat_id": chat_id, **DEFAULT_CONFIG})
-        return await db.config.find_one({"chat_id": chat_id})
-    return config
+    return await config_cache.get(chat_id)
 
 
 @bot.on(events.NewMessage(pattern=r"^\/start$"))
@@ -67,10 +94,7 @@ async def send_welcome(event):
     # Check the config for the chat
     chat_id = event.chat_id
 
-    config = await db.config.find_one({"chat_id": chat_id})
-
-    if not config:
-        await db.config.insert_one({"chat_id": chat_id, **DEFAULT_CONFIG})
+    await get_config(chat_id)
 
     await event.reply(START_MSG)
 
@@ -82,7 +106,14 @@ async def send_help(event):
 
 @bot.on(events.NewMessage(pattern=r"^\/ping$"))
 async def echo_all(event):
-    await event.reply("pong")
+    stats = outbound.stats()
+    await event.reply(
+        f"pong\n"
+        f"Outbound queue: {stats['depth']} pending, {stats['sent']} sent, "
+        f"{stats['coalesced']} coalesced, {stats['failed']} failed\n"
+        f"Latency: {stats['avg_latency']}s avg, {stats['max_latency']}s max\n"
+        f"Flood waits: {stats['flood_waits']} ({stats['flood_wait_seconds']}s)"
+    )
 
 
 @bot.on(events.NewMessage(pattern=r"^\/config"))
@@ -100,7 +131,7 @@ async def config_command(event):
             return
         else:
             print_config = copy.deepcopy(config)
-            del print_config["_id"]
+            print_config.pop("_id", None)
             del print_config["chat_id"]
 
             await event.reply(
@@ -135,10 +166,7 @@ async def config_command(event):
         elif config_key == "alert_interval":
             config_value = int(config_value)
 
-        db.config.update_one(
-            {"chat_id": chat_id},
-            {"$set": {config_key: config_value}},
-        )
+        await config_cache.set(chat_id, config_key, config_value)
         await event.reply(f"✅ Configuration updated: {config_key} = {config_value}")
 
 
@@ -147,10 +175,7 @@ async def add_alert(event):
     args = event.message.message.split(" ")
     chat_id = event.chat_id
     if len(args) == 1:
-        query = await db.alerts.find_one({"chat_id": chat_id})
-        alerts = []
-        if query:
-            alerts = query.get("data", [])
+        alerts = await AlertStore(db).chat_alerts(chat_id)
 
         if not alerts:
             await event.reply("🔕 No alerts set")
@@ -215,14 +240,9 @@ async def delete_alert(event):
         await event.reply("⚠️ Invalid alert ID")
         return
     chat_id = event.chat_id
-    query = await db.alerts.find_one({"chat_id": chat_id})
-    alerts = query.get("data", [])
-
-    if not alerts:
-        await event.reply("🔕 No alerts set")
-        return
+    alert = await AlertStore(db).alert_at(chat_id, alert_id)
 
-    if alert_id < 1 or alert_id > len(alerts):
+    if alert is None:
         await event.reply("⚠️ Invalid alert ID")
         return
 
@@ -233,8 +253,8 @@ async def delete_alert(event):
             Button.inline("No", "delete_alert_no"),
         ]
     ]
-    symbol = alerts[alert_id - 1].get("symbol")
-    price = alerts[alert_id - 1].get("price")
+    symbol = alert.get("symbol")
+    price = alert.get("price")
     await event.reply(
         f"❓ Are you sure you want to delete alert ID {alert_id}: {symbol} - {price}?",
         buttons=keyboard,
@@ -269,7 +289,7 @@ async def callback_handler(event):
     await event.delete()
 
 
-@bot.on(events.NewMessage(pattern=r"^\/(?:p|price)"))
+@bot.on(events.NewMessage(pattern=r"^\/(?!pinbars\b)(?:p|price)"))
 async def price_command(event):
     try:
         # Check if symbol is provided
@@ -345,6 +365,42 @@ async def filter_command(event, timeframe: str = "15m", threshold: float = 1.0):
         await event.reply(f"❌ Error: {str(e)}")
 
 
+@bot.on(events.NewMessage(pattern=r"^\/pinbars"))
+async def pinbars_command(event):
+    try:
+        args = event.message.text.split()
+        timeframe = args[1].lower() if len(args) > 1 else "4h"
+        msg = await event.reply(f"🕯 Scanning pinbars on {timeframe}...")
+
+        start_time = time.time()
+        symbols = pd.read_csv("top_200_currencies.csv")["symbol"].tolist()
+        price_bot = CryptoPriceBot()
+        pinbars = await price_bot.scan_pinbars(symbols, timeframe)
+        await price_bot.close()
+
+        await msg.delete()
+        if not pinbars:
+            await event.reply(
+                f"⚪ No pinbar on the last closed {timeframe} candle "
+                f"of {len(symbols)} symbols"
+            )
+            return
+
+        pinbars.sort(key=lambda p: (p["side"] != "bullish", p["symbol"]))
+        message = f"🕯 Pinbars on the last closed {timeframe} candle:\n\n"
+        for pinbar in pinbars:
+            emoji = "🟢" if pinbar["side"] == "bullish" else "🔴"
+            message += (
+                f"{emoji} {pinbar['symbol']}: {pinbar['side']}, "
+                f"close ${pinbar['close']:,.4f}\n"
+            )
+        await event.reply(message)
+        print(f"Time taken: {time.time() - start_time}")
+
+    except Exception as e:  # noqa: BLE001 - reported to the user
+        await event.reply(f"❌ Error: {e}")
+
+
 @bot.on(events.NewMessage(pattern=r"^\/(?:c|chart)" + PATTERN_TWO_ARGS))
 async def chart_command(event):
     try:
@@ -375,6 +431,10 @@ async def chart_command(event):
             df_future, ft_exchange = await price_bot.fetch_future_ohlcv_data(
                 symbol, timeframe, 200
             )
+        # Same result as /signal, free when it was already computed this candle
+        result = None
+        if df is not None and not df.empty:
+            result = await signal_cache.get(price_bot, symbol, timeframe)
         await price_bot.close()
 
         if df is None or df.empty:
@@ -426,6 +486,8 @@ async def chart_command(event):
             f"Volume last 24h: ${volume_last_24h:,.2f}\n"
             f"Volume previous 24h: ${volume_previous_24h:,.2f}\t, change {'🟢' if volume_change >= 0 else '🔴'} {volume_change:,.2f}%\n"
         )
+        if result is not None:
+            caption += f"Signal: {SIGNAL_EMOJIS[result.overall]} {result.overall_name.upper()} ({result.confidence:.0%})\n"
 
         # Delete loading message and send chart
         await msg.delete()
@@ -503,28 +565,39 @@ async def signal_command(event):
         # Parse arguments
         symbol = symbol_complete(args[1].upper())
         timeframe = args[2].lower() if len(args) > 2 else "1h"
+        if timeframe != "all" and not is_timeframe(timeframe):
+            await event.reply(
+                f"⚠️ Unknown timeframe {timeframe}. Example: /signal btc 4h\n"
+                "Timeframes: minutes (15m), hours (1h, 4h), days (1d), weeks (1w) "
+                "or all\n"
+            )
+            return
 
         # Send loading message
         msg = await event.reply(f"🔎 Finding signal for {symbol}...")
 
-        # Get candle data and create chart
+        if timeframe == "all":
+            await send_confluence_signal(event, msg, symbol)
+            return
+
+        # Answer from the signal cache, the analysis only runs once per closed
+        # candle and the exchange is only queried for the new candles
         price_bot = CryptoPriceBot()
-        df, _ = await price_bot.fetch_ohlcv_data(symbol, timeframe)
+        result = await signal_cache.get(price_bot, symbol, timeframe)
         await price_bot.close()
 
-        if df is None or df.empty:
+        if result is None:
             await msg.edit(f"❌ Unable to fetch data for {symbol}")
             return
 
-        # Call indicators.py to get signals
-        signals = await quant_agent(df)
+        candle_time = datetime.fromtimestamp(result.candle_time / 1000, UTC)
 
         # Delete loading message and send chart
         await msg.delete()
         await event.reply(
             f"📈 Signals for {symbol} ({timeframe}):\n"
-            f"Current Price: ${df['close'].iloc[-1]:,.4f}\n"
-            f"\n\n{signals}",
+            f"Last close: ${result.close:,.4f} ({candle_time.strftime('%Y-%m-%d %H:%M')} UTC candle)\n"
+            f"\n\n{format_signal_message(result)}",
             parse_mode="html",
         )
 
@@ -532,6 +605,102 @@ async def signal_command(event):
         await event.reply(f"❌ Error: {str(e)}")
 
 
+async def send_confluence_signal(event, msg, symbol: str):
+    # One fine-grained fetch resampled locally, plus the longer timeframes
+    price_bot = CryptoPriceBot()
+    fetched = await asyncio.gather(
+        price_bot.fetch_ohlcv_data(symbol, CONFLUENCE_BASE_TIMEFRAME, 1000),
+        *(
+            price_bot.fetch_ohlcv_data(symbol, timeframe, INDICATOR_WINDOW + 1)
+            for timeframe in CONFLUENCE_FETCHED_TIMEFRAMES
+        ),
+    )
+    await price_bot.close()
+
+    base_df, exchange = fetched[0]
+    if any(df is None or df.empty for df, _ in fetched):
+        await msg.edit(f"❌ Unable to fetch data for {symbol}")
+        return
+
+    fetched_frames = dict(
+        zip(CONFLUENCE_FETCHED_TIMEFRAMES, (df for df, _ in fetched[1:]))
+    )
+    frames = {}
+    for timeframe in CONFLUENCE_TIMEFRAMES:
+        if timeframe == CONFLUENCE_BASE_TIMEFRAME:
+            frames[timeframe] = base_df
+        elif timeframe in fetched_frames:
+            frames[timeframe] = fetched_frames[timeframe]
+        else:
+            frames[timeframe] = resample_ohlcv(base_df, timeframe)
+    kernel_settings = {tf: kernel_params.get(symbol, tf) for tf in frames}
+    results = await compute_executor.run(
+        confluence_analysis, symbol, frames, kernel_settings, exchange
+    )
+
+    await msg.delete()
+    await event.reply(
+        f"📈 Signals for {symbol} on {exchange}:\n"
+        f"Last close: ${base_df['close'].iloc[-2]:,.4f}\n\n"
+        f"{format_confluence_message(results)}",
+        parse_mode="html",
+    )
+
+
+@bot.on(events.NewMessage(pattern=r"^\/backtest"))
+async def backtest_command(event):
+    try:
+        args = event.message.text.split()
+        if len(args) < 2 or len(args) > 3:
+            await event.reply("⚠️ Please provide a symbol. Example: /backtest BTC 4h\n")
+            return
+        symbol = symbol_complete(args[1].upper())
+        timeframe = args[2].lower() if len(args) > 2 else "4h"
+
+        msg = await event.reply(f"🧪 Backtesting {symbol} {timeframe}...")
+
+        price_bot = CryptoPriceBot()
+        df, exchange = await price_bot.fetch_ohlcv_history(symbol, timeframe)
+        await price_bot.close()
+
+        if df is None or df.empty:
+            await msg.edit(f"❌ Unable to fetch data for {symbol}")
+            return
+
+        # The last candle is still open
+        df = df.iloc[:-1]
+        params = [(DEFAULT_BANDWIDTH, DEFAULT_KERNEL)]
+        tuned = kernel_params.get(symbol, timeframe)
+        if tuned not in params:
+            params.append(tuned)
+        results = await compute_executor.run(run_backtest, {symbol: df}, params)
+
+        table_header = ["Strategy", "Trades", "Hit", "PnL", "MaxDD"]
+        table_body = [
+            [
+                strategy,
+                row["trades"],
+                f"{row['hit_rate']:.0%}",
+                f"{row['pnl']:+.1%}",
+                f"{row['max_drawdown']:.1%}",
+            ]
+            for (strategy, _), row in results.iterrows()
+        ]
+        result_table = tabulate(table_body, headers=table_header, tablefmt="pretty")
+
+        await msg.delete()
+        await event.reply(
+            f"🧪 Backtest {symbol} {timeframe} on {exchange}\n"
+            f"Period: {df.index[0].strftime('%Y-%m-%d')} - {df.index[-1].strftime('%Y-%m-%d')} ({len(df)} candles)\n"
+            f"Long only, fee {FEE_RATE:.1%} per side\n"
+            f"<pre>{result_table}</pre>",
+            parse_mode="HTML",
+        )
+
+    except Exception as e:  # noqa: BLE001 - reported to the user
+        await event.reply(f"❌ Error: {e}")
+
+
 @bot.on(events.NewMessage(pattern=r"^\/calendar"))
 async def get_all_economic_calendar(event):
     loc = final_table()
@@ -543,7 +712,7 @@ async def get_all_economic_calendar(event):
                     f"{row['Event']}\n"
                     f"Actual: {row['Actual']} | Forecast: {row['Forecast']} | Previous: {row['Previous']}"
                 )
-                await bot.send_message(event.chat_id, message)
+                outbound.send(event.chat_id, message, INTERACTIVE)
         except Exception as e:
             await event.reply(f"❌ Error: {str(e)}")
 
@@ -553,25 +722,43 @@ async def add_monitor_symbol(event):
     args = event.message.text.split()
     if len(args) == 1:
         # show list signals
-        query = await db.signals.find_one({"chat_id": event.chat_id})
-        if not query:
+        signals = await SignalMonitorStore(db).chat_monitors(event.chat_id)
+        if not signals:
             await event.reply("🔕 No signals set")
             return
 
-        signals = query.get("data", [])
         # list signals
         list_signals = "\n".join(
-            [f"{i + 1}. {signals[i]}" for i in range(len(signals))]
+            [
+                f"{i + 1}. {signal['symbol']} ({', '.join(signal['timeframes'])})"
+                for i, signal in enumerate(signals)
+            ]
         )
         await event.reply(f"🔔 Signals: \n{list_signals}")
         return
 
     chat_id = event.chat_id
-    symbols = [symbol_complete(args[i].upper()) for i in range(1, len(args))]
+    # Arguments like 15m or 4h are timeframes, the others symbols
+    timeframes = [arg.lower() for arg in args[1:] if re.fullmatch(r"\d+[mhdMHD]", arg)]
+    symbols = [
+        symbol_complete(arg.upper())
+        for arg in args[1:]
+        if not re.fullmatch(r"\d+[mhdMHD]", arg)
+    ]
+    invalid = [tf for tf in timeframes if tf not in SIGNAL_TIMEFRAMES]
+    if invalid or not symbols:
+        await event.reply(
+            f"⚠️ Please provide symbols and timeframes among "
+            f"{', '.join(SIGNAL_TIMEFRAMES)}, e.g. /mon BTC 4h"
+        )
+        return
 
-    added_id = await SignalService.add_monitor(db, chat_id, symbols, 0)
+    added_id = await SignalService.add_monitor(db, chat_id, symbols, timeframes)
     # Send confirmation message
-    await event.reply(f"✅ Monitor {added_id} set for {symbols}")
+    await event.reply(
+        f"✅ Monitor {added_id} set for {symbols} "
+        f"on {', '.join(timeframes or SIGNAL_TIMEFRAMES)}"
+    )
 
 
 @bot.on(events.NewMessage(pattern=r"^\/(?:delmon|delete_monitor)"))
@@ -587,8 +774,7 @@ async def delete_monitor_symbol(event):
         await event.reply("⚠️ Invalid monitor ID")
         return
     chat_id = event.chat_id
-    query = await db.signals.find_one({"chat_id": chat_id})
-    signals = query.get("data", [])
+    signals = await SignalMonitorStore(db).chat_monitors(chat_id)
 
     if not signals:
         await event.reply("🔕 No signals set")
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import time
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# Operations per bulk_write, and pending ones that start a flush
+BULK_BATCH_SIZE = 1000
+FLUSH_INTERVAL = 5  # Seconds an operation waits at most before a flush is started
+# Operations kept for a retry while Mongo is unreachable, the oldest are dropped
+MAX_PENDING = 20 * BULK_BATCH_SIZE
+
+
+class BulkWriter:
+    """
+    Buffers writes to a collection and sends them as unordered bulk_writes
+
+    update_one calls on the same filter are merged into one operation (the
+    fields of each operator overwritten by the later call), so each
+    document is written at most once per flush. A flush is started in the background once
+    BULK_BATCH_SIZE operations are pending or, when one is added, the oldest
+    waited FLUSH_INTERVAL seconds. flush() writes everything now, e.g. at
+    the end of a cycle. Batches are unordered, so the operations of one
+    flush may be applied in any order.
+
+    An operation rejected by Mongo is reported and dropped, the others of
+    its batch are still applied. A batch that fails as a whole (network,
+    failover) is retried first thing on the next flush, in its own batches
+    so newer updates of the same documents are applied after it. Part of it
+    may already have been applied, and the server does not say which, so
+    the operations must be idempotent: $set the computed value rather than
+    $inc it.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        batch_size: int = BULK_BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Filter key -> (filter, update, upsert) of the merged update_one calls
+        self._updates: dict[str, tuple[dict, dict, bool]] = {}
+        self._requests: list = []
+        self._retries: list = []
+        self._oldest: float | None = None
+        self._flushing: asyncio.Task | None = None
+        self.flushes = 0
+        self.batches = 0
+        self.operations = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._updates) + len(self._requests) + len(self._retries)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        """Queue an update of one document, merged with the pending ones on it"""
+        key = json.dumps(filter, sort_keys=True, default=str)
+        pending = self._updates.get(key)
+        if pending is None:
+            self._updates[key] = (
+                filter,
+                {op: dict(fields) for op, fields in update.items()},
+                upsert,
+            )
+        else:
+            merged = pending[1]
+            for op, fields in update.items():
+                target = merged.setdefault(op, {})
+                target.update(fields)
+            self._updates[key] = (filter, merged, pending[2] or upsert)
+        self._added()
+
+    def add(self, request):
+        """Queue any pymongo write operation (UpdateMany, InsertOne...) as is"""
+        self._requests.append(request)
+        self._added()
+
+    def _added(self):
+        now = time.monotonic()
+        if self._oldest is None:
+            self._oldest = now
+        if len(self) >= self.batch_size or now - self._oldest >= self.flush_interval:
+            self._start_flush()
+
+    def _start_flush(self):
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.create_task(self._flush())
+
+    def _take(self) -> list[list]:
+        """The pending operations, split into batches"""
+        requests = [
+            UpdateOne(filter, update, upsert=upsert)
+            for filter, update, upsert in self._updates.values()
+        ]
+        requests.extend(self._requests)
+        batches = [
+            pending[start : start + self.batch_size]
+            for pending in (self._retries, requests)
+            for start in range(0, len(pending), self.batch_size)
+        ]
+        self._updates = {}
+        self._requests = []
+        self._retries = []
+        self._oldest = None
+        return batches
+
+    async def flush(self) -> dict:
+        """
+        Write everything pending, waiting for a flush already running
+
+        Returns:
+            dict: operations, batches (round trips) and errors of this flush
+        """
+        if self._flushing is not None and not self._flushing.done():
+            await self._flushing
+        return await self._flush()
+
+    async def _flush(self) -> dict:
+        batches = self._take()
+        stats = {"operations": 0, "batches": 0, "errors": 0}
+        for i, batch in enumerate(batches):
+            stats["batches"] += 1
+            try:
+                await self.collection.bulk_write(batch, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    print(
+                        f"Error writing to {self.collection.name}: "
+                        f"{batch[error['index']]}: {error.get('errmsg')}"
+                    )
+                stats["errors"] += len(e.details.get("writeErrors", []))
+            except PyMongoError as e:
+                print(
+                    f"Error writing {len(batch)} operations to "
+                    f"{self.collection.name}, retried on the next flush: {e}"
+                )
+                self._retry([request for rest in batches[i:] for request in rest])
+                break
+            stats["operations"] += len(batch)
+        self.flushes += 1
+        self.batches += stats["batches"]
+        self.operations += stats["operations"]
+        self.errors += stats["errors"]
+        return stats
+
+    def _retry(self, requests: list):
+        self._retries = requests + self._retries
+        overflow = len(self._retries) - MAX_PENDING
+        if overflow > 0:
+            del self._retries[:overflow]
+            self.dropped += overflow
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self),
+            "flushes": self.flushes,
+            "batches": self.batches,
+            "operations": self.operations,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
+
+
+if __name__ == "__main__":
+    # Round trips for the bookkeeping of 10k triggered alerts, against a
+    # collection that only counts the calls and applies the $set fields
+    from pymongo.errors import AutoReconnect
+
+    class CountingCollection:
+        name = "price_alerts"
+
+        def __init__(self):
+            self.calls = 0
+            self.applied = 0
+            self.docs = {}
+            # "before" fails without writing, "after" writes then loses the reply
+            self.fail_next = None
+
+        def apply(self, filter, update):
+            self.docs.setdefault(filter["_id"], {}).update(update.get("$set", {}))
+
+        async def update_one(self, filter, update, upsert=False):
+            self.calls += 1
+            self.applied += 1
+            self.apply(filter, update)
+
+        async def bulk_write(self, requests, ordered=True):
+            self.calls += 1
+            fail, self.fail_next = self.fail_next, None
+            if fail == "before":
+                raise AutoReconnect("connection closed")
+            for request in requests:
+                self.apply(request._filter, request._doc)
+            self.applied += len(requests)
+            if fail == "after":
+                raise AutoReconnect("connection closed")
+
+    async def main():
+        alerts = [f"alert-{i}" for i in range(10_000)]
+        update = {"$set": {"state": "triggered", "trigger_count": 1}}
+
+        one_by_one = CountingCollection()
+        for alert_id in alerts:
+            await one_by_one.update_one({"_id": alert_id}, update)
+
+        collection = CountingCollection()
+        writer = BulkWriter(collection)
+        for alert_id in alerts:
+            writer.update_one({"_id": alert_id}, {"$set": {"state": "armed"}})
+            # Merged with the previous update of the same alert
+            writer.update_one({"_id": alert_id}, update)
+        await writer.flush()
+        assert collection.applied == len(alerts) and not len(writer)
+        assert collection.docs == one_by_one.docs
+        print(
+            f"{len(alerts)} alerts: {one_by_one.calls} round trips one by one, "
+            f"{collection.calls} buffered ({writer.stats()})"
+        )
+
+        # A batch lost to a failover is written by the next flush, and one
+        # applied before the reply was lost is written again to the same
+        # result
+        retried = {"$set": {"state": "triggered", "trigger_count": 2}}
+        for fail in ("before", "after"):
+            collection.fail_next = fail
+            writer.update_one({"_id": "alert-0"}, retried)
+            await writer.flush()
+            assert len(writer) == 1
+            await writer.flush()
+            assert not len(writer)
+            assert collection.docs["alert-0"] == retried["$set"]
+
+    asyncio.run(main())
@@ -0,0 +1,308 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from src.services.bulk_writer import BulkWriter
+from src.services.compute import compute_executor
+from src.services.outbound import OutboundQueue
+from src.services.price_bot import PINBAR_SCAN_BARS, CryptoPriceBot
+from src.services.sharding import Shard
+from src.services.signal_cache import SignalCache
+from src.services.signal_result import SignalResult
+from src.services.subscription_index import subscription_index
+from src.utils import format_candle_event, last_closed_candle
+
+WATCH_INTERVAL = 20  # Seconds between two checks for candles not closed yet
+WATCH_RETRIES = 6  # Checks of a closed candle before waiting for the next one
+MAX_CONCURRENT_FETCHES = 10
+
+
+@dataclass(frozen=True, slots=True)
+class CandleEvent:
+    """Something detected on a closed candle"""
+
+    kind: str  # "pinbar" or "kernel"
+    symbol: str
+    timeframe: str
+    exchange: str
+    candle_time: int  # Open time in ms of the closed candle
+    side: str  # "bullish" or "bearish"
+    price: float  # Close of the candle
+
+
+class CandleCloseWatcher:
+    """
+    Runs the detectors once per closed candle of the subscribed symbols
+
+    Work is done once per (symbol, timeframe), only for the symbols someone
+    monitors on the timeframe, however many chats do. The events are fanned
+    out through the subscription index.
+
+    The last processed candle of every (exchange, symbol, timeframe) is kept
+    in db.candle_state. A candle is only processed once the exchange returns
+    the next one, and its events are only sent once it is saved as
+    processed, so a restart never repeats a notification.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        outbound: OutboundQueue,
+        signal_cache: SignalCache,
+        timeframes: list[str],
+        shard: Shard | None = None,
+    ):
+        self.db = db
+        self.outbound = outbound
+        self.signal_cache = signal_cache
+        self.timeframes = timeframes
+        # Each shard keeps its own candle_state since they process the same
+        # symbols independently
+        self.shard = shard
+        self.candle_states = BulkWriter(db.candle_state)
+        self.last_processed: dict[tuple[str, str, str], int] = {}
+        # Exchange the symbol was last fetched from, to look up last_processed
+        self.exchanges: dict[tuple[str, str], str] = {}
+        # Candle at which a symbol had no data, not retried before the next one
+        self.unavailable: dict[tuple[str, str], int] = {}
+        # Statistics of the last check of every timeframe
+        self.last_runs: dict[str, dict] = {}
+
+    async def load(self):
+        async for doc in self.db.candle_state.find(
+            {"shard": self.shard_name},
+            {"_id": 0, "exchange": 1, "symbol": 1, "timeframe": 1, "last_processed": 1},
+        ):
+            self._set_processed(
+                doc["exchange"], doc["symbol"], doc["timeframe"], doc["last_processed"]
+            )
+
+    @property
+    def shard_name(self) -> str | None:
+        return self.shard.name if self.shard else None
+
+    def _set_processed(self, exchange, symbol, timeframe, candle_time):
+        self.last_processed[(exchange, symbol, timeframe)] = candle_time
+        self.exchanges[(symbol, timeframe)] = exchange
+
+    def processed_until(self, symbol: str, timeframe: str) -> int:
+        exchange = self.exchanges.get((symbol, timeframe))
+        return self.last_processed.get((exchange, symbol, timeframe), 0)
+
+    async def poll(self):
+        """Process every timeframe that has a newly closed candle"""
+        for timeframe in self.timeframes:
+            await self.check(timeframe)
+
+    def due(self, timeframe: str, subscriptions: dict) -> list[str]:
+        """Symbols whose latest closed candle is still to be processed"""
+        closed = last_closed_candle(timeframe)
+        return [
+            symbol
+            for symbol in subscriptions
+            if self.processed_until(symbol, timeframe) < closed
+            and self.unavailable.get((symbol, timeframe)) != closed
+        ]
+
+    async def check(self, timeframe: str, subscriptions: dict | None = None) -> int:
+        """
+        Process the latest closed candle of the symbols not processed yet
+
+        Returns:
+            int: Number of events sent
+        """
+        if subscriptions is None:
+            subscriptions = subscription_index.subscriptions(timeframe)
+        closed = last_closed_candle(timeframe)
+        due = self.due(timeframe, subscriptions)
+        if not due:
+            return 0
+
+        start_time = time.perf_counter()
+        misses = self.signal_cache.misses
+        price_bot = CryptoPriceBot()
+        try:
+            candles, events = await self.detect(price_bot, due, timeframe, closed)
+        finally:
+            await price_bot.close()
+        stats = {
+            "subscribers": len({c for chats in subscriptions.values() for c in chats}),
+            "symbols": len(due),
+            "processed": len(candles),
+            "fetches": len(due) + self.signal_cache.misses - misses,
+            "events": len(events),
+            "sends": 0,
+        }
+        self.last_runs[timeframe] = stats
+        if not candles:
+            return 0
+
+        for symbol, exchange in candles.items():
+            self.candle_states.update_one(
+                {
+                    "exchange": exchange,
+                    "symbol": symbol,
+                    "timeframe": timeframe,
+                    "shard": self.shard_name,
+                },
+                {"$set": {"last_processed": closed}},
+                upsert=True,
+            )
+        # BulkWriter reports failures instead of raising them: a write
+        # rejected, or queued for a retry, leaves the candles unprocessed and
+        # the events unsent until a later check persists them
+        written = await self.candle_states.flush()
+        if written["errors"] or len(self.candle_states):
+            print(
+                f"Closed {timeframe} candles not saved, their events are held: "
+                f"{written}"
+            )
+            return 0
+        for symbol, exchange in candles.items():
+            self._set_processed(exchange, symbol, timeframe, closed)
+
+        stats["sends"] = self.deliver(events, subscriptions)
+        stats["duration"] = round(time.perf_counter() - start_time, 3)
+        print(f"Processed closed {timeframe} candles: {stats}")
+        return len(events)
+
+    async def detect(
+        self, price_bot: CryptoPriceBot, symbols: list[str], timeframe: str, closed: int
+    ) -> tuple[dict[str, str], list[CandleEvent]]:
+        """
+        Run the pinbar and kernel regression detectors on the closed candle
+
+        Returns:
+            tuple: (exchange of every symbol whose candle was processed, events)
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+        async def fetch(symbol):
+            async with semaphore:
+                return await price_bot.fetch_ohlcv_data(
+                    symbol, timeframe, PINBAR_SCAN_BARS
+                )
+
+        fetched = await asyncio.gather(*(fetch(symbol) for symbol in symbols))
+        frames = {}
+        candles = {}
+        for symbol, (df, exchange) in zip(symbols, fetched):
+            if df is None or len(df) < PINBAR_SCAN_BARS:
+                self.unavailable[(symbol, timeframe)] = closed
+                continue
+            # Until the exchange opens the next candle, the closed one may
+            # still change; it is picked up on the next check
+            if df.index[-2:-1].as_unit("ms").asi8[0] < closed:
+                continue
+            frames[symbol] = df
+            candles[symbol] = exchange
+        if not frames:
+            return {}, []
+
+        scanned, _, colors = await compute_executor.run(
+            price_bot.pinbar_detector.detect_batch, frames
+        )
+        events = [
+            CandleEvent(
+                "pinbar",
+                symbol,
+                timeframe,
+                candles[symbol],
+                closed,
+                "bearish" if colors[i, -2] == 1 else "bullish",
+                float(frames[symbol]["close"].iloc[-2]),
+            )
+            for i, symbol in enumerate(scanned)
+            if colors[i, -2] >= 0
+        ]
+
+        results = await self.signal_cache.get_many(price_bot, list(frames), timeframe)
+        for symbol, result in results.items():
+            if not isinstance(result, SignalResult):
+                if result is not None:
+                    print(f"Error checking alerts for {symbol}: {result}")
+                continue
+            if result.candle_time != closed or not (
+                result.kernel_up or result.kernel_down
+            ):
+                continue
+            events.append(
+                CandleEvent(
+                    "kernel",
+                    symbol,
+                    timeframe,
+                    candles[symbol],
+                    closed,
+                    "bullish" if result.kernel_up else "bearish",
+                    result.close,
+                )
+            )
+        return candles, events
+
+    def deliver(self, events: list[CandleEvent], subscriptions: dict) -> int:
+        """
+        Send the events to the chats monitoring their symbol, one message per chat
+
+        Returns:
+            int: Number of messages queued
+        """
+        messages = {}
+        for event in events:
+            for chat_id in subscriptions.get(event.symbol, []):
+                messages.setdefault(chat_id, []).append(format_candle_event(event))
+        for chat_id, lines in messages.items():
+            self.outbound.send(chat_id, "\n".join(lines))
+        return len(messages)
+
+
+if __name__ == "__main__":
+    # A pinbar on a coin quoted around $0.10 is detected on its closed
+    # candle: the minimum nose length is relative to the price, not $1
+    from types import SimpleNamespace
+
+    import pandas as pd
+
+    from src.utils import timeframe_to_seconds
+
+    timeframe = "1h"
+    closed = last_closed_candle(timeframe)
+    step = timeframe_to_seconds(timeframe) * 1000
+    # Bullish left eye, bearish pinbar protruding above it, the open candle
+    candles = pd.DataFrame(
+        {
+            "open": [0.1000, 0.1040, 0.1035],
+            "high": [0.1050, 0.1100, 0.1040],
+            "low": [0.0990, 0.1030, 0.1030],
+            "close": [0.1040, 0.1035, 0.1036],
+        },
+        index=pd.to_datetime([closed - step, closed, closed + step], unit="ms"),
+    )
+
+    async def no_signals(price_bot, symbols, timeframe):
+        return {}
+
+    async def main():
+        price_bot = CryptoPriceBot()
+
+        async def fetch_ohlcv_data(symbol, timeframe, limit):
+            return candles, "binance"
+
+        price_bot.fetch_ohlcv_data = fetch_ohlcv_data
+        watcher = CandleCloseWatcher(
+            SimpleNamespace(candle_state=None),
+            None,
+            SimpleNamespace(get_many=no_signals),
+            [timeframe],
+        )
+        try:
+            _, events = await watcher.detect(
+                price_bot, ["TEST/USDT"], timeframe, closed
+            )
+        finally:
+            await price_bot.close()
+        assert [(e.kind, e.side) for e in events] == [("pinbar", "bearish")], events
+        print(f"Sub-dollar pinbar detected: {events[0]}")
+
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import timedelta
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from src.services.alert_index import alert_index
+from src.services.config_cache import ConfigCache
+from src.services.monitor_store import AlertStore, SignalMonitorStore
+from src.services.subscription_index import subscription_index
+
+# What a chat can change, a version counter each in db.chat_changes
+ALERTS = "alerts"
+SIGNALS = "signals"
+CONFIG = "config"
+
+SYNC_INTERVAL = 5  # Seconds between two polls of db.chat_changes on the leader
+# Changes read again on each poll, for the writes in flight when the last
+# one ran. Both ends use the Mongo clock, so replica clocks do not matter.
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+async def mark_changed(db: AsyncIOMotorDatabase, chat_id: int, kind: str):
+    """
+    Record that a chat changed its alerts, signals or config
+
+    Called by whichever replica served the command, after its write. The
+    leader picks the change up on its next ChatSync poll.
+    """
+    await db.chat_changes.update_one(
+        {"_id": chat_id},
+        {"$inc": {f"versions.{kind}": 1}, "$currentDate": {"updated_at": True}},
+        upsert=True,
+    )
+
+
+class ChatSync:
+    """
+    Brings the edits made on other replicas into the leader's indexes
+
+    Every replica serves commands but only the leader runs the monitors, and
+    a command updates the AlertIndex, SubscriptionIndex and ConfigCache of
+    the replica that handled it. Each edit also bumps a version of the chat
+    in db.chat_changes (mark_changed). The leader polls the chats changed
+    since its last poll and reloads the parts whose version it has not seen
+    from Mongo. The reloads go through update_chat and the config cache
+    subscribers, so they reach the shard workers too.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        config_cache: ConfigCache,
+        interval: float = SYNC_INTERVAL,
+    ):
+        self.db = db
+        self.config_cache = config_cache
+        self.interval = interval
+        self.alerts = AlertStore(db)
+        self.monitors = SignalMonitorStore(db)
+        # chat_id -> (versions, updated_at) seen, within SYNC_OVERLAP
+        self.seen: dict[int, tuple[dict, object]] = {}
+        self.since = None
+        self.reloads = 0
+        self._task: asyncio.Task | None = None
+
+    async def changes(self) -> list[dict]:
+        query = {} if self.since is None else {"updated_at": {"$gte": self.since}}
+        return await self.db.chat_changes.find(query).to_list(None)
+
+    async def baseline(self):
+        """
+        Record the current versions without reloading anything
+
+        Run before the indexes are loaded, so an edit made after the load
+        is at a version not seen yet.
+        """
+        self.seen = {}
+        self.since = None
+        for change in await self.changes():
+            self.seen[change["_id"]] = (
+                change.get("versions", {}),
+                change["updated_at"],
+            )
+            self.since = max(self.since or change["updated_at"], change["updated_at"])
+        if self.since is not None:
+            self.since -= SYNC_OVERLAP
+
+    async def poll(self) -> int:
+        """Reload the chats changed on any replica, returns the reloads"""
+        reloads = 0
+        latest = None
+        for change in await self.changes():
+            chat_id, versions = change["_id"], change.get("versions", {})
+            seen = self.seen.get(chat_id, ({}, None))[0]
+            for kind, version in versions.items():
+                if seen.get(kind) != version:
+                    await self.reload(chat_id, kind)
+                    reloads += 1
+            self.seen[chat_id] = (versions, change["updated_at"])
+            latest = max(latest or change["updated_at"], change["updated_at"])
+
+        if latest is not None:
+            self.since = latest - SYNC_OVERLAP
+            # Older changes are not read again, nor compared
+            self.seen = {
+                chat_id: entry
+                for chat_id, entry in self.seen.items()
+                if entry[1] >= self.since
+            }
+        self.reloads += reloads
+        return reloads
+
+    async def reload(self, chat_id: int, kind: str):
+        if kind == ALERTS:
+            alert_index.update_chat(chat_id, await self.alerts.chat_alerts(chat_id))
+        elif kind == SIGNALS:
+            subscription_index.update_chat(
+                chat_id, await self.monitors.chat_monitors(chat_id)
+            )
+        elif kind == CONFIG:
+            await self.config_cache.reload(chat_id)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:  # noqa: BLE001 - keep polling after any error
+                print(f"Error syncing the chats changed on other replicas: {e}")
+
+    async def start_monitoring(self):
+        await self.baseline()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop_monitoring(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
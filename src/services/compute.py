@@ -0,0 +1,197 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def _timed_batch(fn, batch: list[tuple], submitted_at: float):
+    """
+    Run fn over a batch of argument tuples inside the worker
+
+    Exceptions are returned in place of the result so one bad symbol does not
+    fail the whole batch. Wall-clock time is used because the submit and the
+    run may happen in different processes.
+    """
+    started_at = time.time()
+    results = []
+    for args in batch:
+        try:
+            results.append(fn(*args))
+        except Exception as e:  # noqa: BLE001 - returned to the caller
+            results.append(e)
+    return results, started_at - submitted_at, time.time() - started_at
+
+
+class ComputeExecutor:
+    """
+    Runs the CPU bound analytics (indicators, kernel regression, pinbars) off
+    the event loop, in a thread or a process pool.
+
+    Work is submitted in batches of argument tuples to amortize the
+    scheduling and, for processes, the pickling cost. The time every batch
+    waited in the queue and the time it took to compute are recorded.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: int | None = None,
+        batch_size: int = 16,
+    ):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self._executor: Executor | None = None
+        self.reset_stats()
+
+    def configure(self, kind: str, max_workers: int | None, batch_size: int):
+        """Change the pool settings, the pool is recreated on the next submit"""
+        self.shutdown()
+        self.kind = kind
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="compute"
+                )
+        return self._executor
+
+    def reset_stats(self):
+        self.batches = 0
+        self.items = 0
+        self.queue_time = 0.0
+        self.compute_time = 0.0
+        self.max_queue_time = 0.0
+        self.max_compute_time = 0.0
+
+    def _record(self, n_items: int, queue_time: float, compute_time: float):
+        self.batches += 1
+        self.items += n_items
+        self.queue_time += queue_time
+        self.compute_time += compute_time
+        self.max_queue_time = max(self.max_queue_time, queue_time)
+        self.max_compute_time = max(self.max_compute_time, compute_time)
+
+    async def _submit(self, fn, batch: list[tuple]) -> list:
+        loop = asyncio.get_running_loop()
+        results, queue_time, compute_time = await loop.run_in_executor(
+            self._get_executor(), _timed_batch, fn, batch, time.time()
+        )
+        self._record(len(batch), queue_time, compute_time)
+        return results
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool and return its result"""
+        (result,) = await self._submit(fn, [args])
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def map_batches(
+        self, fn, items: list[tuple], batch_size: int | None = None
+    ) -> list:
+        """
+        Run fn(*item) for every item, batch_size items per pool task
+
+        Returns:
+            list: Results in the order of items, with the raised exception in
+            place of the result for the items that failed
+        """
+        batch_size = batch_size or self.batch_size
+        batches = [
+            items[start : start + batch_size]
+            for start in range(0, len(items), batch_size)
+        ]
+        results = await asyncio.gather(*(self._submit(fn, b) for b in batches))
+        return [result for batch in results for result in batch]
+
+    def stats(self) -> dict:
+        batches = self.batches or 1
+        return {
+            "kind": self.kind,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_queue_ms": round(self.queue_time / batches * 1000, 2),
+            "max_queue_ms": round(self.max_queue_time * 1000, 2),
+            "avg_compute_ms": round(self.compute_time / batches * 1000, 2),
+            "max_compute_ms": round(self.max_compute_time * 1000, 2),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Configured from the settings by the bot at startup
+compute_executor = ComputeExecutor()
+
+
+if __name__ == "__main__":
+    # Signals of 200 symbols (indicators and kernel regression) computed on
+    # the event loop, then through the thread and the process pools. The
+    # process workers are spawned, they import the main module again, so it
+    # must not have side effects at import time (see bot.py)
+    import os
+    import sys
+
+    import numpy as np
+    import pandas as pd
+
+    from src.services.indicator_engine import INDICATOR_WINDOW
+    from src.services.indicators import quant_agent_sync
+
+    SYMBOLS = 200
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    rng = np.random.default_rng(7)
+    items = []
+    for i in range(SYMBOLS):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, INDICATOR_WINDOW)))
+        spread = np.abs(rng.normal(0, 0.005, (2, INDICATOR_WINDOW))) * close
+        df = pd.DataFrame(
+            {
+                "high": close + spread[0],
+                "low": close - spread[1],
+                "close": close,
+                "volume": rng.uniform(100, 1000, INDICATOR_WINDOW),
+            },
+            index=pd.date_range("2024-01-01", periods=INDICATOR_WINDOW, freq="h"),
+        )
+        items.append((df, f"COIN{i}/USDT", "1h"))
+
+    def outcome(results: list) -> list:
+        # The values hold NaN, which never compare equal
+        return [(r.signals, r.overall, r.kernel_up, r.kernel_down) for r in results]
+
+    start = time.perf_counter()
+    expected = outcome([quant_agent_sync(*item) for item in items])
+    inline_time = time.perf_counter() - start
+    print(f"inline: {inline_time * 1000:.0f} ms")
+
+    async def timed(executor: ComputeExecutor) -> float:
+        # The first call starts the pool, not part of the measure
+        await executor.map_batches(quant_agent_sync, items[:workers], 1)
+        executor.reset_stats()
+        start = time.perf_counter()
+        results = await executor.map_batches(quant_agent_sync, items)
+        elapsed = time.perf_counter() - start
+        assert outcome(results) == expected
+        return elapsed
+
+    for kind in ("thread", "process"):
+        executor = ComputeExecutor(kind, workers)
+        try:
+            elapsed = asyncio.run(timed(executor))
+        finally:
+            executor.shutdown()
+        print(
+            f"{kind} x{workers}: {elapsed * 1000:.0f} ms "
+            f"({inline_time / elapsed:.1f}x), {executor.stats()}"
+        )
@@ -0,0 +1,98 @@
+from cachetools import LRUCache
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+DEFAULT_CONFIG = {
+    "is_alert": "off",
+    "price_threshold": 0.01,
+    "alert_interval": 1,
+    "is_future": "off",
+}
+
+CONFIG_CACHE_SIZE = 50000
+
+
+class ConfigCache:
+    """
+    User configs by chat_id, bounded with LRU eviction
+
+    Reads go to Mongo only for chats that are not cached (one $in query for
+    a whole batch), writes go to Mongo and the cache together. A chat known
+    to have no config is cached as None, so it is not queried again.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, maxsize: int = CONFIG_CACHE_SIZE):
+        self.db = db
+        self.configs = LRUCache(maxsize=maxsize)
+        self.queries = 0
+        # Called with (chat_id, config) on every write
+        self.subscribers: list = []
+
+    async def load(self):
+        """Fill the cache with every stored config in one query"""
+        self.queries += 1
+        async for config in self.db.config.find({}, {"_id": 0}):
+            self.configs[config["chat_id"]] = config
+
+    async def get(self, chat_id: int) -> dict:
+        """Config of the chat, created from DEFAULT_CONFIG if it has none"""
+        config = self.configs.get(chat_id)
+        if config is None and chat_id not in self.configs:
+            self.queries += 1
+            config = await self.db.config.find_one({"chat_id": chat_id}, {"_id": 0})
+        if config is None:
+            config = {"chat_id": chat_id, **DEFAULT_CONFIG}
+            self.queries += 1
+            # insert_one sets the _id of the document it is given
+            await self.db.config.insert_one(config)
+        self.configs[chat_id] = config
+        return config
+
+    async def get_many(self, chat_ids: list[int]) -> dict[int, dict]:
+        """Configs of the chats that have one, missing ones in a single query"""
+        configs = {}
+        missing = []
+        for chat_id in chat_ids:
+            if chat_id not in self.configs:
+                missing.append(chat_id)
+            elif self.configs[chat_id] is not None:
+                configs[chat_id] = self.configs[chat_id]
+        if not missing:
+            return configs
+
+        self.queries += 1
+        found = {}
+        async for config in self.db.config.find(
+            {"chat_id": {"$in": missing}}, {"_id": 0}
+        ):
+            found[config["chat_id"]] = config
+        for chat_id in missing:
+            self.configs[chat_id] = found.get(chat_id)
+            if chat_id in found:
+                configs[chat_id] = found[chat_id]
+        return configs
+
+    async def set(self, chat_id: int, key: str, value) -> dict:
+        """Write a config value through to Mongo and the cache"""
+        config = await self.get(chat_id)
+        self.queries += 1
+        await self.db.config.update_one({"chat_id": chat_id}, {"$set": {key: value}})
+        config[key] = value
+        # chat_sync imports this module
+        from src.services.chat_sync import CONFIG, mark_changed
+
+        await mark_changed(self.db, chat_id, CONFIG)
+        self.notify(chat_id, config)
+        return config
+
+    async def reload(self, chat_id: int) -> dict | None:
+        """Read the config of the chat again, after a write by another replica"""
+        self.queries += 1
+        config = await self.db.config.find_one({"chat_id": chat_id}, {"_id": 0})
+        self.configs[chat_id] = config
+        if config is not None:
+            self.notify(chat_id, config)
+        return config
+
+    def notify(self, chat_id: int, config: dict):
+        for subscriber in self.subscribers:
+            subscriber(chat_id, config)
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from typing import Tuple
 
 
 class PinbarDetector:
@@ -24,6 +23,7 @@ class PinbarDetector:
         custom_nose_length_to_left_eye_length: float = 0.0,
         custom_left_eye_depth: float = 0.1,
         custom_minimum_nose_length: float = 1.0,
+        custom_minimum_nose_percent: float = 0.0,
     ):
         """
         Initialize the Pinbar Detector with custom or default settings.
@@ -32,6 +32,9 @@ class PinbarDetector:
             count_bars: Number of bars to analyze (0 = all bars)
             use_custom_settings: Whether to use custom settings
             custom_*: Various custom parameters for pinbar detection
+            custom_minimum_nose_length is in price units, whatever the
+            symbol; custom_minimum_nose_percent is relative to the close
+            (0.1 = 0.1%), so it fits every price range
         """
         self.count_bars = count_bars
 
@@ -48,6 +51,7 @@ class PinbarDetector:
             self.nose_length_to_left_eye_length = custom_nose_length_to_left_eye_length
             self.left_eye_depth = custom_left_eye_depth
             self.minimum_nose_length = custom_minimum_nose_length
+            self.minimum_nose_percent = custom_minimum_nose_percent
         else:
             # Default settings
             self.max_nose_body_size = 0.33
@@ -61,11 +65,144 @@ class PinbarDetector:
             self.nose_length_to_left_eye_length = 0.0
             self.left_eye_depth = 0.1
             self.minimum_nose_length = 1.0
+            self.minimum_nose_percent = 0.0
 
-    def detect(self, df: pd.DataFrame) -> Tuple[list, list]:
+    def detect(self, df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
         """
         Detect pinbar patterns in the provided OHLC data.
 
+        Args:
+            df: pandas DataFrame with columns 'open', 'high', 'low', 'close'
+
+        Returns:
+            Tuple of (signals, colors) arrays of len(df) where:
+                signals: price level of the signal, NaN for no signal
+                colors: 0 for bullish, 1 for bearish, -1 for no signal
+        """
+        if len(df) < 2:
+            raise ValueError("Need at least 2 bars of data")
+
+        return self.detect_arrays(
+            df["open"].values, df["high"].values, df["low"].values, df["close"].values
+        )
+
+    def detect_arrays(
+        self,
+        opens: np.ndarray,
+        highs: np.ndarray,
+        lows: np.ndarray,
+        closes: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate every pinbar rule as a mask over whole series at once.
+
+        Each bar is compared with the bar before it by slicing the last axis,
+        so the arrays can also be (n_symbols, n_bars) matrices. Every rule is
+        the negation of a rejection in the loop version (detect_loop), which
+        keeps its behaviour on NaN ratios from zero-length bars.
+
+        Args:
+            opens, highs, lows, closes: Arrays of shape (..., n_bars)
+
+        Returns:
+            Tuple of (signals, colors) arrays of shape (..., n_bars), see detect
+        """
+        opens, highs, lows, closes = (
+            np.asarray(a, dtype=float) for a in (opens, highs, lows, closes)
+        )
+        o, h, l, c = (a[..., 1:] for a in (opens, highs, lows, closes))
+        po, ph, pl, pc = (a[..., :-1] for a in (opens, highs, lows, closes))
+
+        nose_length = h - l
+        left_eye_length = ph - pl
+        nose_body = np.abs(o - c)
+        left_eye_body = np.abs(po - pc)
+        body_top = np.maximum(o, c)
+        body_bottom = np.minimum(o, c)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            common = (
+                ~(nose_length < self.minimum_nose_length)
+                & ~(nose_length < c * self.minimum_nose_percent / 100)
+                & ~(nose_body / nose_length > self.max_nose_body_size)
+                & ~(left_eye_body / left_eye_length < self.left_eye_min_body_size)
+                & ~(nose_body / left_eye_body > self.nose_body_to_left_eye_body)
+                & ~(nose_length / left_eye_length < self.nose_length_to_left_eye_length)
+            )
+            if self.nose_body_inside_left_eye_body:
+                common &= ~(
+                    (body_top > np.maximum(po, pc)) | (body_bottom < np.minimum(po, pc))
+                )
+
+            bearish = (
+                common
+                & ~(h - ph < nose_length * self.nose_protruding)
+                & ~(1 - (h - body_top) / nose_length >= self.nose_body_position)
+                & ~(l - pl < left_eye_length * self.left_eye_depth)
+            )
+            bullish = (
+                common
+                & ~(pl - l < nose_length * self.nose_protruding)
+                & ~(1 - (body_bottom - l) / nose_length >= self.nose_body_position)
+                & ~(ph - h < left_eye_length * self.left_eye_depth)
+            )
+
+        if self.left_eye_opposite_direction:
+            bearish &= ~(pc <= po)
+            bullish &= ~(pc >= po)
+        if self.nose_same_direction:
+            bearish &= ~(c >= o)
+            bullish &= ~(c <= o)
+
+        # Like the loop, only the first count_bars bars are processed
+        n_bars = opens.shape[-1]
+        bars_to_process = n_bars if self.count_bars == 0 else self.count_bars
+        bearish[..., max(bars_to_process - 1, 0) :] = False
+        bullish &= ~bearish
+        bullish[..., max(bars_to_process - 1, 0) :] = False
+
+        signals = np.full(opens.shape, np.nan)
+        colors = np.full(opens.shape, -1, dtype=np.int8)
+        signals[..., 1:] = np.where(
+            bearish,
+            h + nose_length / 5,
+            np.where(bullish, l - nose_length / 5, np.nan),
+        )
+        colors[..., 1:] = np.where(bearish, 1, np.where(bullish, 0, -1))
+        return signals, colors
+
+    def detect_batch(
+        self, frames: dict[str, pd.DataFrame]
+    ) -> tuple[list, np.ndarray, np.ndarray]:
+        """
+        Detect pinbars on several symbols in one vectorized pass.
+
+        The common tail of every DataFrame is stacked into (n_symbols, n_bars)
+        OHLC matrices before running detect_arrays.
+
+        Args:
+            frames: OHLC DataFrames keyed by symbol
+
+        Returns:
+            Tuple of (symbols, signals, colors) where row i of the
+            (n_symbols, n_bars) signals and colors belongs to symbols[i]
+        """
+        symbols = [s for s, df in frames.items() if df is not None and len(df) >= 2]
+        if not symbols:
+            return [], np.empty((0, 0)), np.empty((0, 0), dtype=np.int8)
+        n_bars = min(len(frames[s]) for s in symbols)
+        signals, colors = self.detect_arrays(
+            *(
+                np.vstack([frames[s][column].values[-n_bars:] for s in symbols])
+                for column in ("open", "high", "low", "close")
+            )
+        )
+        return symbols, signals, colors
+
+    def detect_loop(self, df: pd.DataFrame) -> tuple[list, list]:
+        """
+        Detect pinbar patterns bar by bar, reference for detect.
+
         Args:
             df: pandas DataFrame with columns 'open', 'high', 'low', 'close'
 
@@ -96,7 +233,10 @@ class PinbarDetector:
         for i in range(1, bars_to_process):
             # Calculate bar parameters
             nose_length = highs[i] - lows[i]
-            if nose_length < self.minimum_nose_length:
+            if (
+                nose_length < self.minimum_nose_length
+                or nose_length < closes[i] * self.minimum_nose_percent / 100
+            ):
                 continue
 
             left_eye_length = highs[i - 1] - lows[i - 1]
@@ -246,29 +386,61 @@ class PinbarDetector:
         return True
 
 
-# Example usage:
+# Parity with the loop version and timing on random data:
 if __name__ == "__main__":
-    # Create sample data
-    data = pd.DataFrame(
+    import time
+
+    rng = np.random.default_rng(5)
+    n_bars = 20000
+    closes = 100 + np.cumsum(rng.normal(0, 1, n_bars))
+    opens = np.roll(closes, 1) + rng.normal(0, 0.3, n_bars)
+    highs = np.maximum(opens, closes) + rng.exponential(1.0, n_bars)
+    lows = np.minimum(opens, closes) - rng.exponential(1.0, n_bars)
+    # Some flat and zero-length bars to exercise the division edge cases
+    flat = rng.random(n_bars) < 0.02
+    opens[flat] = highs[flat] = lows[flat] = closes[flat]
+    data = pd.DataFrame({"open": opens, "high": highs, "low": lows, "close": closes})
+
+    settings = [
+        {},
+        {"count_bars": 5000},
+        {
+            "use_custom_settings": True,
+            "custom_left_eye_opposite_direction": False,
+            "custom_nose_same_direction": True,
+            "custom_nose_body_inside_left_eye_body": True,
+            "custom_minimum_nose_length": 0.0,
+            "custom_left_eye_min_body_size": 0.0,
+        },
+        {
+            "use_custom_settings": True,
+            "custom_nose_protruding": 0.2,
+            "custom_left_eye_depth": 0.0,
+            "custom_nose_length_to_left_eye_length": 1.0,
+        },
         {
-            "Open": [100, 101, 102, 103, 104],
-            "High": [105, 106, 107, 108, 109],
-            "Low": [95, 96, 97, 98, 99],
-            "Close": [102, 103, 104, 105, 106],
-        }
-    )
-
-    # Initialize detector
-    detector = PinbarDetector(
-        use_custom_settings=True,
-        custom_max_nose_body_size=0.33,
-        custom_nose_body_position=0.4,
-    )
-
-    # Detect pinbars
-    signals, colors = detector.detect(data)
-    # Print results
-    for i, (signal, color) in enumerate(zip(signals, colors)):
-        if signal is not None:
-            pattern = "Bullish" if color == 0 else "Bearish"
-            print(f"Bar {i}: {pattern} pinbar detected at price {signal:.2f}")
+            "use_custom_settings": True,
+            "custom_minimum_nose_length": 0.0,
+            "custom_minimum_nose_percent": 1.5,
+        },
+    ]
+    for kwargs in settings:
+        detector = PinbarDetector(**kwargs)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            start = time.perf_counter()
+            loop_signals, loop_colors = detector.detect_loop(data)
+            loop_time = time.perf_counter() - start
+        start = time.perf_counter()
+        signals, colors = detector.detect(data)
+        vector_time = time.perf_counter() - start
+
+        expected_signals = np.array(
+            [np.nan if s is None else s for s in loop_signals], dtype=float
+        )
+        expected_colors = np.array([-1 if c is None else c for c in loop_colors])
+        np.testing.assert_array_equal(colors, expected_colors)
+        np.testing.assert_allclose(signals, expected_signals)
+        print(
+            f"{kwargs}: {np.sum(colors >= 0)} pinbars, loop {loop_time * 1000:.1f} ms, "
+            f"vectorized {vector_time * 1000:.2f} ms ({loop_time / vector_time:.0f}x)"
+        )
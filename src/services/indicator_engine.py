@@ -0,0 +1,271 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+RSI_WINDOW = 14
+BB_WINDOW = 20
+BB_DEVIATIONS = 2
+STOCH_WINDOW = 14
+MFI_WINDOW = 14
+OBV_SLOPE_BARS = 5
+
+# Enough bars for the EMAs to converge to the full-history values
+INDICATOR_WINDOW = 300
+EMA_BLOCK = 32
+
+
+def ema(x, alpha, block: int = EMA_BLOCK):
+    """
+    Exponential moving average along the last axis, seeded with the first value
+
+    Equivalent to pandas ewm(alpha=alpha, adjust=False).mean(). The recursion
+    is solved in closed form inside blocks of `block` bars, so the only Python
+    loop is over blocks and every row of x is processed at once.
+
+    Parameters:
+        x (np.array): Values of shape (..., n_bars)
+        alpha (float | np.array): Smoothing factor, broadcastable to x.shape[:-1] + (1,)
+        block (int): Block length, keeps decay ** -block far from overflowing
+
+    Returns:
+        np.array: EMA of the same shape as x
+    """
+    x = np.asarray(x, dtype=float)
+    alpha = np.asarray(alpha, dtype=float)
+    decay = 1 - alpha
+    steps = np.arange(block)
+    powers = decay**steps
+    inverse_powers = decay**-steps
+
+    out = np.empty(np.broadcast_shapes(x.shape, alpha.shape))
+    prev = x[..., :1]
+    for start in range(0, x.shape[-1], block):
+        chunk = x[..., start : start + block]
+        n = chunk.shape[-1]
+        weighted = np.cumsum(chunk * inverse_powers[..., :n], axis=-1)
+        out[..., start : start + n] = (
+            alpha * weighted * powers[..., :n] + prev * decay * powers[..., :n]
+        )
+        prev = out[..., start + n - 1 : start + n]
+    return out
+
+
+def _mask_warmup(x, periods: int):
+    x[..., : periods - 1] = np.nan
+    return x
+
+
+def _rolling(x, window: int):
+    """Windows of `window` bars ending at every bar, NaN padded at the start"""
+    pad = np.full(x.shape[:-1] + (window - 1,), np.nan)
+    return sliding_window_view(np.concatenate([pad, x], axis=-1), window, axis=-1)
+
+
+def compute_indicators(high, low, close, volume, window: int | None = None) -> dict:
+    """
+    Compute MACD, RSI, Bollinger Bands, OBV, Stochastic and MFI in one pass
+
+    Matches the ta library classes used by quant_agent (same windows, same
+    NaN warm-up). With `window`, only the last `window` bars are used: the
+    latest values then match the full-history values within tolerance once
+    the EMAs have converged, and OBV is relative to the window start.
+
+    Args:
+        high, low, close, volume: Arrays of shape (..., n_bars)
+        window: Number of trailing bars to compute on, None for all bars
+
+    Returns:
+        dict: Arrays of shape (..., n_bars) keyed by indicator
+    """
+    arrays = [np.asarray(a, dtype=float) for a in (high, low, close, volume)]
+    if window is not None:
+        arrays = [a[..., -window:] for a in arrays]
+    high, low, close, volume = arrays
+
+    prev_close = np.concatenate([close[..., :1], close[..., :-1]], axis=-1)
+    diff = close - prev_close
+    typical_price = (high + low + close) / 3
+    prev_typical = np.concatenate(
+        [typical_price[..., :1], typical_price[..., :-1]], axis=-1
+    )
+
+    # Every EMA on the close series goes through a single call
+    alphas = np.array(
+        [2 / (MACD_FAST + 1), 2 / (MACD_SLOW + 1), 1 / RSI_WINDOW, 1 / RSI_WINDOW]
+    ).reshape((4,) + (1,) * close.ndim)
+    emas = ema(
+        np.stack([close, close, np.maximum(diff, 0), np.maximum(-diff, 0)]),
+        alphas,
+    )
+    ema_fast = _mask_warmup(emas[0], MACD_FAST)
+    ema_slow = _mask_warmup(emas[1], MACD_SLOW)
+    ema_up = _mask_warmup(emas[2], RSI_WINDOW)
+    ema_down = _mask_warmup(emas[3], RSI_WINDOW)
+
+    macd = ema_fast - ema_slow
+    macd_signal = np.full_like(macd, np.nan)
+    if macd.shape[-1] >= MACD_SLOW:
+        macd_signal[..., MACD_SLOW - 1 :] = _mask_warmup(
+            ema(macd[..., MACD_SLOW - 1 :], 2 / (MACD_SIGNAL + 1)), MACD_SIGNAL
+        )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = np.where(ema_down == 0, 100.0, 100 - 100 / (1 + ema_up / ema_down))
+
+        closes = _rolling(close, BB_WINDOW)
+        bb_mavg = closes.mean(axis=-1)
+        bb_std = closes.std(axis=-1)
+
+        lowest = _rolling(low, STOCH_WINDOW).min(axis=-1)
+        highest = _rolling(high, STOCH_WINDOW).max(axis=-1)
+        stoch = 100 * (close - lowest) / (highest - lowest)
+
+        money_flow = typical_price * volume * np.sign(typical_price - prev_typical)
+        flows = _rolling(money_flow, MFI_WINDOW)
+        positive_flow = np.where(flows >= 0, flows, 0.0).sum(axis=-1)
+        negative_flow = -np.where(flows < 0, flows, 0.0).sum(axis=-1)
+        mfi = 100 - 100 / (1 + positive_flow / negative_flow)
+        mfi[..., : MFI_WINDOW - 1] = np.nan
+
+    obv = np.cumsum(np.where(close < prev_close, -volume, volume), axis=-1)
+
+    return {
+        "macd": macd,
+        "macd_signal": macd_signal,
+        "rsi": rsi,
+        "bb_upper": bb_mavg + BB_DEVIATIONS * bb_std,
+        "bb_lower": bb_mavg - BB_DEVIATIONS * bb_std,
+        "obv": obv,
+        "stoch": stoch,
+        "mfi": mfi,
+        "close": close,
+    }
+
+
+def obv_slope(obv):
+    """Mean OBV change over the last OBV_SLOPE_BARS bars, on every bar"""
+    slope = np.full_like(obv, np.nan)
+    slope[..., OBV_SLOPE_BARS:] = (
+        obv[..., OBV_SLOPE_BARS:] - obv[..., :-OBV_SLOPE_BARS]
+    ) / OBV_SLOPE_BARS
+    return slope
+
+
+def signal_votes(indicators: dict) -> dict:
+    """
+    Bullish (1) / bearish (-1) / neutral (0) vote of every indicator on every bar
+
+    These are the quant_agent rules; comparisons against NaN are neutral.
+    A precomputed "obv_slope" entry is used instead of the "obv" series when
+    present (see IndicatorState.indicators).
+    """
+    macd, macd_signal = indicators["macd"], indicators["macd_signal"]
+    prev_macd = np.roll(macd, 1, axis=-1)
+    prev_signal = np.roll(macd_signal, 1, axis=-1)
+    prev_macd[..., 0] = prev_signal[..., 0] = np.nan
+    close = indicators["close"]
+    rsi, stoch, mfi = indicators["rsi"], indicators["stoch"], indicators["mfi"]
+    slope = (
+        indicators["obv_slope"]
+        if "obv_slope" in indicators
+        else obv_slope(indicators["obv"])
+    )
+
+    def vote(bullish, bearish):
+        return np.where(bullish, 1, np.where(bearish, -1, 0)).astype(np.int8)
+
+    with np.errstate(invalid="ignore"):
+        return {
+            "MACD": vote(
+                (prev_macd < prev_signal) & (macd > macd_signal),
+                (prev_macd > prev_signal) & (macd < macd_signal),
+            ),
+            "RSI": vote(rsi <= 30, rsi >= 70),
+            "Bollinger": vote(
+                close < indicators["bb_lower"], close > indicators["bb_upper"]
+            ),
+            "OBV": vote(slope > 0, slope < 0),
+            "STOCH": vote(stoch <= 20, stoch >= 80),
+            "MFI": vote(mfi <= 20, mfi >= 80),
+        }
+
+
+def overall_vote(votes: dict):
+    """Majority vote of the indicators and the share of the winning side"""
+    stacked = np.stack(list(votes.values()))
+    bullish = np.sum(stacked == 1, axis=0)
+    bearish = np.sum(stacked == -1, axis=0)
+    confidence = np.maximum(bullish, bearish) / len(votes)
+    return np.sign(bullish - bearish).astype(np.int8), confidence
+
+
+if __name__ == "__main__":
+    import time
+
+    import pandas as pd
+
+    from src.services.indicators import (
+        calculate_bollinger_bands,
+        calculate_macd,
+        calculate_mfi,
+        calculate_obv,
+        calculate_rsi,
+        calculate_stoch,
+    )
+
+    rng = np.random.default_rng(7)
+    n_bars = 1000
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+    spread = np.abs(rng.normal(0, 0.005, (2, n_bars))) * close
+    prices_df = pd.DataFrame(
+        {
+            "open": close,
+            "high": close + spread[0],
+            "low": close - spread[1],
+            "close": close,
+            "volume": rng.uniform(100, 1000, n_bars),
+        }
+    )
+    arrays = [prices_df[c].values for c in ("high", "low", "close", "volume")]
+
+    def run_ta():
+        macd, macd_signal = calculate_macd(prices_df)
+        upper, lower = calculate_bollinger_bands(prices_df)
+        return {
+            "macd": macd.values,
+            "macd_signal": macd_signal.values,
+            "rsi": calculate_rsi(prices_df).values,
+            "bb_upper": upper.values,
+            "bb_lower": lower.values,
+            "obv": calculate_obv(prices_df).values,
+            "stoch": calculate_stoch(prices_df).values,
+            "mfi": calculate_mfi(prices_df).values,
+        }
+
+    expected = run_ta()
+    full = compute_indicators(*arrays)
+    tail = compute_indicators(*arrays, window=INDICATOR_WINDOW)
+    for name, values in expected.items():
+        np.testing.assert_allclose(full[name], values, rtol=1e-9, atol=1e-9)
+        if name != "obv":
+            np.testing.assert_allclose(tail[name][-2:], values[-2:], rtol=1e-6)
+
+    def bench(func, repeat=20):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat
+
+    ta_time = bench(run_ta)
+    full_time = bench(lambda: compute_indicators(*arrays))
+    tail_time = bench(lambda: compute_indicators(*arrays, window=INDICATOR_WINDOW))
+    print(f"ta library:            {ta_time * 1000:8.2f} ms")
+    print(
+        f"fused, all bars:       {full_time * 1000:8.2f} ms ({ta_time / full_time:.1f}x)"
+    )
+    print(
+        f"fused, last {INDICATOR_WINDOW} bars: {tail_time * 1000:8.2f} ms "
+        f"({ta_time / tail_time:.1f}x)"
+    )
@@ -0,0 +1,340 @@
+from collections import deque
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from src.services.indicator_engine import (
+    BB_DEVIATIONS,
+    BB_WINDOW,
+    INDICATOR_WINDOW,
+    MACD_FAST,
+    MACD_SIGNAL,
+    MACD_SLOW,
+    MFI_WINDOW,
+    OBV_SLOPE_BARS,
+    RSI_WINDOW,
+    STOCH_WINDOW,
+)
+from src.services.kernel_tuning import KERNEL_HISTORY
+from src.utils import last_closed_candle, timeframe_to_seconds
+
+
+class IndicatorState:
+    """
+    Recursive quant_agent indicators of one (symbol, timeframe)
+
+    Every closed candle is folded in with update() in O(1): the EMAs (MACD,
+    Wilder RSI) are plain recursions and the rolling indicators (Bollinger,
+    Stochastic, MFI, OBV slope) only keep their fixed-size window. Seeding
+    from history replays the candles, so the values match compute_indicators.
+    """
+
+    def __init__(self, symbol: str, timeframe: str, exchange: str | None = None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.exchange = exchange
+        self.bars = 0
+        self.last_timestamp = None
+        self.prev_close = None
+        self.prev_typical = None
+
+        self.ema_fast = None
+        self.ema_slow = None
+        self.macd_signal = None
+        self.macd_bars = 0
+        self.prev_macd = np.nan
+        self.prev_macd_signal = np.nan
+        self.rsi_up = None
+        self.rsi_down = None
+        self.obv = 0.0
+
+        self.closes = deque(maxlen=BB_WINDOW)
+        self.highs = deque(maxlen=STOCH_WINDOW)
+        self.lows = deque(maxlen=STOCH_WINDOW)
+        self.money_flows = deque(maxlen=MFI_WINDOW)
+        self.obvs = deque(maxlen=OBV_SLOPE_BARS + 1)
+        self.kernel_closes = deque(maxlen=KERNEL_HISTORY)
+
+    @staticmethod
+    def _ema(prev, value, alpha):
+        return value if prev is None else prev + alpha * (value - prev)
+
+    def update(self, timestamp: int, high, low, close, volume) -> bool:
+        """
+        Fold one closed candle into the state
+
+        Args:
+            timestamp: Candle open time in ms
+            high, low, close, volume: Candle values
+
+        Returns:
+            bool: False if the candle was already applied
+        """
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return False
+
+        self.prev_macd, self.prev_macd_signal = self._macd_values()
+
+        prev_close = close if self.prev_close is None else self.prev_close
+        typical = (high + low + close) / 3
+        prev_typical = typical if self.prev_typical is None else self.prev_typical
+        diff = close - prev_close
+
+        self.ema_fast = self._ema(self.ema_fast, close, 2 / (MACD_FAST + 1))
+        self.ema_slow = self._ema(self.ema_slow, close, 2 / (MACD_SLOW + 1))
+        self.rsi_up = self._ema(self.rsi_up, max(diff, 0.0), 1 / RSI_WINDOW)
+        self.rsi_down = self._ema(self.rsi_down, max(-diff, 0.0), 1 / RSI_WINDOW)
+        self.bars += 1
+        if self.bars >= MACD_SLOW:
+            macd = self.ema_fast - self.ema_slow
+            self.macd_signal = self._ema(self.macd_signal, macd, 2 / (MACD_SIGNAL + 1))
+            self.macd_bars += 1
+
+        self.obv += -volume if close < prev_close else volume
+        self.obvs.append(self.obv)
+        self.closes.append(close)
+        self.kernel_closes.append(close)
+        self.highs.append(high)
+        self.lows.append(low)
+        self.money_flows.append(typical * volume * np.sign(typical - prev_typical))
+
+        self.prev_close = close
+        self.prev_typical = typical
+        self.last_timestamp = timestamp
+        return True
+
+    def _macd_values(self):
+        if self.bars < MACD_SLOW:
+            return np.nan, np.nan
+        macd = self.ema_fast - self.ema_slow
+        signal = self.macd_signal if self.macd_bars >= MACD_SIGNAL else np.nan
+        return macd, signal
+
+    def indicators(self) -> dict:
+        """
+        Latest indicator values in the compute_indicators layout
+
+        Every array holds the previous and the latest bar (only the MACD
+        lines need the previous one), so the result can be passed to
+        signal_votes and build_signal_result.
+        """
+        macd, macd_signal = self._macd_values()
+        nan = np.nan
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = nan
+            if self.bars >= RSI_WINDOW:
+                rsi = (
+                    100.0
+                    if self.rsi_down == 0
+                    else 100 - 100 / (1 + self.rsi_up / self.rsi_down)
+                )
+
+            bb_upper = bb_lower = nan
+            if len(self.closes) == BB_WINDOW:
+                closes = np.array(self.closes)
+                mavg, std = closes.mean(), closes.std()
+                bb_upper = mavg + BB_DEVIATIONS * std
+                bb_lower = mavg - BB_DEVIATIONS * std
+
+            stoch = nan
+            if len(self.highs) == STOCH_WINDOW:
+                lowest, highest = min(self.lows), max(self.highs)
+                stoch = 100 * (self.prev_close - lowest) / np.float64(highest - lowest)
+
+            mfi = nan
+            if len(self.money_flows) == MFI_WINDOW:
+                flows = np.array(self.money_flows)
+                positive = flows[flows >= 0].sum()
+                negative = -flows[flows < 0].sum()
+                mfi = 100 - 100 / (1 + positive / np.float64(negative))
+
+        slope = nan
+        if len(self.obvs) == OBV_SLOPE_BARS + 1:
+            slope = (self.obvs[-1] - self.obvs[0]) / OBV_SLOPE_BARS
+
+        return {
+            "macd": np.array([self.prev_macd, macd]),
+            "macd_signal": np.array([self.prev_macd_signal, macd_signal]),
+            "rsi": np.array([nan, rsi]),
+            "bb_upper": np.array([nan, bb_upper]),
+            "bb_lower": np.array([nan, bb_lower]),
+            "obv": np.array([nan, self.obv]),
+            "obv_slope": np.array([nan, slope]),
+            "stoch": np.array([nan, stoch]),
+            "mfi": np.array([nan, mfi]),
+            "close": np.array([nan, self.prev_close]),
+        }
+
+    def is_current(self, now: float | None = None) -> bool:
+        """Whether the latest closed candle has already been applied"""
+        return (
+            self.last_timestamp is not None
+            and self.last_timestamp >= last_closed_candle(self.timeframe, now)
+        )
+
+    def to_dict(self) -> dict:
+        data = {
+            key: value
+            for key, value in self.__dict__.items()
+            if not isinstance(value, deque)
+        }
+        for key, value in self.__dict__.items():
+            if isinstance(value, deque):
+                data[key] = list(value)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IndicatorState":
+        state = cls(data["symbol"], data["timeframe"], data.get("exchange"))
+        for key, value in data.items():
+            if key == "_id":
+                continue
+            current = getattr(state, key, None)
+            if isinstance(current, deque):
+                current.extend(value)
+            else:
+                setattr(state, key, value)
+        return state
+
+    @classmethod
+    def seed(cls, symbol: str, timeframe: str, df, exchange: str | None = None):
+        """Build the state from closed candles of an OHLCV DataFrame"""
+        state = cls(symbol, timeframe, exchange)
+        state.extend(df)
+        return state
+
+    def extend(self, df) -> int:
+        """Apply every closed candle of an OHLCV DataFrame, return how many were new"""
+        timestamps = df.index.as_unit("ms").asi8
+        applied = 0
+        for timestamp, high, low, close, volume in zip(
+            timestamps,
+            df["high"].values,
+            df["low"].values,
+            df["close"].values,
+            df["volume"].values,
+        ):
+            applied += self.update(
+                int(timestamp), float(high), float(low), float(close), float(volume)
+            )
+        return applied
+
+
+class IndicatorStateStore:
+    """IndicatorState per (symbol, timeframe), persisted in db.indicator_state"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.states: dict[tuple[str, str], IndicatorState] = {}
+
+    async def load(self):
+        async for doc in self.db.indicator_state.find({}):
+            state = IndicatorState.from_dict(doc)
+            self.states[(state.symbol, state.timeframe)] = state
+
+    async def save(self, state: IndicatorState):
+        self.states[(state.symbol, state.timeframe)] = state
+        await self.db.indicator_state.update_one(
+            {"symbol": state.symbol, "timeframe": state.timeframe},
+            {"$set": state.to_dict()},
+            upsert=True,
+        )
+
+    async def get(
+        self, price_bot, symbol: str, timeframe: str
+    ) -> IndicatorState | None:
+        """
+        Return the up to date state, touching the exchange only when needed
+
+        A state that already holds the latest closed candle is returned as is.
+        A stale one is caught up with the missing candles, and a missing one
+        is seeded from INDICATOR_WINDOW candles of history.
+        """
+        state = self.states.get((symbol, timeframe))
+        if state is None:
+            doc = await self.db.indicator_state.find_one(
+                {"symbol": symbol, "timeframe": timeframe}
+            )
+            if doc:
+                state = IndicatorState.from_dict(doc)
+                self.states[(symbol, timeframe)] = state
+        if state is not None and len(state.kernel_closes) < min(
+            state.bars, KERNEL_HISTORY
+        ):
+            # Saved before the kernel closes were kept, start over from history
+            state = None
+        if state is not None and state.is_current():
+            return state
+
+        closed_until = last_closed_candle(timeframe)
+        if state is None:
+            df, exchange = await price_bot.fetch_ohlcv_data(
+                symbol, timeframe, INDICATOR_WINDOW + 1
+            )
+            if df is None or df.empty:
+                return None
+            df = df[df.index.as_unit("ms").asi8 <= closed_until]
+            state = IndicatorState.seed(symbol, timeframe, df, exchange)
+        else:
+            missing = (closed_until - state.last_timestamp) // (
+                timeframe_to_seconds(timeframe) * 1000
+            )
+            if missing > INDICATOR_WINDOW:
+                # Too far behind to catch up, start over from history
+                self.states.pop((symbol, timeframe), None)
+                await self.db.indicator_state.delete_one(
+                    {"symbol": symbol, "timeframe": timeframe}
+                )
+                return await self.get(price_bot, symbol, timeframe)
+            df, _ = await price_bot.fetch_ohlcv_data(
+                symbol, timeframe, int(missing) + 1, since=state.last_timestamp + 1
+            )
+            if df is None or df.empty:
+                return state
+            state.extend(df[df.index.as_unit("ms").asi8 <= closed_until])
+
+        await self.save(state)
+        return state
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    from src.services.indicator_engine import compute_indicators, signal_votes
+
+    rng = np.random.default_rng(3)
+    n_bars = 400
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+    spread = np.abs(rng.normal(0, 0.005, (2, n_bars))) * close
+    df = pd.DataFrame(
+        {
+            "high": close + spread[0],
+            "low": close - spread[1],
+            "close": close,
+            "volume": rng.uniform(100, 1000, n_bars),
+        },
+        index=pd.date_range("2024-01-01", periods=n_bars, freq="h"),
+    )
+
+    state = IndicatorState.seed("TEST/USDT", "1h", df.iloc[:-50])
+    state = IndicatorState.from_dict(state.to_dict())
+    state.extend(df.iloc[-60:])
+    expected = compute_indicators(*(df[c].values for c in df.columns))
+    latest = state.indicators()
+    for name in (
+        "macd",
+        "macd_signal",
+        "rsi",
+        "bb_upper",
+        "bb_lower",
+        "obv",
+        "stoch",
+        "mfi",
+    ):
+        np.testing.assert_allclose(latest[name][-1], expected[name][-1], rtol=1e-9)
+    np.testing.assert_allclose(latest["macd"][0], expected["macd"][-2], rtol=1e-9)
+    votes = signal_votes(latest)
+    expected_votes = signal_votes(expected)
+    assert all(votes[name][-1] == expected_votes[name][-1] for name in votes)
+    print("IndicatorState matches compute_indicators")
@@ -1,11 +1,32 @@
 import json
 import re
+
+import numpy as np
+import pandas as pd
 import ta
 from tabulate import tabulate
 
+from src.services.compute import compute_executor
+from src.services.indicator_engine import (
+    INDICATOR_WINDOW,
+    compute_indicators,
+    overall_vote,
+    signal_votes,
+)
+from src.services.kernel_tuning import (
+    DEFAULT_BANDWIDTH,
+    DEFAULT_KERNEL,
+    KERNEL_HISTORY,
+    kernel_params,
+)
+from src.services.signal_result import SignalResult, analyse_signal
+from src.utils import timeframe_to_seconds
+
 
 def calculate_macd(prices_df):
-    macd = ta.trend.MACD(prices_df["close"], 12, 26, 9)
+    macd = ta.trend.MACD(
+        prices_df["close"], window_slow=26, window_fast=12, window_sign=9
+    )
     return macd.macd(), macd.macd_signal()
 
 
@@ -38,168 +59,138 @@ def calculate_mfi(prices_df):
     return mfi.money_flow_index()
 
 
-def format_indicator_message(price, reasoning, overall_signal, confidence):
-    # Signal emoji mapping
-    signal_emojis = {"bullish": "🟢", "bearish": "🔴", "neutral": "⚪"}
-
-    # Format header
-    message = [
-        f"💰 Price: ${price:.4f} USDT",
-        f"📊 Signal: {signal_emojis[overall_signal]} {overall_signal.upper()}",
-        f"🎯 Confidence: {confidence:.1%}\n",
-    ]
-
-    # Format indicators
-    for indicator, data in reasoning.items():
-        signal = data["signal"]
-        details = data["details"]
-        emoji = signal_emojis[signal]
+def indicator_arrays(prices_df, window: int | None = INDICATOR_WINDOW) -> dict:
+    """Compute every quant_agent indicator from an OHLCV DataFrame in one pass"""
+    return compute_indicators(
+        prices_df["high"].values,
+        prices_df["low"].values,
+        prices_df["close"].values,
+        prices_df["volume"].values,
+        window=window,
+    )
 
-        if indicator == "MACD":
-            message.append(f"{emoji} MACD: {details}")
-        elif indicator == "RSI":
-            message.append(f"{emoji} RSI(14): {details}")
-        elif indicator == "Bollinger":
-            message.append(f"{emoji} BBands: {details}")
-        elif indicator == "OBV":
-            message.append(f"{emoji} OBV: {details}")
-        elif indicator == "STOCH":
-            message.append(f"{emoji} STOCH: {details}")
-        elif indicator == "MFI":
-            message.append(f"{emoji} MFI(14): {details}")
 
-    return "\n".join(message)
+def indicator_signals(prices_df) -> pd.DataFrame:
+    """
+    Bullish (1) / bearish (-1) / neutral (0) signal of every indicator on every bar
+
+    Applies the same rules as quant_agent, but to the whole series at once.
+    The "overall" column is the majority vote used by quant_agent.
+    """
+    votes = signal_votes(indicator_arrays(prices_df, window=None))
+    signals = pd.DataFrame(votes, index=prices_df.index)
+    signals["overall"], _ = overall_vote(votes)
+    return signals
+
+
+def resample_ohlcv(df, timeframe: str) -> pd.DataFrame:
+    """
+    Resample finer OHLCV candles to a coarser timeframe
+
+    Buckets are aligned to UTC like the exchange candles. A leading bucket
+    that is only partly covered by df is dropped; the last bucket is kept,
+    it is still open just like the last candle of df.
+    """
+    rule = timeframe.replace("m", "min").replace("d", "D")
+    resampled = df.resample(rule, label="left", closed="left")
+    candles = resampled.agg(
+        {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"}
+    ).dropna()
+    base_seconds = (df.index[1] - df.index[0]).total_seconds()
+    expected = timeframe_to_seconds(timeframe) / base_seconds
+    counts = resampled["close"].count().reindex(candles.index)
+    first_full = counts.index[counts >= expected]
+    if len(first_full):
+        candles = candles[candles.index >= first_full[0]]
+    return candles
+
+
+def confluence_analysis(
+    symbol: str,
+    frames: dict,
+    kernel_settings: dict | None = None,
+    exchange: str | None = None,
+) -> dict:
+    """
+    Run the quant_agent indicators on several timeframes at once
+
+    Each timeframe is computed on the last INDICATOR_WINDOW closed candles
+    it has, like /signal on that timeframe alone. The timeframes with as
+    many candles are stacked, so they share a single vectorized call.
+
+    Args:
+        symbol: Symbol the frames belong to
+        frames: OHLCV DataFrames keyed by timeframe, last candle still open
+        kernel_settings: (bandwidth, kernel_type) per timeframe, defaults otherwise
+        exchange: Exchange the frames were fetched from
+
+    Returns:
+        dict: SignalResult of the last closed candle, keyed by timeframe
+    """
+    closed = {tf: df.iloc[:-1] for tf, df in frames.items()}
+    # A short frame (4h over the history of the shorter timeframes) must not
+    # cut the others, that would change their indicators
+    lengths = {}
+    for tf, df in closed.items():
+        lengths.setdefault(min(INDICATOR_WINDOW, len(df)), []).append(tf)
+    indicators = {}
+    for n_bars, timeframes in lengths.items():
+        arrays = [
+            np.vstack([closed[tf][column].values[-n_bars:] for tf in timeframes])
+            for column in ("high", "low", "close", "volume")
+        ]
+        stacked = compute_indicators(*arrays)
+        for i, tf in enumerate(timeframes):
+            indicators[tf] = {name: values[i] for name, values in stacked.items()}
+    kernel_settings = kernel_settings or {}
+
+    return {
+        tf: analyse_signal(
+            indicators[tf],
+            df["close"].values[-KERNEL_HISTORY:],
+            symbol,
+            tf,
+            df.index[-1:].as_unit("ms").asi8[0],
+            exchange,
+            *kernel_settings.get(tf, (DEFAULT_BANDWIDTH, DEFAULT_KERNEL)),
+        )
+        for tf, df in closed.items()
+    }
 
 
 ##### Quantitative Agent #####
-async def quant_agent(prices_df):
+async def quant_agent(
+    prices_df, symbol: str, timeframe: str, exchange: str | None = None
+) -> SignalResult:
     """Analyzes technical indicators and generates trading signals."""
-    # Calculate indicators
-    # 1. MACD (Moving Average Convergence Divergence)
-    macd_line, signal_line = calculate_macd(prices_df)
-
-    # 2. RSI (Relative Strength Index)
-    rsi = calculate_rsi(prices_df)
-
-    # 3. Bollinger Bands (Bollinger Bands)
-    upper_band, lower_band = calculate_bollinger_bands(prices_df)
-
-    # 4. OBV (On-Balance Volume)
-    obv = calculate_obv(prices_df)
-
-    # 5. Stochastic Oscillator
-    stoch = calculate_stoch(prices_df)
-
-    # 6. Money Flow Index
-    mfi = calculate_mfi(prices_df)
-
-    # Generate individual signals
-    signals = []
-
-    # MACD signal
-    if (
-        macd_line.iloc[-2] < signal_line.iloc[-2]
-        and macd_line.iloc[-1] > signal_line.iloc[-1]
-    ):
-        signals.append("bullish")
-    elif (
-        macd_line.iloc[-2] > signal_line.iloc[-2]
-        and macd_line.iloc[-1] < signal_line.iloc[-1]
-    ):
-        signals.append("bearish")
-    else:
-        signals.append("neutral")
-
-    # RSI signal
-    if rsi.iloc[-1] <= 30:
-        signals.append("bullish")
-    elif rsi.iloc[-1] >= 70:
-        signals.append("bearish")
-    else:
-        signals.append("neutral")
-
-    # Bollinger Bands signal
-    current_price = prices_df["close"].iloc[-1]
-    if current_price < lower_band.iloc[-1]:
-        signals.append("bullish")
-    elif current_price > upper_band.iloc[-1]:
-        signals.append("bearish")
-    else:
-        signals.append("neutral")
-
-    # OBV signal
-    obv_slope = obv.diff().iloc[-5:].mean()
-    if obv_slope > 0:
-        signals.append("bullish")
-    elif obv_slope < 0:
-        signals.append("bearish")
-    else:
-        signals.append("neutral")
-
-    # STOCH signal
-    if stoch.iloc[-1] <= 20:
-        signals.append("bullish")
-    elif stoch.iloc[-1] >= 80:
-        signals.append("bearish")
-    else:
-        signals.append("neutral")
-
-    # MFI signal
-    if mfi.iloc[-1] <= 20:
-        signals.append("bullish")
-    elif mfi.iloc[-1] >= 80:
-        signals.append("bearish")
-    else:
-        signals.append("neutral")
-
-    # Add reasoning collection
-    reasoning = {
-        "MACD": {
-            "signal": signals[0],
-            "details": f"{'Line crossed above' if signals[0] == 'bullish' else 'Line crossed below' if signals[0] == 'bearish' else 'no cross'} Signal Line",
-        },
-        "RSI": {
-            "signal": signals[1],
-            "details": f"{rsi.iloc[-1]:.2f} ({'oversold' if signals[1] == 'bullish' else 'overbought' if signals[1] == 'bearish' else 'neutral'})",
-        },
-        "Bollinger": {
-            "signal": signals[2],
-            "details": f"{'below lower band' if signals[2] == 'bullish' else 'above upper band' if signals[2] == 'bearish' else 'within bands'}",
-        },
-        "OBV": {
-            "signal": signals[3],
-            "details": f"Slope: {obv_slope:.2f} ({signals[3]})",
-        },
-        "STOCH": {
-            "signal": signals[4],
-            "details": f"{stoch.iloc[-1]:.2f} ({signals[4]})",
-        },
-        "MFI": {
-            "signal": signals[5],
-            "details": f"{mfi.iloc[-1]:.2f} ({'oversold' if signals[5] == 'bullish' else 'overbought' if signals[5] == 'bearish' else 'neutral'})",
-        },
-    }
-
-    # Determine overall signal
-    bullish_signals = signals.count("bullish")
-    bearish_signals = signals.count("bearish")
-
-    if bullish_signals > bearish_signals:
-        overall_signal = "bullish"
-    elif bearish_signals > bullish_signals:
-        overall_signal = "bearish"
-    else:
-        overall_signal = "neutral"
-
-    # Calculate confidence level based on the proportion of indicators agreeing
-    total_signals = len(signals)
-    confidence = max(bullish_signals, bearish_signals) / total_signals
+    # MACD, RSI, Bollinger Bands, OBV, Stochastic Oscillator and Money Flow
+    # Index, computed together over the trailing window only, off the event loop
+    return await compute_executor.run(
+        quant_agent_sync,
+        prices_df,
+        symbol,
+        timeframe,
+        exchange,
+        *kernel_params.get(symbol, timeframe),
+    )
 
-    message_body = []
-    for key, value in reasoning.items():
-        message_body.append((key, value["signal"], value["details"]))
 
-    message_content_string = format_indicator_message(
-        prices_df["close"].iloc[-1], reasoning, overall_signal, confidence
+def quant_agent_sync(
+    prices_df,
+    symbol: str,
+    timeframe: str,
+    exchange: str | None = None,
+    bandwidth: int = DEFAULT_BANDWIDTH,
+    kernel_type: str = DEFAULT_KERNEL,
+) -> SignalResult:
+    """Signal of the last candle of prices_df, which must only hold closed candles"""
+    return analyse_signal(
+        indicator_arrays(prices_df),
+        prices_df["close"].values[-KERNEL_HISTORY:],
+        symbol,
+        timeframe,
+        prices_df.index[-1:].as_unit("ms").asi8[0],
+        exchange,
+        bandwidth,
+        kernel_type,
     )
-    return message_content_string
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import time
+
+SETTLE_DELAY = 5  # Seconds after a boundary, for the exchange to close the candle
+
+
+class Job:
+    """A coroutine function run at every multiple of `interval` plus `offset`"""
+
+    def __init__(
+        self,
+        name: str,
+        func,
+        interval: float,
+        offset: float = 0,
+        settle: float = SETTLE_DELAY,
+        coalesce: bool = True,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.offset = offset
+        self.settle = settle
+        self.coalesce = coalesce
+        self.task: asyncio.Task | None = None
+        # Scheduled time of a run that came due while the job was running
+        self.pending: float | None = None
+        self.runs = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def next_run(self, now: float) -> float:
+        """First scheduled time (wall clock) after now"""
+        boundary = ((now - self.offset - self.settle) // self.interval + 1) * (
+            self.interval
+        )
+        return boundary + self.offset + self.settle
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "last_duration": round(self.last_duration, 3),
+            "max_duration": round(self.max_duration, 3),
+            "last_lateness": round(self.last_lateness, 3),
+            "max_lateness": round(self.max_lateness, 3),
+        }
+
+
+class AlignedScheduler:
+    """
+    Runs jobs at wall clock boundaries, e.g. every candle close of a timeframe
+
+    The loop sleeps until the next scheduled time instead of polling, so a
+    job starts within milliseconds of its boundary plus settle delay. A job
+    never runs twice at once: a run that comes due while the previous one
+    is still going is either coalesced into one run right after it, or
+    skipped. Duration and lateness (start time minus scheduled time) are
+    recorded per job.
+    """
+
+    def __init__(self):
+        self.jobs: dict[str, Job] = {}
+        self._queue: list[tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self.is_running = False
+
+    def every(self, name: str, interval: float, func, **kwargs) -> Job:
+        """
+        Add a job, names must be unique
+
+        Args:
+            name: Name of the job in the stats
+            interval: Seconds between two runs, aligned to the epoch
+            func: Coroutine function called without arguments
+            **kwargs: offset, settle and coalesce of Job
+        """
+        job = Job(name, func, interval, **kwargs)
+        self.jobs[name] = job
+        heapq.heappush(self._queue, (job.next_run(time.time()), name))
+        self._wakeup.set()
+        return job
+
+    async def run(self):
+        self.is_running = True
+        while self.is_running:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            scheduled, name = self._queue[0]
+            delay = scheduled - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._queue)
+            job = self.jobs.get(name)
+            if job is None:
+                continue
+            # Boundaries missed while the loop was blocked are not replayed
+            next_run = job.next_run(max(scheduled, time.time()))
+            heapq.heappush(self._queue, (next_run, name))
+            self._fire(job, scheduled)
+
+    def _fire(self, job: Job, scheduled: float):
+        if job.task is not None and not job.task.done():
+            if not job.coalesce:
+                job.skipped += 1
+            elif job.pending is None:
+                job.pending = scheduled
+            else:
+                job.coalesced += 1
+            return
+        job.task = asyncio.create_task(self._run_job(job, scheduled))
+
+    async def _run_job(self, job: Job, scheduled: float):
+        while True:
+            job.last_lateness = time.time() - scheduled
+            job.max_lateness = max(job.max_lateness, job.last_lateness)
+            started_at = time.monotonic()
+            try:
+                await job.func()
+            except Exception as e:  # noqa: BLE001 - a failed run must not end the job
+                job.failures += 1
+                print(f"Error in job {job.name}: {e}")
+            job.runs += 1
+            job.last_duration = time.monotonic() - started_at
+            job.max_duration = max(job.max_duration, job.last_duration)
+            if job.pending is None:
+                return
+            scheduled, job.pending = job.pending, None
+
+    def stop(self):
+        self.is_running = False
+        self._wakeup.set()
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+        self.jobs.clear()
+        self._queue.clear()
+
+    def stats(self) -> dict:
+        return {name: job.stats() for name, job in self.jobs.items()}
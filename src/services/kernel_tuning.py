@@ -0,0 +1,189 @@
+import asyncio
+import itertools
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from src.services.compute import compute_executor
+
+DEFAULT_BANDWIDTH = 14
+DEFAULT_KERNEL = "laplace"
+
+TUNING_BANDWIDTHS = tuple(range(4, 41, 2))
+# "tent" is left out because it is the same function as "triangular"
+TUNING_KERNELS = (
+    "gaussian",
+    "triangular",
+    "epanechnikov",
+    "logistic",
+    "loglogistic",
+    "cosine",
+    "sinc",
+    "laplace",
+    "quartic",
+    "parabolic",
+    "exponential",
+    "silverman",
+    "cauchy",
+    "wave",
+    "power",
+    "morters",
+)
+# The repainting regression only looks bandwidth bars around a bar, so the
+# signal of the latest candle never needs more closes than this
+KERNEL_HISTORY = max(TUNING_BANDWIDTHS) + 4
+TUNING_FOLDS = 3  # Consecutive out-of-sample segments every pair is scored on
+# Log return charged per signal on top of the fees, so that of two pairs
+# trading about as well the one sending fewer signals wins
+TUNING_NOISE_PENALTY = 0.001
+
+
+def evaluate_kernel_grid(
+    data,
+    bandwidths=TUNING_BANDWIDTHS,
+    kernels=TUNING_KERNELS,
+    folds=TUNING_FOLDS,
+    noise_penalty=TUNING_NOISE_PENALTY,
+):
+    """
+    Score every (bandwidth, kernel) pair on a price series in one pass
+
+    Each pair is scored on the signals it would have sent live: the
+    repainting regression as SignalService reads it, replayed over every bar
+    with backtest.kernel_events (one matrix product for all pairs). Every
+    signal only uses the bars up to its own, so the trades are out of
+    sample. The signals are traded long only with fees, separately on
+    `folds` consecutive segments, and the score is the mean log return per
+    segment: noisy pairs pay the fees of every flip, plus noise_penalty
+    per signal.
+
+    Parameters:
+        data (np.array): Closed-candle prices, oldest first
+        bandwidths (iterable[int]): Bandwidths to evaluate
+        kernels (iterable[str]): Kernel types to evaluate
+        folds (int): Number of segments the score is averaged over
+        noise_penalty (float): Cost per signal, as a log return
+
+    Returns:
+        tuple: (scores of shape (n_params,), higher is better, list of (bandwidth, kernel))
+    """
+    # backtest imports the defaults of this module
+    from src.services.backtest import (
+        evaluate_events,
+        kernel_events,
+        live_kernel_filters,
+    )
+
+    data = np.asarray(data, dtype=float)
+    params = [
+        (int(bandwidth), kernel)
+        for kernel in kernels
+        for bandwidth in sorted(set(bandwidths))
+    ]
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        filters = live_kernel_filters(params)
+    warmup = filters.shape[-1]
+    if len(data) < warmup + folds * warmup:
+        raise ValueError(f"Need at least {warmup * (folds + 1)} bars of data")
+
+    closes = data[None, :]
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        events = kernel_events(closes, params)
+    # A pair whose weights are not finite never signals, it is left out
+    valid = np.isfinite(filters).all(axis=(0, 2))
+
+    scores = np.zeros(len(params))
+    bounds = np.linspace(warmup, len(data), folds + 1).astype(int)
+    for start, end in itertools.pairwise(bounds):
+        stats = evaluate_events(closes[:, start:end], events[..., start:end])
+        signals = np.count_nonzero(events[..., start:end], axis=-1)[:, 0]
+        scores += np.log1p(stats["pnl"][:, 0]) - noise_penalty * signals
+    scores = np.where(valid, scores / folds, np.nan)
+    return scores, params
+
+
+def best_kernel_params(data, **kwargs) -> dict:
+    """Return the best scoring bandwidth and kernel for a price series"""
+    scores, params = evaluate_kernel_grid(data, **kwargs)
+    best = int(np.nanargmax(scores))
+    bandwidth, kernel_type = params[best]
+    return {
+        "bandwidth": bandwidth,
+        "kernel_type": kernel_type,
+        "score": float(scores[best]),
+    }
+
+
+class KernelParamStore:
+    """In-memory lookup of tuned kernel parameters per (symbol, timeframe)"""
+
+    def __init__(self):
+        self._params: dict[tuple[str, str], tuple[int, str]] = {}
+
+    def get(self, symbol: str, timeframe: str) -> tuple[int, str]:
+        return self._params.get(
+            (symbol, timeframe), (DEFAULT_BANDWIDTH, DEFAULT_KERNEL)
+        )
+
+    def set(self, symbol: str, timeframe: str, bandwidth: int, kernel_type: str):
+        self._params[(symbol, timeframe)] = (bandwidth, kernel_type)
+
+    async def load(self, db: AsyncIOMotorDatabase):
+        async for doc in db.kernel_params.find({}, {"_id": 0}):
+            self.set(
+                doc["symbol"], doc["timeframe"], doc["bandwidth"], doc["kernel_type"]
+            )
+
+    async def save(
+        self, db: AsyncIOMotorDatabase, symbol: str, timeframe: str, result: dict
+    ):
+        self.set(symbol, timeframe, result["bandwidth"], result["kernel_type"])
+        await db.kernel_params.update_one(
+            {"symbol": symbol, "timeframe": timeframe},
+            {"$set": {"symbol": symbol, "timeframe": timeframe, **result}},
+            upsert=True,
+        )
+
+
+kernel_params = KernelParamStore()
+
+
+async def tune_kernel_params(
+    db: AsyncIOMotorDatabase,
+    price_bot,
+    symbols: list[str],
+    timeframes: list[str],
+    limit: int = 1000,
+) -> int:
+    """
+    Tune and store the kernel parameters for every (symbol, timeframe)
+
+    Args:
+        db: Database holding the kernel_params collection
+        price_bot: CryptoPriceBot used to fetch the candles
+        symbols: Symbols to tune
+        timeframes: Timeframes to tune
+        limit: Number of candles to tune on
+
+    Returns:
+        int: Number of (symbol, timeframe) pairs tuned
+    """
+
+    async def tune_one(symbol: str, timeframe: str) -> bool:
+        df, _ = await price_bot.fetch_ohlcv_data(symbol, timeframe, limit)
+        if df is None or df.empty:
+            return False
+        try:
+            # The last candle is still open, tune on closed candles only
+            result = await compute_executor.run(
+                best_kernel_params, df["close"].values[:-1]
+            )
+        except ValueError as e:
+            print(f"Skipping kernel tuning for {symbol} {timeframe}: {e}")
+            return False
+        await kernel_params.save(db, symbol, timeframe, result)
+        return True
+
+    tasks = [tune_one(symbol, tf) for symbol in symbols for tf in timeframes]
+    results = await asyncio.gather(*tasks)
+    return sum(results)
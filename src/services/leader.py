@@ -0,0 +1,213 @@
+import asyncio
+import os
+import socket
+import time
+from datetime import UTC, datetime, timedelta
+from uuid import uuid4
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+LEASE_TTL = 30  # Seconds a lease lasts without heartbeat, the failover time
+LEASE_NAME = "background_monitors"
+
+
+class LeaderLease:
+    """
+    Lease in db.leases that at most one bot replica holds at a time
+
+    The holder renews it every ttl / 3 seconds. Another replica takes the
+    lease over once it expired, so a replica that died is replaced within
+    ttl seconds. A holder that cannot renew steps down before its lease may
+    expire. Expiries are set and compared on the Mongo clock ($$NOW), so a
+    replica whose clock is off cannot take a lease that is still valid.
+    A TTL index removes the lease documents left behind.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        name: str = LEASE_NAME,
+        ttl: float = LEASE_TTL,
+    ):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = ttl / 3
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.is_leader = False
+        self.renewed_at = 0.0
+        self.elections = 0
+
+    async def try_acquire(self) -> bool:
+        """Take or renew the lease, True if this replica holds it now"""
+        try:
+            # An update pipeline, for $$NOW: the server clock decides
+            lease = await self.db.leases.find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$expr": {
+                        "$or": [
+                            {"$eq": ["$holder", self.holder]},
+                            {"$lt": ["$expires_at", "$$NOW"]},
+                        ]
+                    },
+                },
+                [
+                    {
+                        "$set": {
+                            "holder": self.holder,
+                            "expires_at": {"$add": ["$$NOW", self.ttl * 1000]},
+                        }
+                    }
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Held by another replica, the upsert collided with its document
+            return False
+        return lease is not None and lease["holder"] == self.holder
+
+    async def release(self):
+        # Also after stepping down, the lease may still be held in the db
+        self.is_leader = False
+        await self.db.leases.delete_one({"_id": self.name, "holder": self.holder})
+
+    async def renew(self) -> bool:
+        """
+        try_acquire, given up before the lease of a leader may have expired
+
+        A leader must know it is still leading ttl - heartbeat seconds after
+        its last renewal at the latest, however long the server takes.
+        """
+        if self.is_leader:
+            timeout = self.ttl - self.heartbeat - (time.monotonic() - self.renewed_at)
+        else:
+            timeout = self.heartbeat
+        try:
+            acquired = await asyncio.wait_for(self.try_acquire(), max(timeout, 0))
+        except (TimeoutError, PyMongoError) as e:
+            print(f"Error renewing the {self.name} lease: {str(e) or type(e).__name__}")
+            # Keep leading only while the lease surely has not expired
+            return (
+                self.is_leader
+                and time.monotonic() - self.renewed_at < self.ttl - self.heartbeat
+            )
+        if acquired:
+            self.renewed_at = time.monotonic()
+        return acquired
+
+    async def step_down(self, on_demoted):
+        self.is_leader = False
+        print(f"{self.holder} lost the lead of {self.name}")
+        await on_demoted()
+
+    async def run(self, on_elected, on_demoted):
+        """
+        Keep competing for the lease, calling the callbacks on every change
+
+        Never returns: an error, including one of the callbacks, is logged
+        and the replica competes again on the next heartbeat. A leader whose
+        on_elected failed steps down, so another replica can take over.
+
+        Args:
+            on_elected: Coroutine function starting the leader only work
+            on_demoted: Coroutine function stopping it
+        """
+        indexed = False
+        while True:
+            try:
+                if not indexed:
+                    await self.db.leases.create_index(
+                        "expires_at", expireAfterSeconds=0
+                    )
+                    indexed = True
+                acquired = await self.renew()
+                if acquired and not self.is_leader:
+                    self.is_leader = True
+                    self.elections += 1
+                    print(f"{self.holder} is now the leader of {self.name}")
+                    await on_elected()
+                elif not acquired and self.is_leader:
+                    await self.step_down(on_demoted)
+            except Exception as e:  # noqa: BLE001 - includes the callbacks, compete again
+                print(f"Error in the {self.name} lease loop: {e}")
+                if self.is_leader:
+                    try:
+                        await self.step_down(on_demoted)
+                        await self.release()
+                    except Exception as e:  # noqa: BLE001 - includes on_demoted
+                        print(f"Error stepping down from {self.name}: {e}")
+            await asyncio.sleep(self.heartbeat)
+
+
+if __name__ == "__main__":
+    # Failover on a stand-in db.leases that applies the lease update the way
+    # the server does, on its own clock: the leader dies without releasing,
+    # the standby must take over within the TTL, and not before it
+
+    class StandInLeases:
+        def __init__(self):
+            self.docs = {}
+
+        async def create_index(self, *args, **kwargs):
+            pass
+
+        async def find_one_and_update(self, filter, update, **kwargs):
+            now = datetime.now(UTC)
+            doc = self.docs.get(filter["_id"])
+            changes = update[0]["$set"]
+            if doc is not None:
+                holder = filter["$expr"]["$or"][0]["$eq"][1]
+                if doc["holder"] != holder and doc["expires_at"] >= now:
+                    # No match, the upsert collides with the existing _id
+                    raise DuplicateKeyError("lease held by another replica")
+            milliseconds = changes["expires_at"]["$add"][1]
+            self.docs[filter["_id"]] = {
+                "_id": filter["_id"],
+                "holder": changes["holder"],
+                "expires_at": now + timedelta(milliseconds=milliseconds),
+            }
+            return dict(self.docs[filter["_id"]])
+
+        async def delete_one(self, filter):
+            doc = self.docs.get(filter["_id"])
+            if doc is not None and doc["holder"] == filter["holder"]:
+                del self.docs[filter["_id"]]
+
+    class StandInDb:
+        leases = StandInLeases()
+
+    async def main():
+        db = StandInDb()
+        leaders = []
+
+        def elected(lease):
+            async def callback():
+                leaders.append((lease.holder, time.monotonic()))
+
+            return callback
+
+        async def demoted():
+            pass
+
+        first, second = LeaderLease(db, ttl=3), LeaderLease(db, ttl=3)
+        first_task = asyncio.create_task(first.run(elected(first), demoted))
+        await asyncio.sleep(0.5)
+        second_task = asyncio.create_task(second.run(elected(second), demoted))
+        await asyncio.sleep(3)
+        assert [holder for holder, _ in leaders] == [first.holder]
+
+        first_task.cancel()
+        died_at = time.monotonic()
+        while len(leaders) < 2:
+            await asyncio.sleep(0.1)
+        assert leaders[1][0] == second.holder
+        failover = leaders[1][1] - died_at
+        assert failover <= second.ttl + second.heartbeat
+        print(f"Failover after {failover:.1f}s (TTL {second.ttl}s)")
+        second_task.cancel()
+
+    asyncio.run(main())
@@ -1,140 +1,432 @@
 import asyncio
-from collections import defaultdict
-from datetime import datetime
+import time
+from datetime import UTC, datetime
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
 from telethon import TelegramClient
 
+from src.services.alert_index import alert_index
+from src.services.alert_scheduler import AlertScheduler
+from src.services.bulk_writer import BulkWriter
+from src.services.chat_sync import ALERTS, mark_changed
+from src.services.config_cache import DEFAULT_CONFIG, ConfigCache
+from src.services.monitor_store import AlertStore
+from src.services.outbound import OutboundQueue
 from src.services.price_bot import CryptoPriceBot
+from src.services.sharding import Shard
+from src.services.snapshot import SNAPSHOT_INTERVAL, SnapshotStore
+
+TICK_INTERVAL = 5  # Seconds between two looks for symbols due for a check
+MAX_CONCURRENT_FETCHES = 10
+# A triggered alert is re-armed once the price moved this much further away
+# than the user's price_threshold, so one crossing sends one notification
+REARM_BAND = 0.005
+
+ARMED = "armed"
+TRIGGERED = "triggered"
 
 
 class MonitorService:
-    def __init__(self, db: AsyncIOMotorDatabase, client: TelegramClient):
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        client: TelegramClient,
+        config_cache: ConfigCache | None = None,
+        outbound: OutboundQueue | None = None,
+        shard: Shard | None = None,
+    ):
         self.db = db
         self.client = client
+        self.config_cache = config_cache or ConfigCache(db)
+        self.outbound = outbound or OutboundQueue(client)
+        # Only the chats of this shard are monitored, all of them if None
+        self.shard = shard
+        self.alerts = AlertStore(db)
+        # Alert states and trigger history, written once per cycle
+        self.bookkeeping = BulkWriter(db.price_alerts)
+        self.snapshots = SnapshotStore(db)
+        self.snapshot_name = "monitor_service" + (f":{shard.name}" if shard else "")
+        self.snapshot_at = 0.0
+        self.started_at = None
+        self.steady_after = None
         self.is_running = False
         self.user_last_alert = {}
+        # Chat -> messages of the alerts triggered during its alert_interval
+        self.held: dict[int, list[str]] = {}
+        self.last_cycle = {}
+        self.scheduler = AlertScheduler()
+        # Symbol -> ids of its triggered alerts, waiting to be re-armed
+        self.triggered: dict[str, set[str]] = {}
 
     async def get_all_monitors(self, chat_id) -> list[dict]:
-        query = await self.db.alerts.find_one({"chat_id": chat_id})
-        if query:
-            return query.get("data", [])
-        return []
+        return await self.alerts.chat_alerts(chat_id)
 
     @classmethod
     async def add_monitor(cls, db, chat_id: int, data: dict):
-        # find if the user already has a monitor for the symbol
-        # alerts has 2 fields: chat_id and data
-        monitor = await db.alerts.find_one({"chat_id": chat_id})
-
-        if not monitor:
-            monitor = {"chat_id": chat_id, "data": []}
-        symbol = data.get("symbol")
-        price = data.get("price")
-        msg = data.get("msg", None)
-        monitor["data"].append({"symbol": symbol, "price": price, "msg": msg})
-        await db.alerts.update_one({"chat_id": chat_id}, {"$set": monitor}, upsert=True)
-        return len(monitor["data"])
+        # One document per alert, see AlertStore
+        store = AlertStore(db)
+        await store.add(
+            chat_id,
+            {
+                "symbol": data.get("symbol"),
+                "price": data.get("price"),
+                "msg": data.get("msg", None),
+                "state": ARMED,
+            },
+        )
+        await mark_changed(db, chat_id, ALERTS)
+        alerts = await store.chat_alerts(chat_id)
+        alert_index.update_chat(chat_id, alerts)
+        return len(alerts)
 
     @classmethod
     async def update_monitor(cls, db, chat_id: int, data: dict):
-        # find if the user already has a monitor for the symbol
         try:
-            monitor = await db.alerts.find_one({"chat_id": chat_id})
-
-            if not monitor:
-                monitor = {"chat_id": chat_id, "data": []}
-            alert_id = data["id"]
-            price = data["price"]
-            msg = data["msg"]
-            monitor["data"][alert_id - 1]["price"] = price
-            monitor["data"][alert_id - 1]["msg"] = msg
-            await db.alerts.update_one(
-                {"chat_id": chat_id}, {"$set": monitor}, upsert=True
+            store = AlertStore(db)
+            # The new target starts armed
+            alert = await store.update(
+                chat_id,
+                data["id"],
+                {"price": float(data["price"]), "msg": data["msg"], "state": ARMED},
             )
-            return monitor["data"][alert_id - 1]["symbol"]
+            if alert is None:
+                return None
+            await mark_changed(db, chat_id, ALERTS)
+            alert_index.update_chat(chat_id, await store.chat_alerts(chat_id))
+            return alert["symbol"]
         except Exception as e:
             print(f"Error updating monitor {str(e)}")
             return None
 
     @classmethod
     async def delete_monitor(cls, db, chat_id: int, id: int):
-        list_monitors = await db.alerts.find_one({"chat_id": chat_id})
-        if not list_monitors:
+        store = AlertStore(db)
+        if not await store.delete(chat_id, id):
             return False
+        await mark_changed(db, chat_id, ALERTS)
+        alert_index.update_chat(chat_id, await store.chat_alerts(chat_id))
+        return True
 
-        if id < 1 or id > len(list_monitors["data"]):
-            return False
+    def load_triggered(self):
+        self.triggered = {}
+        for alert_id, (_, alert) in alert_index.by_id.items():
+            if alert.get("state") == TRIGGERED:
+                self.triggered.setdefault(alert["symbol"], set()).add(alert_id)
 
-        list_monitors["data"].pop(id - 1)
+    def set_state(
+        self, alert: dict, state: str, updates: dict, record: dict | None = None
+    ):
+        """
+        Change the state of an alert, saved with the next bookkeeping flush
 
-        await db.alerts.update_one({"chat_id": chat_id}, {"$set": list_monitors})
+        Args:
+            alert: Alert of the alert index
+            state: ARMED or TRIGGERED
+            updates: alert_id -> state of the changes in this cycle
+            record: Update operators saved with the state, e.g. the trigger
+        """
+        alert["state"] = state
+        triggered = self.triggered.setdefault(alert["symbol"], set())
+        if state == TRIGGERED:
+            triggered.add(alert["alert_id"])
+        else:
+            triggered.discard(alert["alert_id"])
+        updates[alert["alert_id"]] = state
+        record = record or {}
+        # Matched on the price too, an alert edited by its user meanwhile is
+        # re-armed at its new target and must keep that state
+        self.bookkeeping.update_one(
+            {"_id": alert["alert_id"], "price": float(alert["price"])},
+            {**record, "$set": {"state": state, **record.get("$set", {})}},
+        )
 
-        return True
+    def rearm(self, symbol: str, low: float, high: float, updates: dict):
+        """
+        Re-arm the triggered alerts of a symbol that the range stayed away from
 
-    async def check_alerts(self):
-        while self.is_running:
-            all_users = await self.db.alerts.distinct("chat_id")
+        Each alert uses the price_threshold of its owner, read from the
+        config cache that get_active_users just filled, whether or not the
+        owner is due this cycle.
+        """
+        triggered = self.triggered.get(symbol, set())
+        for alert_id in list(triggered):
+            entry = alert_index.get(alert_id)
+            # Deleted, or edited (which re-arms it) since it triggered
+            if entry is None or entry[1].get("state") != TRIGGERED:
+                triggered.discard(alert_id)
+                continue
+            user, alert = entry
+            config = self.config_cache.configs.get(user) or DEFAULT_CONFIG
+            band = config["price_threshold"] / 100 + REARM_BAND
+            target_price = float(alert["price"])
+            if low > target_price * (1 + band) or high < target_price * (1 - band):
+                self.set_state(alert, ARMED, updates)
+        if not triggered:
+            self.triggered.pop(symbol, None)
+
+    async def save_states(self) -> dict:
+        """Flush the bookkeeping of the cycle, one bulk write per BULK_BATCH_SIZE"""
+        try:
+            return await self.bookkeeping.flush()
+        except PyMongoError as e:
+            print(f"Error saving alert states: {e}")
+            return {"operations": 0, "batches": 0, "errors": 0}
+
+    async def get_active_users(self) -> dict[int, dict]:
+        """
+        Config of every user with alerts turned on
+
+        A user waiting for alert_interval is active too: their alerts are
+        still evaluated, only the messages are held, see deliver.
+        """
+        if not alert_index.chats:
+            return {}
+
+        configs = await self.config_cache.get_many(list(alert_index.chats))
+        return {
+            user: config
+            for user, config in configs.items()
+            if config["is_alert"] == "on"
+        }
+
+    def deliver(self, messages: dict[int, list[str]], active: dict, now: float) -> int:
+        """
+        Send the alert messages of the cycle and the held ones now due
+
+        alert_interval throttles the messages sent to a user, never the
+        alerts: the ones triggered while it runs are held, then queued
+        together once it is over (the OutboundQueue merges them into as few
+        messages as fit). Held messages of a user who turned the alerts off
+        are dropped.
+
+        Returns:
+            int: Number of alert messages queued
+        """
+        for user, lines in messages.items():
+            self.held.setdefault(user, []).extend(lines)
+        queued = 0
+        for user in list(self.held):
+            config = active.get(user)
+            if config is None:
+                del self.held[user]
+                continue
+            if now - self.user_last_alert.get(user, 0) < config["alert_interval"] * 60:
+                continue
+            for line in self.held.pop(user):
+                self.outbound.send(user, line)
+                queued += 1
+            self.user_last_alert[user] = now
+        return queued
+
+    async def fetch_candles(
+        self, price_bot: CryptoPriceBot, symbols: list[str]
+    ) -> dict:
+        """1m candles since the last check of every symbol, fetched concurrently"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+        async def fetch(symbol):
+            since, limit = self.scheduler.candles_since(symbol)
+            async with semaphore:
+                return await price_bot.fetch_ohlcv_data(symbol, "1m", limit, since)
+
+        results = await asyncio.gather(*(fetch(symbol) for symbol in symbols))
+        return {
+            symbol: (df, exchange)
+            for symbol, (df, exchange) in zip(symbols, results)
+            if df is not None and not df.empty
+        }
+
+    async def run_cycle(self) -> dict:
+        """
+        Check the symbols whose alerts could have been reached by now
+
+        The AlertScheduler picks the due symbols within the request budget.
+        Each is fetched once, however many users watch it, and the alerts
+        touched by the high/low range since its previous check (wicks
+        included) are looked up in the alert index.
+
+        An armed alert that is hit becomes triggered and its message is sent
+        once, right away or when the user's alert_interval is over. It is
+        re-armed when a later range stays more than price_threshold plus
+        REARM_BAND away from its target. The state changes of the cycle and
+        the trigger history (last trigger time and price, trigger count) go
+        through the BulkWriter, flushed once at the end of the cycle.
+
+        Returns:
+            dict: Statistics of the cycle
+        """
+        start_time = time.perf_counter()
+        config_queries = self.config_cache.queries
+        active = await self.get_active_users()
+        symbols = {
+            alert["symbol"]
+            for user in active
+            for alert in alert_index.chat_alerts(user)
+        }
+        # Symbols of users with alerts turned off keep their schedule
+        self.scheduler.forget(alert_index.targets)
+        checks, deferred = self.scheduler.due(symbols)
+
+        candles = {}
+        if checks:
             price_bot = CryptoPriceBot()
-            for user in all_users:
-                user_config = await self.db.config.find_one({"chat_id": user})
-
-                price_threshold = user_config["price_threshold"]
-                is_alert_on = user_config["is_alert"] == "on"
-                alert_interval = user_config["alert_interval"]
-                # Skip if alerts are turned off for this user
-                if not is_alert_on:
+            try:
+                candles = await self.fetch_candles(price_bot, checks)
+            finally:
+                await price_bot.close()
+
+        max_tolerance = max(
+            (config["price_threshold"] / 100 for config in active.values()),
+            default=0,
+        )
+        updates = {}
+        messages = {}
+        for symbol in checks:
+            if symbol not in candles:
+                # Retry soon, the range since the last check is kept
+                self.scheduler.retry(symbol)
+                continue
+            df, exchange = candles[symbol]
+            first_check = symbol not in self.scheduler.last_check
+            self.scheduler.update_volatility(
+                symbol, df["high"].values, df["low"].values
+            )
+            if first_check:
+                # The volatility history is not part of the range to evaluate
+                df = df.iloc[-1:]
+            low, high = df["low"].min(), df["high"].max()
+            current_price = df["close"].iloc[-1]
+
+            for user, alert in alert_index.near(symbol, low, high, max_tolerance):
+                # Waiting for alert_interval or not, every alert of an active
+                # user moves through the states, its message is held instead
+                if user not in active or alert.get("state") == TRIGGERED:
                     continue
-                current_time = datetime.now().timestamp()
-                last_alert_time = self.user_last_alert.get(user, 0)
-                if current_time - last_alert_time < alert_interval * 60:
+                tolerance = active[user]["price_threshold"] / 100
+                target_price = float(alert["price"])
+                # If price came within the threshold, send alert
+                if not (
+                    target_price * (1 - tolerance) <= high
+                    and target_price * (1 + tolerance) >= low
+                ):
                     continue
-                alerts = await self.get_all_monitors(user)
-                alerts_dict = defaultdict(list)
-                for alert in alerts:
-                    alerts_dict[alert["symbol"]].append(
-                        (float(alert.get("price")), alert.get("msg"))
-                    )
-
-                for symbol, values in alerts_dict.items():
-                    try:
-                        # Get current price
-                        ticker_data = await price_bot.fetch_timeframe_change(
-                            symbol, "1m"
-                        )
-                        if not ticker_data:
-                            continue
-                        current_price = ticker_data["current_price"]
-                        for target_price, msg in values:
-                            # Calculate price difference percentage
-                            price_diff_pct = (
-                                abs(current_price - target_price) / target_price * 100
-                            )
-                            # If price is within threshold, send alert
-                            if price_diff_pct <= price_threshold:
-                                alert_message = (
-                                    f"🚨 Price Alert!\n"
-                                    f"Exchange: {ticker_data['exchange']}\n"
-                                    f"Symbol: {symbol}\n"
-                                    f"Target: ${target_price:,.4f}\n"
-                                    f"Current: ${current_price:,.4f}\n"
-                                    f"Difference: {price_diff_pct:.4f}%\n"
-                                    f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}"
-                                    "\n"
-                                    f"Message: {msg}"
-                                )
-                                # Send alert to all active chats
-                                await self.client.send_message(
-                                    user, message=alert_message
-                                )
-                    except Exception as e:
-                        print(f"Error checking alerts: {str(e)}")
-            await price_bot.close()
-            await asyncio.sleep(60)
+                # Triggered even if the send fails later, a blocked chat must
+                # not be retried on every check. The count is set, not
+                # incremented, so a bookkeeping batch sent twice counts once
+                alert["trigger_count"] = alert.get("trigger_count", 0) + 1
+                self.set_state(
+                    alert,
+                    TRIGGERED,
+                    updates,
+                    {
+                        "$set": {
+                            "last_triggered_at": datetime.now(UTC),
+                            "last_triggered_price": float(current_price),
+                            "trigger_count": alert["trigger_count"],
+                        },
+                    },
+                )
+                price_diff_pct = abs(current_price - target_price) / target_price * 100
+                alert_message = (
+                    f"🚨 Price Alert!\n"
+                    f"Exchange: {exchange}\n"
+                    f"Symbol: {symbol}\n"
+                    f"Target: ${target_price:,.4f}\n"
+                    f"Current: ${current_price:,.4f}\n"
+                    f"Range: ${low:,.4f} - ${high:,.4f}\n"
+                    f"Difference: {price_diff_pct:.4f}%\n"
+                    f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}"
+                    "\n"
+                    f"Message: {alert.get('msg')}"
+                )
+                messages.setdefault(user, []).append(alert_message)
+
+            self.rearm(symbol, low, high, updates)
+            distance = alert_index.distance(symbol, current_price) - max_tolerance
+            self.scheduler.schedule(symbol, distance)
+
+        writes = await self.save_states()
+        queued = self.deliver(messages, active, datetime.now().timestamp())
+
+        triggered = sum(state == TRIGGERED for state in updates.values())
+        self.last_cycle = {
+            "users": len(active),
+            "symbols": len(symbols),
+            "requests": len(checks),
+            "deferred": deferred,
+            "failed_requests": len(checks) - len(candles),
+            "config_queries": self.config_cache.queries - config_queries,
+            "triggered": triggered,
+            "rearmed": len(updates) - triggered,
+            "queued": queued,
+            "held": sum(len(lines) for lines in self.held.values()),
+            "writes": writes["operations"],
+            "write_round_trips": writes["batches"],
+            "outbound_depth": self.outbound.depth(),
+            "duration": round(time.perf_counter() - start_time, 3),
+        }
+        return self.last_cycle
+
+    def snapshot(self) -> dict:
+        return {
+            "user_last_alert": [
+                [user, at] for user, at in self.user_last_alert.items()
+            ],
+            "scheduler": self.scheduler.snapshot(),
+            "held": [[user, lines] for user, lines in self.held.items()],
+        }
+
+    def restore(self, state: dict):
+        self.user_last_alert.update(
+            (user, at) for user, at in state.get("user_last_alert", [])
+        )
+        self.scheduler.restore(state.get("scheduler", []))
+        for user, lines in state.get("held", []):
+            self.held.setdefault(user, []).extend(lines)
+
+    async def save_snapshot(self):
+        try:
+            await self.snapshots.save(self.snapshot_name, self.snapshot())
+            self.snapshot_at = time.monotonic()
+        except PyMongoError as e:
+            print(f"Error saving the monitor snapshot: {e}")
+
+    async def check_alerts(self):
+        while self.is_running:
+            try:
+                stats = await self.run_cycle()
+                if stats["requests"] or stats["deferred"]:
+                    print(f"Alert cycle: {stats}")
+                if self.steady_after is None and not stats["deferred"]:
+                    # Every due symbol fits the request budget again
+                    self.steady_after = time.monotonic() - self.started_at
+                    print(f"Alert monitor steady after {self.steady_after:.1f}s")
+            except Exception as e:  # noqa: BLE001 - the next tick tries again
+                print(f"Error checking alerts: {e}")
+            if time.monotonic() - self.snapshot_at >= SNAPSHOT_INTERVAL:
+                await self.save_snapshot()
+            await asyncio.sleep(TICK_INTERVAL)
 
     async def start_monitoring(self):
         self.is_running = True
+        self.started_at = time.monotonic()
+        self.steady_after = None
+        await alert_index.load(self.db, self.shard.owns if self.shard else None)
+        self.load_triggered()
+        await self.config_cache.load()
+        state = await self.snapshots.load(self.snapshot_name)
+        if state:
+            self.restore(state)
+        print(
+            f"Alert monitor restored: {bool(state)}, {len(self.scheduler.next_check)} symbols scheduled"
+        )
+        # Counted from the first save, the restored state is as good as saved
+        self.snapshot_at = time.monotonic()
         await self.check_alerts()
 
     async def stop_monitoring(self):
+        if self.is_running:
+            await self.save_states()
+            await self.save_snapshot()
         self.is_running = False
@@ -1,12 +1,32 @@
 import asyncio
-import schedule
+from dataclasses import asdict
 import time
 from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
 from telethon import TelegramClient
 
-from src.services.MultiKernelRegression import apply_multi_kernel_regression
+from src.services.candle_watcher import (
+    WATCH_INTERVAL,
+    WATCH_RETRIES,
+    CandleCloseWatcher,
+)
+from src.services.chat_sync import SIGNALS, mark_changed
+from src.services.compute import compute_executor
+from src.services.indicator_state import IndicatorStateStore
+from src.services.job_scheduler import AlignedScheduler
+from src.services.kernel_tuning import kernel_params, tune_kernel_params
+from src.services.outbound import OutboundQueue
 from src.services.price_bot import CryptoPriceBot
+from src.services.sharding import TUNING_KEY, Shard
+from src.services.signal_cache import SignalCache
+from src.services.signal_result import SignalResult
+from src.services.snapshot import SNAPSHOT_INTERVAL, SnapshotStore
+from src.services.monitor_store import SignalMonitorStore
+from src.services.subscription_index import SIGNAL_TIMEFRAMES, subscription_index
+from src.utils import last_closed_candle, timeframe_to_seconds
+
+DAY = 24 * 60 * 60
 
 
 class SignalService:
@@ -14,130 +34,172 @@ class SignalService:
         self,
         db: AsyncIOMotorDatabase,
         client: TelegramClient,
+        signal_cache: SignalCache | None = None,
+        outbound: OutboundQueue | None = None,
+        shard: Shard | None = None,
     ):
         self.db = db
         self.client = client
+        self.signal_cache = signal_cache or SignalCache(IndicatorStateStore(db))
+        self.outbound = outbound or OutboundQueue(client)
+        self.shard = shard
+        self.watcher = CandleCloseWatcher(
+            db, self.outbound, self.signal_cache, SIGNAL_TIMEFRAMES, shard
+        )
         self.is_running = False
         self.user_last_alert = {}
+        self.snapshots = SnapshotStore(db)
+        self.snapshot_name = "signal_service" + (f":{shard.name}" if shard else "")
+        self.scheduler = AlignedScheduler()
 
     async def get_all_monitors(self, chat_id) -> list[dict]:
-        query = await self.db.signals.find_one({"chat_id": chat_id})
-        if query:
-            return query.get("data", [])
-        return []
+        return await SignalMonitorStore(self.db).chat_monitors(chat_id)
 
     @classmethod
-    async def add_monitor(cls, db, chat_id: int, symbols: list[str], price: float):
-        # find if the user already has a monitor for the symbol
-        # alerts has 2 fields: chat_id and data
-        monitor = await db.signals.find_one({"chat_id": chat_id})
-
-        if not monitor:
-            monitor = {"chat_id": chat_id, "data": []}
-        monitor["data"] = list(set(monitor["data"] + symbols))
-
-        await db.signals.update_one(
-            {"chat_id": chat_id}, {"$set": monitor}, upsert=True
-        )
-        return len(monitor["data"])
+    async def add_monitor(
+        cls, db, chat_id: int, symbols: list[str], timeframes: list[str] | None = None
+    ):
+        # One document per (chat, symbol), a symbol monitored again gets the
+        # new timeframes too
+        store = SignalMonitorStore(db)
+        await store.add(chat_id, symbols, timeframes or SIGNAL_TIMEFRAMES)
+        await mark_changed(db, chat_id, SIGNALS)
+        monitors = await store.chat_monitors(chat_id)
+        subscription_index.update_chat(chat_id, monitors)
+        return len(monitors)
 
     @classmethod
     async def delete_monitor(cls, db, chat_id: int, id: int):
-        list_monitors = await db.signals.find_one({"chat_id": chat_id})
-        if not list_monitors:
+        store = SignalMonitorStore(db)
+        if not await store.delete(chat_id, id):
             return False
-
-        if id < 1 or id > len(list_monitors["data"]):
-            return False
-
-        list_monitors["data"].pop(id - 1)
-
-        await db.signals.update_one({"chat_id": chat_id}, {"$set": list_monitors})
-
+        await mark_changed(db, chat_id, SIGNALS)
+        subscription_index.update_chat(chat_id, await store.chat_monitors(chat_id))
         return True
 
     async def check_alerts(self, timeframe: str):
-        all_users = await self.db.signals.distinct("chat_id")
-        price_bot = CryptoPriceBot()
         print("Checking task for timeframe", timeframe)
         try:
-            for user in all_users:
-                alerts = await self.get_all_monitors(user)
-                message_list = []
-
-                for symbol in alerts:
-                    try:
-                        ticker_data, exchange = await price_bot.fetch_ohlcv_data(
-                            symbol, timeframe=timeframe, limit=200
-                        )
-
-                        if ticker_data is None or ticker_data.empty:
-                            continue
-
-                        current_price = ticker_data.iloc[-1]["close"]
-                        df = apply_multi_kernel_regression(ticker_data, repaint=True)
-                        signal_up, signal_down = df.iloc[-2][
-                            ["signal_up", "signal_down"]
-                        ]
-
-                        if signal_up:
-                            message_list.append(
-                                f"📈 {exchange.capitalize()}: Signal for {symbol}: {current_price} in timeframe {timeframe} is up"
-                            )
-                        elif signal_down:
-                            message_list.append(
-                                f"📉 {exchange.capitalize()}: Signal for {symbol}: {current_price} in timeframe {timeframe} is down"
-                            )
-
-                    except Exception as e:
-                        print(f"Error checking alerts for {symbol}: {str(e)}")
-                        await self.client.send_message(
-                            user,
-                            f"Error checking alerts for {symbol} in timeframe {timeframe}",
-                        )
-                message_list_str = "\n".join(message_list)
-                if message_list:
-                    await self.client.send_message(user, message_list_str)
-                # log
-                print(
-                    f"Checked alerts for {user} with result: {message_list_str or 'No alerts'}"
+            subscriptions = subscription_index.subscriptions(timeframe)
+            for _ in range(WATCH_RETRIES):
+                await self.watcher.check(timeframe, subscriptions)
+                # The exchanges that had not closed the candle yet are retried
+                if not self.watcher.due(timeframe, subscriptions):
+                    break
+                await asyncio.sleep(WATCH_INTERVAL)
+        finally:
+            print(
+                f"Task completed, compute: {compute_executor.stats()}, "
+                f"signals: {self.signal_cache.stats()}, "
+                f"previous run: {self.scheduler.jobs[timeframe].stats()}"
+            )
+
+    async def tune_kernels(self):
+        if self.shard is not None and not self.shard.owns(TUNING_KEY):
+            # Another worker tunes, pick up its results
+            await kernel_params.load(self.db)
+            return
+        # Every chat, not only the ones of this shard
+        symbols = {timeframe: set() for timeframe in SIGNAL_TIMEFRAMES}
+        async for monitor in self.db.signal_monitors.find(
+            {}, {"_id": 0, "symbol": 1, "timeframes": 1}
+        ):
+            for timeframe in monitor["timeframes"]:
+                symbols.setdefault(timeframe, set()).add(monitor["symbol"])
+        price_bot = CryptoPriceBot()
+        try:
+            tuned = 0
+            for timeframe, timeframe_symbols in symbols.items():
+                tuned += await tune_kernel_params(
+                    self.db, price_bot, sorted(timeframe_symbols), [timeframe]
                 )
-
+            print(f"Tuned kernel parameters for {tuned} symbol/timeframe pairs")
         finally:
             await price_bot.close()
-            print("Task completed")
 
     async def test_print(self):
         print("TESTING")
 
     def schedule_jobs(self):
-        # Schedule 2h checks (every even hour UTC)
-        # Schedule 1m checks (every minute)
-        def create_check_task(timeframe):
-            return lambda: asyncio.create_task(self.check_alerts(timeframe))
-
-        schedule.every().minute.do(lambda: create_check_task("15m"))
-
-        for hour in range(0, 24, 2):
-            schedule.every().day.at(f"{hour:02d}:01", "UTC").do(create_check_task("2h"))
-
-        # Schedule 4h checks (00:00, 04:00, 08:00, 12:00, 16:00, 20:00 UTC)
-        for hour in range(0, 24, 4):
-            schedule.every().day.at(f"{hour:02d}:01", "UTC").do(create_check_task("4h"))
+        # Every candle close, plus the settle delay of the scheduler
+        for timeframe in SIGNAL_TIMEFRAMES:
+            self.scheduler.every(
+                timeframe,
+                timeframe_to_seconds(timeframe),
+                lambda timeframe=timeframe: self.check_alerts(timeframe),
+            )
+        # Re-tune the kernel parameters once a day, away from the candle closes
+        self.scheduler.every(
+            "tune_kernels", DAY, self.tune_kernels, offset=30 * 60, settle=0
+        )
+        if self.shard is not None:
+            # The other workers pick up what the tuning worker saved: a
+            # reload only, tune_kernels would tune again on the owner
+            self.scheduler.every(
+                "reload_kernels",
+                DAY,
+                lambda: kernel_params.load(self.db),
+                offset=90 * 60,
+                settle=0,
+            )
+        self.scheduler.every(
+            "snapshot", SNAPSHOT_INTERVAL, self.save_snapshot, settle=0
+        )
 
-        # Schedule daily check at 00:00 UTC
-        schedule.every().day.at("00:01", "UTC").do(create_check_task("1d"))
+    def snapshot(self) -> dict:
+        """The signal results of the latest closed candles"""
+        results = self.signal_cache.results
+        return {
+            "signals": [
+                asdict(result)
+                for (_, timeframe, candle_time), result in results.items()
+                if candle_time == last_closed_candle(timeframe)
+            ]
+        }
+
+    def restore(self, state: dict):
+        for data in state.get("signals", []):
+            result = SignalResult(**data)
+            self.signal_cache.results[
+                (result.symbol, result.timeframe, result.candle_time)
+            ] = result
+
+    async def save_snapshot(self):
+        try:
+            await self.snapshots.save(self.snapshot_name, self.snapshot())
+        except PyMongoError as e:
+            print(f"Error saving the signal snapshot: {e}")
 
     async def start_monitoring(self):
         self.is_running = True
+        started_at = time.monotonic()
+        await kernel_params.load(self.db)
+        await self.watcher.load()
+        await subscription_index.load(self.db, self.shard.owns if self.shard else None)
+        # The series tails, in one query instead of one per symbol
+        await self.signal_cache.indicator_states.load()
+        state = await self.snapshots.load(self.snapshot_name)
+        if state:
+            self.restore(state)
+
+        # The candles that closed while stopped, then wait for the next closes
+        try:
+            await self.watcher.poll()
+        except Exception as e:  # noqa: BLE001 - the watcher job polls again
+            print(f"Error watching candle closes: {e}")
+        print(
+            f"Signal monitor steady after "
+            f"{time.monotonic() - started_at:.1f}s, restored: {bool(state)}"
+        )
         self.schedule_jobs()
-
-        while self.is_running:
-            schedule.run_pending()
-            await asyncio.sleep(60)  # Check schedule every minute
+        await self.scheduler.run()
 
     async def stop_monitoring(self):
+        if self.is_running:
+            await self.save_snapshot()
         self.is_running = False
+        # The jobs are scheduled again if the monitoring restarts
+        self.scheduler.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+from datetime import UTC, datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from src.services.alert_index import new_alert_id
+from src.services.subscription_index import normalize_monitor
+
+# Marker in db.migrations once the per-chat documents have been split
+MIGRATION_NAME = "per_document_monitors"
+# Numbering shown to the users, the order the entries were created in
+CREATED_ORDER = [("created_at", ASCENDING), ("_id", ASCENDING)]
+# Fields of an alert read back, leaving chat_id and created_at on the server
+ALERT_FIELDS = {"symbol": 1, "price": 1, "msg": 1, "state": 1, "trigger_count": 1}
+MONITOR_FIELDS = {"_id": 0, "symbol": 1, "timeframes": 1}
+
+
+class AlertStore:
+    """
+    Price alerts in db.price_alerts, one document per alert
+
+    {_id: alert_id, chat_id, symbol, price, msg, state, created_at}. Every
+    edit is a single atomic write on one document, so two edits of the same
+    chat can no longer overwrite each other. The users number the alerts of
+    a chat in creation order.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db.price_alerts
+
+    @staticmethod
+    def to_alert(doc: dict) -> dict:
+        """The alert as kept by the AlertIndex"""
+        return {
+            "alert_id": doc["_id"],
+            "symbol": doc["symbol"],
+            "price": doc["price"],
+            "msg": doc.get("msg"),
+            "state": doc.get("state"),
+            "trigger_count": doc.get("trigger_count", 0),
+        }
+
+    async def chat_alerts(self, chat_id: int) -> list[dict]:
+        cursor = self.collection.find({"chat_id": chat_id}, ALERT_FIELDS).sort(
+            CREATED_ORDER
+        )
+        return [self.to_alert(doc) async for doc in cursor]
+
+    async def alert_at(self, chat_id: int, position: int) -> dict | None:
+        """Document of the alert numbered `position` (from 1) in the chat"""
+        if position < 1:
+            return None
+        cursor = (
+            self.collection.find({"chat_id": chat_id}, ALERT_FIELDS)
+            .sort(CREATED_ORDER)
+            .skip(position - 1)
+            .limit(1)
+        )
+        async for doc in cursor:
+            return doc
+        return None
+
+    async def add(self, chat_id: int, alert: dict) -> dict:
+        doc = {
+            "_id": alert.get("alert_id") or new_alert_id(),
+            "chat_id": chat_id,
+            "symbol": alert["symbol"],
+            "price": float(alert["price"]),
+            "msg": alert.get("msg"),
+            "state": alert.get("state"),
+            "created_at": datetime.now(UTC),
+        }
+        await self.collection.insert_one(doc)
+        return doc
+
+    async def update(self, chat_id: int, position: int, changes: dict) -> dict | None:
+        """Set fields of the alert numbered `position`, None if there is none"""
+        doc = await self.alert_at(chat_id, position)
+        if doc is None:
+            return None
+        # Matched on chat_id too, the alert may have been deleted meanwhile
+        result = await self.collection.update_one(
+            {"_id": doc["_id"], "chat_id": chat_id}, {"$set": changes}
+        )
+        if not result.matched_count:
+            return None
+        return {**doc, **changes}
+
+    async def delete(self, chat_id: int, position: int) -> bool:
+        doc = await self.alert_at(chat_id, position)
+        if doc is None:
+            return False
+        result = await self.collection.delete_one(
+            {"_id": doc["_id"], "chat_id": chat_id}
+        )
+        return result.deleted_count == 1
+
+
+class SignalMonitorStore:
+    """
+    Signal monitors in db.signal_monitors, one document per (chat, symbol)
+
+    {chat_id, symbol, timeframes, created_at}. Monitoring a symbol again
+    adds the new timeframes to its document with $addToSet.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.collection = db.signal_monitors
+
+    @staticmethod
+    def to_monitor(doc: dict) -> dict:
+        return {"symbol": doc["symbol"], "timeframes": doc["timeframes"]}
+
+    async def chat_monitors(self, chat_id: int) -> list[dict]:
+        cursor = self.collection.find({"chat_id": chat_id}, MONITOR_FIELDS).sort(
+            CREATED_ORDER
+        )
+        return [self.to_monitor(doc) async for doc in cursor]
+
+    async def add(self, chat_id: int, symbols: list[str], timeframes: list[str]):
+        """Monitor the symbols on the timeframes, in one bulk write"""
+        now = datetime.now(UTC)
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"chat_id": chat_id, "symbol": symbol},
+                    {
+                        "$addToSet": {"timeframes": {"$each": timeframes}},
+                        # Keeps the order of the symbols within one command
+                        "$setOnInsert": {"created_at": now + timedelta(milliseconds=i)},
+                    },
+                    upsert=True,
+                )
+                for i, symbol in enumerate(symbols)
+            ]
+        )
+
+    async def delete(self, chat_id: int, position: int) -> bool:
+        if position < 1:
+            return False
+        cursor = (
+            self.collection.find({"chat_id": chat_id}, {"_id": 1})
+            .sort(CREATED_ORDER)
+            .skip(position - 1)
+            .limit(1)
+        )
+        async for doc in cursor:
+            result = await self.collection.delete_one({"_id": doc["_id"]})
+            return result.deleted_count == 1
+        return False
+
+
+def legacy_alert_id(chat_id: int, position: int) -> str:
+    """Id of the alert at `position` in a legacy per-chat document"""
+    return f"legacy-{chat_id}-{position}"
+
+
+async def migrate_monitor_documents(db: AsyncIOMotorDatabase):
+    """
+    Split the legacy per-chat documents once, after ensure_indexes
+
+    db.alerts and db.signals held one document per chat with the entries in
+    a data array. Each entry becomes its own document, keeping its order,
+    and the legacy collections are left untouched. An entry stored before
+    alert ids existed gets one derived from its chat and position, so the
+    upserts of a migration interrupted or run by two replicas at once write
+    the same documents again instead of duplicating them.
+    """
+    alerts, monitors = AlertStore(db), SignalMonitorStore(db)
+    if await db.migrations.find_one({"_id": MIGRATION_NAME}):
+        return
+
+    migrated_at = datetime.now(UTC)
+    requests = []
+    async for query in db.alerts.find({}, {"chat_id": 1, "data": 1}):
+        for i, alert in enumerate(query.get("data", [])):
+            alert_id = alert.get("alert_id") or legacy_alert_id(query["chat_id"], i)
+            doc = {
+                "chat_id": query["chat_id"],
+                "symbol": alert["symbol"],
+                "price": float(alert["price"]),
+                "msg": alert.get("msg"),
+                # Stored before alert states existed: ARMED of MonitorService
+                "state": alert.get("state", "armed"),
+                "created_at": migrated_at + timedelta(milliseconds=i),
+            }
+            requests.append(ReplaceOne({"_id": alert_id}, doc, upsert=True))
+    if requests:
+        await alerts.collection.bulk_write(requests, ordered=False)
+    alert_count = len(requests)
+
+    requests = []
+    async for query in db.signals.find({}, {"chat_id": 1, "data": 1}):
+        for i, monitor in enumerate(query.get("data", [])):
+            monitor = normalize_monitor(monitor)
+            requests.append(
+                UpdateOne(
+                    {"chat_id": query["chat_id"], "symbol": monitor["symbol"]},
+                    {
+                        "$addToSet": {"timeframes": {"$each": monitor["timeframes"]}},
+                        "$setOnInsert": {
+                            "created_at": migrated_at + timedelta(milliseconds=i)
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+    if requests:
+        await monitors.collection.bulk_write(requests, ordered=False)
+
+    await db.migrations.update_one(
+        {"_id": MIGRATION_NAME},
+        {"$set": {"done_at": datetime.now(UTC)}},
+        upsert=True,
+    )
+    print(
+        f"Migrated {alert_count} alerts and {len(requests)} signal monitors "
+        "to one document each"
+    )
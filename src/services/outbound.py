@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+INTERACTIVE = 0  # Replies to a command
+BROADCAST = 1  # Alerts and signals nobody is waiting for
+
+GLOBAL_RATE = 25  # Messages per second over all chats, Telegram allows ~30
+CHAT_INTERVAL = 1.0  # Seconds between two messages to the same chat
+MAX_MESSAGE_LENGTH = 4096
+MAX_FLOOD_RETRIES = 5
+
+
+@dataclass(slots=True)
+class OutboundMessage:
+    chat_id: int
+    text: str
+    priority: int
+    kwargs: dict
+    queued_at: float = field(default_factory=time.monotonic)
+    future: asyncio.Future | None = None
+    attempts: int = 0
+
+
+class OutboundQueue:
+    """
+    Every message the bot sends on its own goes through this queue
+
+    Messages are sent by priority, then in order, within a global rate and
+    at most one message per CHAT_INTERVAL to every chat. Messages waiting
+    for the same chat with the same send options are coalesced into one,
+    up to Telegram's length limit. A FloodWaitError pauses the chat it
+    happened in for the requested time and requeues the message, the other
+    chats keep being served.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        global_rate: float = GLOBAL_RATE,
+        chat_interval: float = CHAT_INTERVAL,
+    ):
+        self.client = client
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.pending: dict[int, list[OutboundMessage]] = {}
+        # (priority, queued_at, seq, chat_id) of the chats with pending messages
+        self.ready: list[tuple] = []
+        self.next_allowed: dict[int, float] = {}
+        self.sending: set[int] = set()
+        self._seq = itertools.count()
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def send(
+        self, chat_id: int, text: str, priority: int = BROADCAST, **kwargs
+    ) -> asyncio.Future:
+        """
+        Queue a message, kwargs are passed to TelegramClient.send_message
+
+        Returns:
+            asyncio.Future: Resolved with the sent Message, or the error
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        message = OutboundMessage(chat_id, text, priority, kwargs)
+        message.future = asyncio.get_running_loop().create_future()
+        self._push(message)
+        return message.future
+
+    def _push(self, message: OutboundMessage, front: bool = False):
+        queue = self.pending.setdefault(message.chat_id, [])
+        if front:
+            queue.insert(0, message)
+        else:
+            queue.append(message)
+        if queue[0] is message:
+            self._push_head(message.chat_id)
+
+    def _take_token(self, now: float) -> float:
+        """Seconds to wait for the global rate, 0 if a message can go now"""
+        self._tokens = min(1.0, self._tokens + (now - self._updated) * self.global_rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.global_rate
+
+    def _next_chat(self, now: float) -> tuple[int | None, float]:
+        """Chat to send to next, or None and the time until one may be ready"""
+        deferred = []
+        chat_id, wait = None, float("inf")
+        while self.ready:
+            entry = heapq.heappop(self.ready)
+            queue = self.pending.get(entry[3])
+            # Stale entry, the chat was served or has a newer head entry
+            if not queue or (queue[0].priority, queue[0].queued_at) != entry[:2]:
+                continue
+            if entry[3] in self.sending:
+                deferred.append(entry)
+                continue
+            delay = self.next_allowed.get(entry[3], 0) - now
+            if delay > 0:
+                deferred.append(entry)
+                wait = min(wait, delay)
+                continue
+            chat_id = entry[3]
+            break
+        for entry in deferred:
+            heapq.heappush(self.ready, entry)
+        return chat_id, wait
+
+    def _batch(self, chat_id: int) -> list[OutboundMessage]:
+        """Head message of the chat and the following ones it can absorb"""
+        queue = self.pending[chat_id]
+        batch = [queue.pop(0)]
+        length = len(batch[0].text)
+        while queue and (
+            queue[0].kwargs == batch[0].kwargs
+            and not batch[0].kwargs.get("file")
+            and length + 2 + len(queue[0].text) <= MAX_MESSAGE_LENGTH
+        ):
+            length += 2 + len(queue[0].text)
+            batch.append(queue.pop(0))
+        if not queue:
+            del self.pending[chat_id]
+        return batch
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            chat_id, wait = self._next_chat(now)
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), None if wait == float("inf") else wait
+                    )
+                except TimeoutError:
+                    pass
+                continue
+            delay = self._take_token(now)
+            if delay:
+                # Put the chat back, a higher priority one may come meanwhile
+                self._push_head(chat_id)
+                await asyncio.sleep(delay)
+                continue
+            batch = self._batch(chat_id)
+            self.sending.add(chat_id)
+            asyncio.create_task(self._deliver(chat_id, batch))
+
+    async def _deliver(self, chat_id: int, batch: list[OutboundMessage]):
+        head = batch[0]
+        try:
+            result = await self.client.send_message(
+                chat_id, "\n\n".join(message.text for message in batch), **head.kwargs
+            )
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            self.flood_wait_seconds += e.seconds
+            self.next_allowed[chat_id] = time.monotonic() + e.seconds
+            for message in reversed(batch):
+                message.attempts += 1
+                if message.attempts > MAX_FLOOD_RETRIES:
+                    self._finish(message, error=e)
+                else:
+                    self._push(message, front=True)
+            print(f"Flood wait of {e.seconds}s sending to {chat_id}")
+        except Exception as e:  # noqa: BLE001 - handed to the waiting callers
+            for message in batch:
+                self._finish(message, error=e)
+            print(f"Error sending message to {chat_id}: {e}")
+        else:
+            self.next_allowed[chat_id] = time.monotonic() + self.chat_interval
+            self.coalesced += len(batch) - 1
+            for message in batch:
+                self._finish(message, result=result)
+        finally:
+            self.sending.discard(chat_id)
+            if chat_id in self.pending:
+                self._push_head(chat_id)
+
+    def _push_head(self, chat_id: int):
+        head = self.pending[chat_id][0]
+        heapq.heappush(
+            self.ready, (head.priority, head.queued_at, next(self._seq), chat_id)
+        )
+        self._wakeup.set()
+
+    def _finish(self, message: OutboundMessage, result=None, error=None):
+        if error is None:
+            self.sent += 1
+            latency = time.monotonic() - message.queued_at
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        else:
+            self.failed += 1
+        if not message.future.done():
+            if error is None:
+                message.future.set_result(result)
+            else:
+                message.future.set_exception(error)
+                # Nobody has to await a broadcast, do not warn about it
+                message.future.exception()
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.pending.values())
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+            "avg_latency": round(self.latency_total / self.sent, 3)
+            if self.sent
+            else 0.0,
+            "max_latency": round(self.latency_max, 3),
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -13,7 +13,13 @@ from src.services.MultiKernelRegression import (
     apply_multi_kernel_regression,
     viewable_signal,
 )
+from src.services.compute import compute_executor
 from src.services.custom_indicators.pinbar_detector import PinbarDetector
+from src.services.kernel_tuning import kernel_params
+
+# The candle before the last closed one, the last closed one and the open one
+PINBAR_SCAN_BARS = 3
+PINBAR_MIN_NOSE_PERCENT = 0.1  # Shortest pinbar nose, in percent of its close
 
 
 class CryptoPriceBot:
@@ -27,16 +33,22 @@ class CryptoPriceBot:
             for exchange_id in exchange_ids
         ]
         self.chart_style = self._create_chart_style()
-        self.pinbar_patterns = ["Pinbar", "Hammer", "Inverted Hammer"]
 
         self.pinbar_detector = PinbarDetector(
             use_custom_settings=True,
             custom_max_nose_body_size=0.33,
             custom_nose_body_position=0.4,
+            # Relative, an absolute minimum would reject every sub-dollar coin
+            custom_minimum_nose_length=0.0,
+            custom_minimum_nose_percent=PINBAR_MIN_NOSE_PERCENT,
         )
 
     async def fetch_ohlcv_data(
-        self, symbol: str, timeframe: str = "1h", limit: int = 100
+        self,
+        symbol: str,
+        timeframe: str = "1h",
+        limit: int = 100,
+        since: int | None = None,
     ) -> tuple[pd.DataFrame, str] | None:
         """
         Fetch OHLCV data and convert to DataFrame for charting
@@ -45,6 +57,7 @@ class CryptoPriceBot:
             symbol: Trading pair symbol (e.g., 'BTC/USDT')
             timeframe: Candle timeframe (e.g., '1h', '4h', '1d')
             limit: Number of candles to fetch
+            since: Timestamp in ms of the first candle, None for the latest candles
 
         Returns:
             pd.DataFrame | None: OHLCV data in DataFrame format or None if error
@@ -54,12 +67,12 @@ class CryptoPriceBot:
             exchange = self.exchanges[0].id
             try:
                 ohlcv = await self.exchanges[0].fetch_ohlcv(
-                    symbol, timeframe, limit=limit
+                    symbol, timeframe, since=since, limit=limit
                 )
             except (BadSymbol, TimeoutError) as e:
                 for i in range(1, len(self.exchanges)):
                     ohlcv = await self.exchanges[i].fetch_ohlcv(
-                        symbol, timeframe, limit=limit
+                        symbol, timeframe, since=since, limit=limit
                     )
                     if ohlcv:
                         exchange = self.exchanges[i].id
@@ -76,6 +89,51 @@ class CryptoPriceBot:
             print(f"Error fetching OHLCV data for {symbol}: {str(e)}")
             return None, exchange
 
+    async def fetch_ohlcv_history(
+        self,
+        symbol: str,
+        timeframe: str = "1h",
+        since: int | None = None,
+        pages: int = 5,
+        page_limit: int = 1000,
+    ) -> tuple[pd.DataFrame, str] | None:
+        """
+        Fetch several pages of OHLCV data, oldest first
+
+        Args:
+            symbol: Trading pair symbol (e.g., 'BTC/USDT')
+            timeframe: Candle timeframe (e.g., '1h', '4h', '1d')
+            since: Timestamp in ms of the first candle, None to end at the latest candle
+            pages: Maximum number of pages to fetch
+            page_limit: Number of candles per page
+
+        Returns:
+            pd.DataFrame | None: OHLCV data in DataFrame format or None if error
+            str: Exchange name
+        """
+        timeframe_ms = self.exchanges[0].parse_timeframe(timeframe) * 1000
+        if since is None:
+            now_ms = self.exchanges[0].milliseconds()
+            since = now_ms - pages * page_limit * timeframe_ms
+
+        frames = []
+        exchange = self.exchanges[0].id
+        for _ in range(pages):
+            df, exchange = await self.fetch_ohlcv_data(
+                symbol, timeframe, page_limit, since=since
+            )
+            if df is None or df.empty:
+                break
+            frames.append(df)
+            if len(df) < page_limit:
+                break
+            since = int(df.index[-1].timestamp() * 1000) + timeframe_ms
+
+        if not frames:
+            return None, exchange
+        df = pd.concat(frames)
+        return df[~df.index.duplicated(keep="last")], exchange
+
     async def fetch_future_ohlcv_data(
         self, symbol: str, timeframe: str = "1h", limit: int = 100
     ) -> tuple[pd.DataFrame, str] | None:
@@ -153,7 +211,12 @@ class CryptoPriceBot:
                 raise ValueError("Empty or invalid DataFrame provided")
 
             # use multi kernel regression to detect signals
-            df_signal = viewable_signal(apply_multi_kernel_regression(df, repaint=True))
+            bandwidth, kernel_type = kernel_params.get(symbol, timeframe)
+            df_signal = viewable_signal(
+                apply_multi_kernel_regression(
+                    df, bandwidth=bandwidth, kernel_type=kernel_type, repaint=True
+                )
+            )
 
             ic = [
                 mpf.make_addplot(
@@ -172,6 +235,23 @@ class CryptoPriceBot:
                 ),
             ]
 
+            # Mark the pinbars above the bearish and below the bullish ones
+            if len(df) >= 2:
+                pinbar_signals, pinbar_colors = self.pinbar_detector.detect(df)
+                for color, marker_color in ((1, "orange"), (0, "blue")):
+                    marked = np.where(pinbar_colors == color, pinbar_signals, np.nan)
+                    if np.isnan(marked).all():
+                        continue
+                    ic.append(
+                        mpf.make_addplot(
+                            marked,
+                            type="scatter",
+                            color=marker_color,
+                            marker="*",
+                            markersize=150,
+                        )
+                    )
+
             # Create buffer for the image
             buf = io.BytesIO()
 
@@ -323,6 +403,51 @@ class CryptoPriceBot:
             print(f"Error fetching price changes for {symbol}: {str(e)}")
             return None
 
+    async def scan_pinbars(self, symbols: list[str], timeframe: str = "4h") -> list:
+        """
+        Find the symbols whose last closed candle is a pinbar
+
+        The candles of every symbol are fetched concurrently, then the
+        detector runs once over the stacked OHLC matrix of all of them.
+
+        Args:
+            symbols: Trading pair symbols to scan
+            timeframe: Candle timeframe (e.g., '1h', '4h', '1d')
+
+        Returns:
+            list[dict]: symbol, exchange, side ("bullish" or "bearish"),
+            signal price and close of every pinbar found
+        """
+        fetched = await asyncio.gather(
+            *(
+                self.fetch_ohlcv_data(symbol, timeframe, PINBAR_SCAN_BARS)
+                for symbol in symbols
+            )
+        )
+        frames = {}
+        exchanges = {}
+        for symbol, (df, exchange) in zip(symbols, fetched):
+            if df is None or len(df) < PINBAR_SCAN_BARS:
+                continue
+            frames[symbol] = df
+            exchanges[symbol] = exchange
+
+        scanned, signals, colors = await compute_executor.run(
+            self.pinbar_detector.detect_batch, frames
+        )
+        # The last candle is still open, read the last closed one
+        return [
+            {
+                "symbol": symbol,
+                "exchange": exchanges[symbol],
+                "side": "bearish" if colors[i, -2] == 1 else "bullish",
+                "signal": float(signals[i, -2]),
+                "close": float(frames[symbol]["close"].iloc[-2]),
+            }
+            for i, symbol in enumerate(scanned)
+            if colors[i, -2] >= 0
+        ]
+
     async def close(self):
         """Close the exchange connection"""
         # await self.exchanges.close()
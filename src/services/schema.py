@@ -0,0 +1,171 @@
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+# Indexes of every collection queried by a field other than _id. A unique
+# index backs the upserts keyed on the same fields. db.leases gets its TTL
+# index from LeaderLease, db.service_state and db.migrations are by _id.
+INDEXES = {
+    "config": [IndexModel([("chat_id", ASCENDING)], unique=True)],
+    # (chat_id, created_at) also serves the chat_id only queries. The
+    # alerts near a price are looked up in the AlertIndex, not in Mongo.
+    "price_alerts": [
+        IndexModel([("chat_id", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "signal_monitors": [
+        IndexModel([("chat_id", ASCENDING), ("symbol", ASCENDING)], unique=True),
+        IndexModel([("symbol", ASCENDING)]),
+    ],
+    "candle_state": [
+        IndexModel(
+            [
+                ("shard", ASCENDING),
+                ("exchange", ASCENDING),
+                ("symbol", ASCENDING),
+                ("timeframe", ASCENDING),
+            ],
+            unique=True,
+        )
+    ],
+    "indicator_state": [
+        IndexModel([("symbol", ASCENDING), ("timeframe", ASCENDING)], unique=True)
+    ],
+    "kernel_params": [
+        IndexModel([("symbol", ASCENDING), ("timeframe", ASCENDING)], unique=True)
+    ],
+    # Polled by ChatSync, a chat not edited for a day is forgotten
+    "chat_changes": [
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=24 * 3600)
+    ],
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Create the INDEXES that do not exist yet, at startup
+
+    create_indexes is a no-op for an index that already exists, so every
+    replica can run it. A collection whose indexes cannot be built, e.g.
+    duplicates under a unique index, is reported without stopping the bot.
+    """
+
+    async def create(name: str, indexes: list[IndexModel]):
+        try:
+            await db[name].create_indexes(indexes)
+        except PyMongoError as e:
+            print(f"Error creating the indexes of {name}: {e}")
+
+    await asyncio.gather(*(create(name, indexes) for name, indexes in INDEXES.items()))
+
+
+if __name__ == "__main__":
+    # Hot queries on 100k synthetic chats in a scratch database of the
+    # configured Mongo, before and after ensure_indexes, with and without
+    # the projections. Needs a local mongod, e.g. DB_URL=mongodb://localhost
+    import random
+    import sys
+    import time
+    from datetime import UTC, datetime, timedelta
+
+    from src.core.db import motor_client
+    from src.services.monitor_store import ALERT_FIELDS, MONITOR_FIELDS
+
+    CHATS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    ALERTS_PER_CHAT = 3
+    SAMPLES = 200
+    SYMBOLS = [f"COIN{i}/USDT" for i in range(200)]
+
+    async def fill(db):
+        random.seed(1)
+        now = datetime.now(UTC)
+        for start in range(0, CHATS, 10_000):
+            chats = range(start, min(start + 10_000, CHATS))
+            configs = [
+                {
+                    "chat_id": chat_id,
+                    "is_alert": "on",
+                    "price_threshold": 0.01,
+                    "alert_interval": 1,
+                    "is_future": "off",
+                }
+                for chat_id in chats
+            ]
+            alerts = [
+                {
+                    "_id": f"{chat_id}-{i}",
+                    "chat_id": chat_id,
+                    "symbol": random.choice(SYMBOLS),
+                    "price": random.uniform(1, 100),
+                    # What the users write in an alert, makes the documents
+                    # as large as the real ones
+                    "msg": "x" * random.randint(0, 200),
+                    "state": "armed",
+                    "created_at": now + timedelta(milliseconds=i),
+                }
+                for chat_id in chats
+                for i in range(ALERTS_PER_CHAT)
+            ]
+            monitors = [
+                {
+                    "chat_id": chat_id,
+                    "symbol": random.choice(SYMBOLS),
+                    "timeframes": ["15m", "4h"],
+                    "created_at": now,
+                }
+                for chat_id in chats
+            ]
+            await db.config.insert_many(configs)
+            await db.price_alerts.insert_many(alerts)
+            await db.signal_monitors.insert_many(monitors)
+
+    async def timed(query) -> float:
+        """Milliseconds per query, averaged over SAMPLES random chats"""
+        chat_ids = random.sample(range(CHATS), SAMPLES)
+        start = time.perf_counter()
+        for chat_id in chat_ids:
+            await query(chat_id)
+        return (time.perf_counter() - start) / SAMPLES * 1000
+
+    def queries(db, projected: bool) -> dict:
+        def fields(projection):
+            return projection if projected else None
+
+        return {
+            "config by chat_id": lambda chat_id: db.config.find_one(
+                {"chat_id": chat_id}, fields({"_id": 0})
+            ),
+            "alerts of a chat": lambda chat_id: (
+                db.price_alerts.find({"chat_id": chat_id}, fields(ALERT_FIELDS))
+                .sort("created_at", ASCENDING)
+                .to_list(None)
+            ),
+            "monitors of a chat": lambda chat_id: db.signal_monitors.find(
+                {"chat_id": chat_id}, fields(MONITOR_FIELDS)
+            ).to_list(None),
+        }
+
+    async def main():
+        db = motor_client["crypto_schema_benchmark"]
+        await db.client.drop_database("crypto_schema_benchmark")
+        await fill(db)
+        print(f"{CHATS} chats, {CHATS * ALERTS_PER_CHAT} alerts")
+
+        results = {}
+        for name, query in queries(db, False).items():
+            results[name] = [await timed(query)]
+        await ensure_indexes(db)
+        for name, query in queries(db, False).items():
+            results[name].append(await timed(query))
+        for name, query in queries(db, True).items():
+            results[name].append(await timed(query))
+
+        for name, (scan, indexed, projected) in results.items():
+            print(
+                f"{name}: scan {scan:.2f} ms, indexed {indexed:.3f} ms "
+                f"({scan / indexed:.0f}x), indexed + projection {projected:.3f} ms"
+            )
+        await db.client.drop_database("crypto_schema_benchmark")
+
+    asyncio.run(main())
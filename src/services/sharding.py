@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
+import queue
+from bisect import bisect_right
+
+from src.core.config import settings
+from src.services.alert_index import alert_index
+from src.services.compute import compute_executor
+from src.services.config_cache import ConfigCache
+from src.services.outbound import BROADCAST, OutboundQueue
+from src.services.subscription_index import subscription_index
+
+VNODES = 64  # Points of every worker on the hash ring
+REPORT_INTERVAL = 60  # Seconds between two load reports of a worker
+# Ring key of the daily kernel tuning, so exactly one worker runs it
+TUNING_KEY = "kernel_tuning"
+
+
+def ring_hash(key) -> int:
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring of worker names
+
+    Adding or removing a worker only moves the keys between it and its
+    neighbours on the ring, about 1/n of them.
+    """
+
+    def __init__(self, workers=(), vnodes: int = VNODES):
+        self.vnodes = vnodes
+        self.points: list[int] = []
+        self.owners: list[str] = []
+        self.workers: set[str] = set()
+        for worker in workers:
+            self.add(worker)
+
+    def add(self, worker: str):
+        if worker in self.workers:
+            return
+        self.workers.add(worker)
+        for i in range(self.vnodes):
+            point = ring_hash(f"{worker}#{i}")
+            j = bisect_right(self.points, point)
+            self.points.insert(j, point)
+            self.owners.insert(j, worker)
+
+    def remove(self, worker: str):
+        self.workers.discard(worker)
+        kept = [(p, o) for p, o in zip(self.points, self.owners) if o != worker]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def owner(self, key) -> str | None:
+        if not self.points:
+            return None
+        i = bisect_right(self.points, ring_hash(key)) % len(self.points)
+        return self.owners[i]
+
+
+class Shard:
+    """The chats, by consistent hashing of chat_id, one worker is responsible for"""
+
+    def __init__(self, name: str, workers: list[str]):
+        self.name = name
+        self.ring = HashRing(workers)
+
+    def owns(self, key) -> bool:
+        return self.ring.owner(key) == self.name
+
+
+class ShardOutbound:
+    """OutboundQueue of a worker, hands the messages to the Telegram process"""
+
+    def __init__(self, outbox, name: str):
+        self.outbox = outbox
+        self.name = name
+        self.queued = 0
+
+    def send(self, chat_id: int, text: str, priority: int = BROADCAST, **kwargs):
+        self.outbox.put(("send", self.name, chat_id, text, priority, kwargs))
+        self.queued += 1
+
+    def depth(self) -> int:
+        return 0
+
+
+class ShardWorker:
+    """
+    MonitorService and SignalService for the chats of one shard
+
+    Runs in its own process with its own Mongo client. Messages go to the
+    Telegram process through the outbox, alert and config edits made there
+    arrive through the inbox.
+    """
+
+    def __init__(self, name: str, workers: list[str], inbox, outbox):
+        # Imported here, the services import Shard from this module
+        from src.core.db import motor_client
+        from src.services.monitor_service import MonitorService
+        from src.services.monitor_signal import SignalService
+
+        self.db = motor_client["crypto"]
+        self.inbox = inbox
+        self.outbox = outbox
+        self.shard = Shard(name, workers)
+        self.outbound = ShardOutbound(outbox, name)
+        self.config_cache = ConfigCache(self.db)
+        self.monitor = MonitorService(
+            self.db, None, self.config_cache, self.outbound, self.shard
+        )
+        self.signal_service = SignalService(
+            self.db, None, outbound=self.outbound, shard=self.shard
+        )
+
+    async def run(self):
+        compute_executor.configure(
+            settings.compute_executor,
+            settings.compute_workers,
+            settings.compute_batch_size,
+        )
+        tasks = [
+            asyncio.create_task(self.monitor.start_monitoring()),
+            asyncio.create_task(self.signal_service.start_monitoring()),
+            asyncio.create_task(self.report()),
+        ]
+        try:
+            await self.listen()
+        finally:
+            await self.monitor.stop_monitoring()
+            await self.signal_service.stop_monitoring()
+            for task in tasks:
+                task.cancel()
+            compute_executor.shutdown()
+
+    async def listen(self):
+        """Apply the messages of the Telegram process until told to stop"""
+        while True:
+            try:
+                message = await asyncio.to_thread(self.inbox.get, True, 1)
+            except queue.Empty:
+                continue
+            kind = message[0]
+            if kind == "stop":
+                return
+            if kind == "workers":
+                self.shard.ring = HashRing(message[1])
+                await self.rebalance()
+            elif kind == "alerts":
+                _, chat_id, alerts = message
+                if self.shard.owns(chat_id):
+                    alert_index.replace_chat(chat_id, alerts)
+                else:
+                    alert_index.remove_chat(chat_id)
+            elif kind == "signals":
+                _, chat_id, monitors = message
+                if self.shard.owns(chat_id):
+                    subscription_index.replace_chat(chat_id, monitors)
+                else:
+                    subscription_index.remove_chat(chat_id)
+            elif kind == "config":
+                _, chat_id, config = message
+                if self.shard.owns(chat_id):
+                    self.config_cache.configs[chat_id] = config
+
+    async def rebalance(self):
+        """Reload the alerts and signal monitors of the chats owned after the workers changed"""
+        await alert_index.load(self.db, self.shard.owns)
+        self.monitor.load_triggered()
+        await subscription_index.load(self.db, self.shard.owns)
+        print(f"{self.shard.name} rebalanced: {self.load()}")
+
+    def load(self) -> dict:
+        return {
+            "chats": len(alert_index.chats),
+            "alerts": len(alert_index),
+            "signal_chats": len(subscription_index.chats),
+            "queued": self.outbound.queued,
+            "last_cycle": self.monitor.last_cycle,
+        }
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            self.outbox.put(("load", self.shard.name, self.load()))
+
+
+def run_worker(name: str, workers: list[str], inbox, outbox):
+    asyncio.run(ShardWorker(name, workers, inbox, outbox).run())
+
+
+class ShardManager:
+    """
+    Runs the background monitors in worker processes, one shard each
+
+    Lives in the Telegram process: it sends the messages of the workers
+    through the OutboundQueue, forwards alert and config edits, keeps the
+    hash ring and restarts a worker process that died.
+    """
+
+    def __init__(self, outbound: OutboundQueue, config_cache: ConfigCache):
+        self.outbound = outbound
+        self.config_cache = config_cache
+        self.context = multiprocessing.get_context("spawn")
+        self.outbox = self.context.Queue()
+        self.ring = HashRing()
+        self.processes: dict[str, multiprocessing.Process] = {}
+        self.inboxes: dict[str, multiprocessing.Queue] = {}
+        self.loads: dict[str, dict] = {}
+        self._pump: asyncio.Task | None = None
+
+    def start(self, workers: int):
+        for _ in range(workers):
+            self.add_worker()
+        alert_index.subscribers.append(self.forward_alerts)
+        subscription_index.subscribers.append(self.forward_signals)
+        self.config_cache.subscribers.append(self.forward_config)
+        self._pump = asyncio.create_task(self.pump())
+
+    def _spawn(self, name: str):
+        self.inboxes[name] = self.context.Queue()
+        process = self.context.Process(
+            target=run_worker,
+            args=(name, sorted(self.ring.workers), self.inboxes[name], self.outbox),
+            name=name,
+            daemon=True,
+        )
+        process.start()
+        self.processes[name] = process
+
+    def broadcast(self, message: tuple):
+        for inbox in self.inboxes.values():
+            inbox.put(message)
+
+    def add_worker(self) -> str:
+        # The lowest free slot: a shard keeps its name across restarts and
+        # re-elections, its candle_state and snapshot are stored under it
+        name = next(
+            name
+            for name in (f"worker-{i}" for i in itertools.count())
+            if name not in self.ring.workers
+        )
+        self.ring.add(name)
+        self.broadcast(("workers", sorted(self.ring.workers)))
+        self._spawn(name)
+        return name
+
+    async def remove_worker(self, name: str):
+        self.ring.remove(name)
+        self.inboxes.pop(name).put(("stop",))
+        process = self.processes.pop(name)
+        self.loads.pop(name, None)
+        self.broadcast(("workers", sorted(self.ring.workers)))
+        await asyncio.to_thread(process.join, 10)
+
+    def forward_alerts(self, chat_id: int, alerts: list[dict]):
+        # Every worker checks the owner itself, a worker that lost the chat
+        # in a rebalance drops it
+        self.broadcast(("alerts", chat_id, alerts))
+
+    def forward_signals(self, chat_id: int, monitors: list):
+        self.broadcast(("signals", chat_id, monitors))
+
+    def forward_config(self, chat_id: int, config: dict):
+        owner = self.ring.owner(chat_id)
+        if owner in self.inboxes:
+            self.inboxes[owner].put(("config", chat_id, config))
+
+    async def pump(self):
+        """Send the messages of the workers and collect their load reports"""
+        while True:
+            try:
+                message = await asyncio.to_thread(self.outbox.get, True, 1)
+            except queue.Empty:
+                self.restart_dead()
+                continue
+            if message[0] == "send":
+                _, _, chat_id, text, priority, kwargs = message
+                self.outbound.send(chat_id, text, priority, **kwargs)
+            elif message[0] == "load":
+                _, name, load = message
+                self.loads[name] = load
+                print(f"Shard {name}: {load}")
+
+    def restart_dead(self):
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                print(f"{name} exited with {process.exitcode}, restarting")
+                self._spawn(name)
+
+    def stats(self) -> dict:
+        return {
+            "workers": sorted(self.ring.workers),
+            "loads": dict(self.loads),
+        }
+
+    async def stop_monitoring(self):
+        if self._pump is not None:
+            self._pump.cancel()
+        for name in list(self.processes):
+            self.inboxes[name].put(("stop",))
+        for process in self.processes.values():
+            await asyncio.to_thread(process.join, 10)
+        self.processes.clear()
+        self.inboxes.clear()
+        self.loads.clear()
+        self.ring = HashRing()
+        if self.forward_alerts in alert_index.subscribers:
+            alert_index.subscribers.remove(self.forward_alerts)
+        if self.forward_signals in subscription_index.subscribers:
+            subscription_index.subscribers.remove(self.forward_signals)
+        if self.forward_config in self.config_cache.subscribers:
+            self.config_cache.subscribers.remove(self.forward_config)
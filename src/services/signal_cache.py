@@ -0,0 +1,106 @@
+import asyncio
+
+import numpy as np
+from cachetools import LRUCache
+
+from src.services.compute import compute_executor
+from src.services.indicator_state import IndicatorStateStore
+from src.services.kernel_tuning import kernel_params
+from src.services.signal_result import SignalResult, analyse_signal
+from src.utils import last_closed_candle
+
+SIGNAL_CACHE_SIZE = 4096
+MAX_CONCURRENT_STATES = 10  # States brought up to date (and fetched) at once
+
+
+class SignalCache:
+    """
+    SignalResult per (symbol, timeframe, last closed candle)
+
+    /signal, /chart and SignalService all read through this cache, so a
+    (symbol, timeframe) is analysed once per candle no matter how many users
+    or commands ask for it. Misses are computed from the IndicatorState,
+    which only fetches the candles closed since its last update.
+    """
+
+    def __init__(
+        self, indicator_states: IndicatorStateStore, maxsize: int = SIGNAL_CACHE_SIZE
+    ):
+        self.indicator_states = indicator_states
+        self.results = LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def peek(
+        self, symbol: str, timeframe: str, now: float | None = None
+    ) -> SignalResult | None:
+        """Return the result of the latest closed candle if already computed"""
+        return self.results.get((symbol, timeframe, last_closed_candle(timeframe, now)))
+
+    async def get(self, price_bot, symbol: str, timeframe: str) -> SignalResult | None:
+        """
+        Return the result of the latest closed candle, None if there is no data
+
+        Raises the exception of the analysis if it failed.
+        """
+        result = (await self.get_many(price_bot, [symbol], timeframe))[symbol]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def get_many(self, price_bot, symbols: list[str], timeframe: str) -> dict:
+        """
+        Return the results of several symbols, analysing the misses in batches
+
+        Returns:
+            dict: Per symbol, the SignalResult, None if there is no data, or
+            the raised exception if the analysis failed
+        """
+        results = {}
+        missing = []
+        for symbol in dict.fromkeys(symbols):
+            result = self.peek(symbol, timeframe)
+            if result is None:
+                missing.append(symbol)
+            else:
+                results[symbol] = result
+        self.hits += len(results)
+        self.misses += len(missing)
+        if not missing:
+            return results
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_STATES)
+
+        async def get_state(symbol):
+            async with semaphore:
+                return await self.indicator_states.get(price_bot, symbol, timeframe)
+
+        states = await asyncio.gather(*(get_state(symbol) for symbol in missing))
+        items = []
+        for symbol, state in zip(missing, states):
+            if state is None:
+                results[symbol] = None
+                continue
+            # Snapshot the state here, the workers never see it change
+            items.append(
+                (
+                    state.indicators(),
+                    np.array(state.kernel_closes),
+                    symbol,
+                    timeframe,
+                    state.last_timestamp,
+                    state.exchange,
+                    *kernel_params.get(symbol, timeframe),
+                )
+            )
+
+        computed = await compute_executor.map_batches(analyse_signal, items)
+        for item, result in zip(items, computed):
+            symbol = item[2]
+            if not isinstance(result, Exception):
+                self.results[(symbol, timeframe, result.candle_time)] = result
+            results[symbol] = result
+        return results
+
+    def stats(self) -> dict:
+        return {"size": len(self.results), "hits": self.hits, "misses": self.misses}
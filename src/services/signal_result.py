@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.services.indicator_engine import obv_slope, overall_vote, signal_votes
+from src.services.kernel_tuning import DEFAULT_BANDWIDTH, DEFAULT_KERNEL
+from src.services.MultiKernelRegression import latest_kernel_signal
+
+SIGNAL_NAMES = {1: "bullish", -1: "bearish", 0: "neutral"}
+
+
+@dataclass(frozen=True, slots=True)
+class SignalResult:
+    """
+    Analytics of one (symbol, timeframe) at one closed candle
+
+    Signals are 1 (bullish), -1 (bearish) or 0 (neutral). Nothing here is
+    formatted, see format_signal_message and format_confluence_message.
+    """
+
+    symbol: str
+    timeframe: str
+    candle_time: int  # Open time in ms of the candle the result is computed at
+    close: float
+    signals: dict[str, int]
+    values: dict[str, float]  # Value behind each signal, NaN when there is none
+    overall: int
+    confidence: float
+    kernel_up: bool = False
+    kernel_down: bool = False
+    exchange: str | None = None
+
+    @property
+    def overall_name(self) -> str:
+        return SIGNAL_NAMES[self.overall]
+
+
+def build_signal_result(
+    indicators: dict,
+    symbol: str,
+    timeframe: str,
+    candle_time: int,
+    exchange: str | None = None,
+    kernel_signal: tuple[bool, bool] = (False, False),
+) -> SignalResult:
+    """
+    Build the result from the indicator arrays of a single series
+
+    Args:
+        indicators: compute_indicators or IndicatorState.indicators output,
+            the last bar being the candle at candle_time
+        symbol, timeframe, exchange: What the indicators were computed on
+        candle_time: Open time in ms of the last bar
+        kernel_signal: (signal_up, signal_down) of the kernel regression
+    """
+    if "obv_slope" not in indicators:
+        indicators = {**indicators, "obv_slope": obv_slope(indicators["obv"])}
+    # Only the MACD cross looks one bar back
+    latest = {name: values[-2:] for name, values in indicators.items()}
+    votes = signal_votes(latest)
+    overall, confidence = overall_vote(votes)
+
+    values = {
+        "MACD": latest["macd"][-1] - latest["macd_signal"][-1],
+        "RSI": latest["rsi"][-1],
+        "Bollinger": np.nan,
+        "OBV": latest["obv_slope"][-1],
+        "STOCH": latest["stoch"][-1],
+        "MFI": latest["mfi"][-1],
+    }
+    return SignalResult(
+        symbol=symbol,
+        timeframe=timeframe,
+        candle_time=int(candle_time),
+        close=float(latest["close"][-1]),
+        signals={name: int(vote[-1]) for name, vote in votes.items()},
+        values={name: float(value) for name, value in values.items()},
+        overall=int(overall[-1]),
+        confidence=float(confidence[-1]),
+        kernel_up=bool(kernel_signal[0]),
+        kernel_down=bool(kernel_signal[1]),
+        exchange=exchange,
+    )
+
+
+def analyse_signal(
+    indicators: dict,
+    closes,
+    symbol: str,
+    timeframe: str,
+    candle_time: int,
+    exchange: str | None = None,
+    bandwidth: int = DEFAULT_BANDWIDTH,
+    kernel_type: str = DEFAULT_KERNEL,
+) -> SignalResult:
+    """
+    Indicator votes and kernel regression signal of the last closed candle
+
+    SignalService used to read the kernel signal right after the candle
+    closed, from the closes plus the candle that just opened. That open
+    candle is taken at the last close here, so the result only depends on
+    closed candles and stays the same for the whole bar.
+
+    Args:
+        indicators: Indicator arrays, the last bar being the candle at candle_time
+        closes: Trailing closed-candle prices, oldest first
+        symbol, timeframe, exchange: What the indicators were computed on
+        candle_time: Open time in ms of the last closed candle
+        bandwidth, kernel_type: Kernel regression parameters
+    """
+    closes = np.asarray(closes, dtype=float)
+    kernel_signal = (False, False)
+    if len(closes) >= 3:
+        kernel_signal = latest_kernel_signal(
+            np.append(closes, closes[-1]), bandwidth, kernel_type
+        )
+    return build_signal_result(
+        indicators, symbol, timeframe, candle_time, exchange, kernel_signal
+    )
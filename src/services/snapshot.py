@@ -0,0 +1,30 @@
+from datetime import UTC, datetime
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+SNAPSHOT_INTERVAL = 60  # Seconds between two snapshots of a service
+
+
+class SnapshotStore:
+    """
+    In-memory state of the services in db.service_state, one document each
+
+    A service saves its snapshot periodically and when it stops, and
+    restores it when it starts, so a restart neither refetches everything
+    at once nor repeats alerts. The state must only hold BSON types, with
+    string keys.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    async def save(self, name: str, state: dict):
+        await self.db.service_state.update_one(
+            {"_id": name},
+            {"$set": {"state": state, "saved_at": datetime.now(UTC)}},
+            upsert=True,
+        )
+
+    async def load(self, name: str) -> dict | None:
+        doc = await self.db.service_state.find_one({"_id": name})
+        return doc["state"] if doc else None
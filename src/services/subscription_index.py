@@ -0,0 +1,85 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+SIGNAL_TIMEFRAMES = ["15m", "2h", "4h", "1d"]
+
+
+def normalize_monitor(monitor) -> dict:
+    """
+    A signal monitor as {"symbol", "timeframes"}
+
+    Monitors stored before timeframes could be chosen are plain symbol
+    strings, they watch every SIGNAL_TIMEFRAMES.
+    """
+    if isinstance(monitor, str):
+        return {"symbol": monitor, "timeframes": list(SIGNAL_TIMEFRAMES)}
+    return {
+        "symbol": monitor["symbol"],
+        "timeframes": list(monitor.get("timeframes") or SIGNAL_TIMEFRAMES),
+    }
+
+
+class SubscriptionIndex:
+    """
+    Signal monitors of every chat, indexed as timeframe -> symbol -> chats
+
+    A candle close of a timeframe only touches the symbols someone monitors
+    on that timeframe. Like the AlertIndex, it is loaded once at startup and
+    kept in sync by SignalService.add_monitor / delete_monitor.
+    """
+
+    def __init__(self):
+        self.index: dict[str, dict[str, set[int]]] = {}
+        self.chats: dict[int, list[dict]] = {}
+        # Called with (chat_id, monitors) on every edit made by a user
+        self.subscribers: list = []
+
+    async def load(self, db: AsyncIOMotorDatabase, owns=None):
+        """Load the monitors of every chat, or of the chats `owns` is true for"""
+        self.index.clear()
+        self.chats.clear()
+        chats = {}
+        async for doc in db.signal_monitors.find(
+            {}, {"_id": 0, "chat_id": 1, "symbol": 1, "timeframes": 1}
+        ):
+            if owns is None or owns(doc["chat_id"]):
+                chats.setdefault(doc.pop("chat_id"), []).append(doc)
+        for chat_id, monitors in chats.items():
+            self.replace_chat(chat_id, monitors)
+
+    def replace_chat(self, chat_id: int, monitors: list):
+        """Index the current monitor list of a chat, replacing its previous one"""
+        self.remove_chat(chat_id)
+        monitors = [normalize_monitor(monitor) for monitor in monitors]
+        if monitors:
+            self.chats[chat_id] = monitors
+        for monitor in monitors:
+            for timeframe in monitor["timeframes"]:
+                symbols = self.index.setdefault(timeframe, {})
+                symbols.setdefault(monitor["symbol"], set()).add(chat_id)
+
+    def update_chat(self, chat_id: int, monitors: list):
+        """replace_chat for an edit made by the user, passed on to the subscribers"""
+        self.replace_chat(chat_id, monitors)
+        for subscriber in self.subscribers:
+            subscriber(chat_id, monitors)
+
+    def remove_chat(self, chat_id: int):
+        for monitor in self.chats.pop(chat_id, []):
+            for timeframe in monitor["timeframes"]:
+                symbols = self.index[timeframe]
+                chats = symbols[monitor["symbol"]]
+                chats.discard(chat_id)
+                if not chats:
+                    del symbols[monitor["symbol"]]
+                if not symbols:
+                    del self.index[timeframe]
+
+    def chat_monitors(self, chat_id: int) -> list[dict]:
+        return self.chats.get(chat_id, [])
+
+    def subscriptions(self, timeframe: str) -> dict[str, set[int]]:
+        """Chats monitoring every symbol on the timeframe"""
+        return self.index.get(timeframe, {})
+
+
+subscription_index = SubscriptionIndex()
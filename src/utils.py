@@ -1,7 +1,10 @@
 from datetime import datetime
 from functools import wraps
+import re
 import time
 
+from tabulate import tabulate
+
 
 def symbol_complete(symbol: str) -> str:
     """Complete the symbol with /USDT if not present"""
@@ -9,6 +12,29 @@ def symbol_complete(symbol: str) -> str:
     return result.upper()
 
 
+TIMEFRAME_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+# Weekly candles open on Monday 00:00 UTC, the epoch was a Thursday
+TIMEFRAME_OFFSETS = {"w": 4 * 86400}
+
+
+def is_timeframe(timeframe: str) -> bool:
+    """Whether the timeframe, e.g. '15m' or '1w', is one timeframe_to_seconds knows"""
+    return re.fullmatch(rf"[1-9]\d*[{''.join(TIMEFRAME_UNITS)}]", timeframe) is not None
+
+
+def timeframe_to_seconds(timeframe: str) -> int:
+    """Convert a timeframe like '15m', '4h', '1d' or '1w' to seconds"""
+    return int(timeframe[:-1]) * TIMEFRAME_UNITS[timeframe[-1]]
+
+
+def last_closed_candle(timeframe: str, now: float | None = None) -> int:
+    """Open time in ms of the latest closed candle of the timeframe (UTC aligned)"""
+    seconds = timeframe_to_seconds(timeframe)
+    offset = TIMEFRAME_OFFSETS.get(timeframe[-1], 0)
+    now = time.time() if now is None else now
+    return ((int((now - offset) // seconds) - 1) * seconds + offset) * 1000
+
+
 def time_it(func):
     @wraps(func)
     def timeit_wrapper(*args, **kwargs):
@@ -38,7 +64,7 @@ def format_price_message(data: dict) -> str:
     # Header with current price and basic info
     message = (
         f"💰 {data['symbol']} Price Information\n"
-        f"📅 {datetime.fromtimestamp(data['timestamp']/1000).strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n"
+        f"📅 {datetime.fromtimestamp(data['timestamp'] / 1000).strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n"
         f"Current Price: ${data['current_price']:,.4f}\n"
         f"24h Range: ${data['low_24h']:,.4f} - ${data['high_24h']:,.4f}\n"
         f"24h Volume: ${data['volume']:,.2f}\n\n"
@@ -60,3 +86,92 @@ def format_price_message(data: dict) -> str:
         message += f"\n📊 Spread: ${spread:.2f} ({spread_pct:.3f}%)"
 
     return message
+
+
+SIGNAL_EMOJIS = {1: "🟢", -1: "🔴", 0: "⚪"}
+
+
+def _signal_details(name: str, signal: int, value: float) -> str:
+    if name == "MACD":
+        cross = {1: "Line crossed above", -1: "Line crossed below", 0: "no cross"}
+        return f"{cross[signal]} Signal Line"
+    if name == "Bollinger":
+        bands = {1: "below lower band", -1: "above upper band", 0: "within bands"}
+        return bands[signal]
+    names = {1: "bullish", -1: "bearish", 0: "neutral"}
+    if name in ("RSI", "MFI"):
+        names = {1: "oversold", -1: "overbought", 0: "neutral"}
+    if name == "OBV":
+        return f"Slope: {value:.2f} ({names[signal]})"
+    return f"{value:.2f} ({names[signal]})"
+
+
+def format_signal_message(result) -> str:
+    """Format a SignalResult into the /signal message"""
+    labels = {
+        "MACD": "MACD",
+        "RSI": "RSI(14)",
+        "Bollinger": "BBands",
+        "OBV": "OBV",
+        "STOCH": "STOCH",
+        "MFI": "MFI(14)",
+    }
+    message = [
+        f"💰 Price: ${result.close:.4f} USDT",
+        f"📊 Signal: {SIGNAL_EMOJIS[result.overall]} {result.overall_name.upper()}",
+        f"🎯 Confidence: {result.confidence:.1%}\n",
+    ]
+    for name, signal in result.signals.items():
+        details = _signal_details(name, signal, result.values[name])
+        message.append(f"{SIGNAL_EMOJIS[signal]} {labels[name]}: {details}")
+
+    if result.kernel_up:
+        message.append("📈 Kernel regression turned up")
+    elif result.kernel_down:
+        message.append("📉 Kernel regression turned down")
+    return "\n".join(message)
+
+
+def format_candle_event(event) -> str:
+    """Format a CandleEvent from the candle close watcher"""
+    exchange = event.exchange.capitalize()
+    if event.kind == "pinbar":
+        emoji = "🟢" if event.side == "bullish" else "🔴"
+        return (
+            f"🕯 {emoji} {exchange}: {event.side.capitalize()} pinbar on "
+            f"{event.symbol}: {event.price} in timeframe {event.timeframe}"
+        )
+    emoji, direction = ("📈", "up") if event.side == "bullish" else ("📉", "down")
+    return (
+        f"{emoji} {exchange}: Signal for {event.symbol}: {event.price} "
+        f"in timeframe {event.timeframe} is {direction}"
+    )
+
+
+def format_confluence_message(results: dict) -> str:
+    """Format the SignalResult of every timeframe into a confluence table"""
+    timeframes = list(results)
+    indicators = list(next(iter(results.values())).signals)
+
+    table_body = [
+        [name] + [SIGNAL_EMOJIS[results[tf].signals[name]] for tf in timeframes]
+        for name in indicators
+    ]
+    table_body.append(
+        ["Overall"] + [SIGNAL_EMOJIS[results[tf].overall] for tf in timeframes]
+    )
+    table_body.append(
+        ["Conf."] + [f"{results[tf].confidence:.0%}" for tf in timeframes]
+    )
+    table = tabulate(table_body, headers=[""] + timeframes, tablefmt="simple")
+
+    bullish = sum(result.overall == 1 for result in results.values())
+    bearish = sum(result.overall == -1 for result in results.values())
+    if bullish > bearish:
+        verdict = f"🟢 BULLISH on {bullish}/{len(timeframes)} timeframes"
+    elif bearish > bullish:
+        verdict = f"🔴 BEARISH on {bearish}/{len(timeframes)} timeframes"
+    else:
+        verdict = "⚪ NO CONFLUENCE"
+
+    return f"📊 Confluence: {verdict}\n<pre>{table}</pre>"